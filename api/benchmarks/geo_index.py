@@ -0,0 +1,67 @@
+import random
+import time
+
+from controllers.matchmaking import _calculate_distance_miles
+from services.geo import GeoGridIndex
+
+"""
+BENCHMARK FOR THE GRID INDEX IN 'services/geo.py'. COMPARES SCANNING EVERY QUEUED HOST WITH HAVERSINE AGAINST
+ONLY SCANNING THE HOSTS IN THE GRID CELLS AROUND THE GUEST, AS THE QUEUE GROWS.
+
+RUN FROM THE /api FOLDER WITH 'python -m benchmarks.geo_index'
+"""
+
+QUEUE_SIZES = [1_000, 10_000, 100_000]
+GUESTS = 50
+MAX_DISTANCE = 25
+
+# Guests are in the New York metro, which always has the same number of hosts,
+# while the rest of the queue grows across the continental US
+US_BOUNDS = ((25.0, 49.0), (-124.0, -67.0))
+METRO = (40.7128, -74.0060)
+METRO_HOSTS = 500
+
+
+def _metro_point(rng: random.Random) -> tuple[float, float]:
+    return (METRO[0] + rng.uniform(-0.3, 0.3), METRO[1] + rng.uniform(-0.3, 0.3))
+
+
+def _us_point(rng: random.Random) -> tuple[float, float]:
+    (lat_min, lat_max), (lon_min, lon_max) = US_BOUNDS
+    return (rng.uniform(lat_min, lat_max), rng.uniform(lon_min, lon_max))
+
+
+def _in_range(guest, coords, uids):
+    return sum(1 for uid in uids if _calculate_distance_miles(*guest, *coords[uid]) <= MAX_DISTANCE)
+
+
+def main():
+    rng = random.Random(484)
+    guests = [_metro_point(rng) for _ in range(GUESTS)]
+
+    print(f"{'hosts':>8} | {'scan us/guest':>14} | {'grid us/guest':>14} | {'scanned/guest':>14} | {'in range/guest':>14}")
+    for size in QUEUE_SIZES:
+        coords = {i: _metro_point(rng) if i < METRO_HOSTS else _us_point(rng) for i in range(size)}
+        index = GeoGridIndex()
+        for uid, point in coords.items():
+            index.add(uid, point)
+
+        start = time.perf_counter()
+        scan_hits = sum(_in_range(guest, coords, coords) for guest in guests)
+        scan_us = (time.perf_counter() - start) / GUESTS * 1e6
+
+        scanned = 0
+        start = time.perf_counter()
+        grid_hits = 0
+        for guest in guests:
+            candidates = index.query(guest, MAX_DISTANCE)
+            scanned += len(candidates)
+            grid_hits += _in_range(guest, coords, candidates)
+        grid_us = (time.perf_counter() - start) / GUESTS * 1e6
+
+        assert scan_hits == grid_hits, "grid index dropped a host that was in range"
+        print(f"{size:>8} | {scan_us:>14.0f} | {grid_us:>14.0f} | {scanned / GUESTS:>14.1f} | {grid_hits / GUESTS:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import asyncio
+import sys
+import time
+import uuid
+
+from sqlalchemy import make_url, text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from controllers.matchmaking import GET_MATCH_PROFILE_STMT, GET_QUEUE_STMT, USER_IN_QUEUE_STMT
+from controllers.preferences import GET_USER_PREFS_STMT
+from controllers.profile import GET_PROFILE_STMT
+from controllers.session import GET_ACTIVE_SESSION_BY_ID_STMT, GET_ACTIVE_SESSION_STMT
+from controllers.user import GET_USER_STMT, USER_EXISTS_STMT
+from middleware.identity import IDENTITY_STMT
+from models.db import ASYNC_DATABASE_URL, SessionLocal
+from models.query_stats import query_stats, reset_query_stats
+
+"""
+BENCHMARK FOR THE MODULE LEVEL 'text()' STATEMENTS OF THE 10 MOST FREQUENT CONTROLLER QUERIES (AUTH / EXISTENCE
+CHECKS, QUEUE POLLS, SESSION LOOKUPS, PROFILE READS).
+
+WITHOUT ARGUMENTS IT ONLY MEASURES WHAT EACH CALL USED TO PAY BEFORE REACHING THE DRIVER: BUILDING THE 'text()'
+(PARSING ITS :params) AND ITS CACHE KEY, AGAINST REUSING THE MODULE LEVEL ONE.
+WITH A UID IT ALSO RUNS THE QUERIES AGAINST THE DATABASE FROM .env: INLINE vs MODULE LEVEL THROUGH psycopg2 (WITH THE
+PREPARE / DB SPLIT FROM 'models/query_stats.py'), AND THROUGH asyncpg WITH ITS PREPARED STATEMENT CACHE OFF vs ON.
+RUN FROM THE /api FOLDER WITH 'python -m benchmarks.hot_queries [uid]'
+"""
+
+ROUNDS = 200
+BUILD_ROUNDS = 20000
+
+
+def _hot_queries(uid: str) -> dict:
+    """name -> (module level statement, params)"""
+    return {
+        "user_exists": (USER_EXISTS_STMT, {"id": uid}),
+        "get_user": (GET_USER_STMT, {"uid": uid}),
+        "user_in_queue": (USER_IN_QUEUE_STMT, {"uid": uid}),
+        "get_queue": (GET_QUEUE_STMT, {"uid": uid}),
+        "match_profile": (GET_MATCH_PROFILE_STMT, {"uid": uid}),
+        "active_session": (GET_ACTIVE_SESSION_STMT, {"uid": uid}),
+        "session_by_id": (GET_ACTIVE_SESSION_BY_ID_STMT, {"session_id": str(uuid.uuid4())}),
+        "identity": (IDENTITY_STMT, {"uid": uid}),
+        "get_profile": (GET_PROFILE_STMT, {"tuid": uid}),
+        "user_prefs": (GET_USER_PREFS_STMT, {"uid": uid}),
+    }
+
+
+def _us_per_call(fn, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - start) * 1e6 / rounds
+
+
+def _build_costs(queries: dict):
+    print(f"Building the statement per call ({BUILD_ROUNDS} rounds)")
+    print(f"{'query':>15} | {'inline us':>9} | {'module us':>9}")
+    for name, (stmt, _) in queries.items():
+        inline = _us_per_call(lambda: text(stmt.text)._generate_cache_key(), BUILD_ROUNDS)
+        module = _us_per_call(lambda: stmt._generate_cache_key(), BUILD_ROUNDS)
+        print(f"{name:>15} | {inline:>9.2f} | {module:>9.2f}")
+
+
+def _sync_costs(queries: dict):
+    print(f"\npsycopg2, {ROUNDS} calls each (prepare = SQLAlchemy before the driver, db = driver + round trip)")
+    print(f"{'query':>15} | {'path':>6} | {'ms/call':>8} | {'prepare us':>10} | {'db ms':>7}")
+    db = SessionLocal()
+    try:
+        for name, (stmt, params) in queries.items():
+            for path in ("inline", "module"):
+                reset_query_stats()
+                build = (lambda: text(stmt.text)) if path == "inline" else (lambda: stmt)
+                elapsed = _us_per_call(lambda: db.execute(build(), params).fetchall(), ROUNDS) / 1e3
+                stats = query_stats()[0]
+                print(f"{name:>15} | {path:>6} | {elapsed:>8.3f} | {stats['avg_prepare_us']:>10.1f} | {stats['avg_db_ms']:>7.3f}")
+    finally:
+        db.rollback()
+        db.close()
+
+
+async def _async_costs(queries: dict):
+    print(f"\nasyncpg, {ROUNDS} calls each")
+    print(f"{'query':>15} | {'unprepared ms':>13} | {'prepared ms':>11}")
+    engines = {
+        size: create_async_engine(make_url(ASYNC_DATABASE_URL).update_query_dict({"prepared_statement_cache_size": str(size)}), connect_args={"ssl": "require"})
+        for size in (0, 100)
+    }
+    try:
+        results = {name: {} for name in queries}
+        for size, engine in engines.items():
+            async with engine.connect() as conn:
+                for name, (stmt, params) in queries.items():
+                    await conn.execute(stmt, params) # Warm up (prepares it once when the cache is on)
+                    start = time.perf_counter()
+                    for _ in range(ROUNDS):
+                        (await conn.execute(stmt, params)).fetchall()
+                    results[name][size] = (time.perf_counter() - start) * 1e3 / ROUNDS
+                await conn.rollback()
+        for name, result in results.items():
+            print(f"{name:>15} | {result[0]:>13.3f} | {result[100]:>11.3f}")
+    finally:
+        for engine in engines.values():
+            await engine.dispose()
+
+
+def main():
+    uid = sys.argv[1] if len(sys.argv) == 2 else str(uuid.uuid4())
+    queries = _hot_queries(uid)
+    _build_costs(queries)
+    if len(sys.argv) != 2:
+        print("\nPass a uid to also run the queries against the database")
+        return
+    _sync_costs(queries)
+    asyncio.run(_async_costs(queries))
+
+
+if __name__ == "__main__":
+    main()
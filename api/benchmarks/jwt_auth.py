@@ -0,0 +1,46 @@
+import time
+
+from jose import jwt
+
+from middleware.auth import SECRET, verify_jwt
+
+"""
+BENCHMARK FOR THE VERIFIED-CLAIMS CACHE IN 'middleware/auth.py'. AUTHENTICATES THE SAME TOKEN REPEATEDLY (LIKE A USER
+POLLING, OR A PHOTO REQUEST RUNNING BOTH 'auth_user' AND 'get_user_jwt') WITH A PLAIN 'jwt.decode' AND WITH 'verify_jwt'
+
+RUN FROM THE /api FOLDER WITH 'python -m benchmarks.jwt_auth'
+"""
+
+REQUESTS = 20_000
+USERS = [1, 100, 5_000] # Distinct tokens the requests are spread over
+
+
+def _token(i: int) -> str:
+    return jwt.encode(
+        {"sub": f"user-{i}", "aud": "authenticated", "exp": int(time.time()) + 3600},
+        SECRET,
+        algorithm="HS256",
+    )
+
+
+def main():
+    print(f"{'tokens':>8} | {'decode us/req':>14} | {'cached us/req':>14} | {'speedup':>8}")
+    for users in USERS:
+        tokens = [_token(i) for i in range(users)]
+        requests = [tokens[i % users] for i in range(REQUESTS)]
+
+        start = time.perf_counter()
+        for token in requests:
+            jwt.decode(token, SECRET, algorithms=["HS256"], audience="authenticated")
+        decode_us = (time.perf_counter() - start) * 1e6 / REQUESTS
+
+        start = time.perf_counter()
+        for token in requests:
+            verify_jwt(token)
+        cached_us = (time.perf_counter() - start) * 1e6 / REQUESTS
+
+        print(f"{users:>8} | {decode_us:>14.1f} | {cached_us:>14.1f} | {decode_us / cached_us:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
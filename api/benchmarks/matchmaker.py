@@ -0,0 +1,105 @@
+import random
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from controllers.matchmaking import MATCHMAKING_TIMEOUT_SECONDS
+from services.matchmaker import MatchmakingEngine, QueueEntry
+from services.scoring import build_columns, score_candidates
+
+"""
+BENCHMARK FOR THE MATCHMAKER'S PAIRING ('MatchmakingEngine._pair'). PAIRS SYNTHETIC QUEUES OF 200 / 1000 / 2000 (THE
+DEFAULT 'matchmaker_max_batch') / 5000 USERS WHERE EVERYONE IS COMPATIBLE, AND WHERE USERS HAVE RANDOM PREFERENCES AROUND
+ONE CITY. FOR EACH IT REPORTS HOW LONG ONE TICK'S PAIRING TAKES (IT HAS TO STAY WELL UNDER 'matchmaker_tick_seconds') AND
+ITS YIELD: HOW MANY PAIRS WERE MADE AND HOW MANY USERS WERE LEFT UNPAIRED ALTHOUGH A COMPATIBLE USER WAS LEFT UNPAIRED TOO
+(THOSE ARE RETRIED NEXT TICK).
+
+THE PREVIOUS PAIRING (EVERY USER'S 20 BEST EDGES, ONLY TOWARDS LATER USERS, TAKEN HEAVIEST FIRST) IS KEPT HERE FOR
+COMPARISON. NO DATABASE IS NEEDED. RUN FROM THE /api FOLDER WITH 'python -m benchmarks.matchmaker'
+"""
+
+QUEUE_SIZES = [200, 1000, 2000, 5000]
+GENDERS = ["g-male", "g-female", "g-nonbinary"]
+TOP_EDGES = 20
+
+
+def _queue(size: int, compatible: bool, rng: random.Random, now: datetime) -> list[QueueEntry]:
+    queue = []
+    for i in range(size):
+        enqueued_at = now - timedelta(seconds=rng.uniform(0, MATCHMAKING_TIMEOUT_SECONDS))
+        if compatible:
+            prefs, gender, age, coords = {}, None, 0, None
+        else:
+            age_min = rng.randint(18, 40)
+            prefs = {
+                "target_gender_id": rng.choice(GENDERS + [None]),
+                "age_min": age_min,
+                "age_max": age_min + rng.randint(0, 30),
+                "max_distance": rng.choice([5, 10, 25, 50, 100]),
+            }
+            gender, age = rng.choice(GENDERS), rng.randint(18, 60)
+            coords = (40 + rng.uniform(-1, 1), -74 + rng.uniform(-1, 1))
+        queue.append(QueueEntry(
+            uid=f"user-{i}", enqueued_at=enqueued_at, expires_at=now + timedelta(minutes=1),
+            prefs=prefs, profile={"gender_id": gender}, age=age, coords=coords,
+        ))
+    return queue
+
+
+def _pair_top_edges(queue: list[QueueEntry], now: datetime) -> list[tuple[QueueEntry, QueueEntry]]:
+    """The previous pairing, kept here for comparison."""
+    columns = build_columns([(e.prefs, e.profile.get("gender_id"), e.age, e.coords) for e in queue])
+    waits = np.array([(now - e.enqueued_at).total_seconds() for e in queue]) / MATCHMAKING_TIMEOUT_SECONDS
+    edges = []
+    for i in range(len(queue) - 1):
+        candidates = np.arange(i + 1, len(queue))
+        mask, score = score_candidates(columns.take([i]), columns.take(candidates))
+        candidates = candidates[mask]
+        weights = waits[i] + waits[candidates] + score[mask]
+        if len(candidates) > TOP_EDGES:
+            best = np.argpartition(weights, -TOP_EDGES)[-TOP_EDGES:]
+            candidates, weights = candidates[best], weights[best]
+        edges.extend(zip(weights, [i] * len(candidates), candidates))
+
+    edges.sort(key=lambda edge: edge[0], reverse=True)
+    paired, pairs = set(), []
+    for _, i, j in edges:
+        if i not in paired and j not in paired:
+            paired.update((i, j))
+            pairs.append((queue[i], queue[j]))
+    return pairs
+
+
+def _missed(queue: list[QueueEntry], pairs: list[tuple[QueueEntry, QueueEntry]]) -> int:
+    """Unpaired users that have a compatible user among the other unpaired users."""
+    paired = {entry.uid for pair in pairs for entry in pair}
+    left = [e for e in queue if e.uid not in paired]
+    if len(left) < 2:
+        return 0
+    columns = build_columns([(e.prefs, e.profile.get("gender_id"), e.age, e.coords) for e in left])
+    missed = 0
+    for i in range(len(left)):
+        mask, _ = score_candidates(columns.take([i]), columns)
+        mask[i] = False
+        missed += bool(mask.any())
+    return missed
+
+
+def main():
+    engine = MatchmakingEngine()
+    now = datetime.utcnow()
+    print(f"{'queue':>6} | {'users':>10} | {'pairing':>9} | {'seconds':>8} | {'pairs':>6} | {'paired %':>8} | {'missed':>6}")
+    for compatible in (True, False):
+        for size in QUEUE_SIZES:
+            queue = _queue(size, compatible, random.Random(size), now)
+            for name, pair in (("top edges", _pair_top_edges), ("_pair", engine._pair)):
+                start = time.perf_counter()
+                pairs = pair(queue, now)
+                elapsed = time.perf_counter() - start
+                print(f"{size:>6} | {'compatible' if compatible else 'random':>10} | {name:>9} | {elapsed:>8.3f} | "
+                      f"{len(pairs):>6} | {200 * len(pairs) / size:>8.1f} | {_missed(queue, pairs):>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import asyncio
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+from PIL import Image
+from storage3 import AsyncStorageClient
+
+from models.db import AsyncSessionLocal, async_engine
+from services import async_storage
+from services.images import shutdown_image_pool
+from services.supabase import STORAGE_HTTP_LIMITS, STORAGE_HTTP_TIMEOUT, _user_headers
+from services.uploads import StagedUpload
+
+"""
+BENCHMARK FOR 'services/async_storage.py'. SENDS WAVES OF CONCURRENT PHOTO UPLOADS THROUGH THE PHOTO SERVICE AND
+REPORTS THE THROUGHPUT AND LATENCY AT EACH CONCURRENCY, TO SEE WHERE IT SATURATES.
+
+STORAGE IS A LOCAL FAKE SERVER ANSWERING AFTER STORAGE_LATENCY_MS, THE DATABASE IS THE ONE FROM .env. EVERY UPLOAD
+RUNS IN ITS OWN TRANSACTION THAT IS ROLLED BACK, SO NOTHING IS KEPT; THE USER NEEDS LESS THAN 6 PHOTOS.
+RUN FROM THE /api FOLDER WITH 'python -m benchmarks.photo_service <uid>'
+"""
+
+CONCURRENCY = [8, 32, 128]
+REQUESTS = 256
+STORAGE_LATENCY_MS = 40
+
+
+class _FakeStorage(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _reply(self, payload):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        time.sleep(STORAGE_LATENCY_MS / 1e3)
+        data = json.dumps(payload(body)).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        if "/object/sign/" in self.path:
+            self._reply(lambda body: [{"path": p, "signedURL": f"/object/sign/{p}?token=x", "error": None} for p in json.loads(body)["paths"]])
+        else:
+            self._reply(lambda body: {"Key": self.path})
+
+    def do_DELETE(self):
+        self._reply(lambda body: [])
+
+    def log_message(self, *args):
+        pass
+
+
+def _staged_photo() -> StagedUpload:
+    buffer = io.BytesIO()
+    Image.new("RGB", (1200, 900), "teal").save(buffer, format="JPEG")
+    fd, path = tempfile.mkstemp(prefix="bench-")
+    with os.fdopen(fd, "wb") as out:
+        out.write(buffer.getvalue())
+    return StagedUpload(path=path, size_bytes=buffer.tell(), sha256="0" * 64, mime_type="image/jpeg")
+
+
+async def _async(uid: str, upload: StagedUpload, url: str, http: httpx.AsyncClient):
+    client = AsyncStorageClient(url, headers=_user_headers("bench"), http_client=http)
+    async with AsyncSessionLocal() as db:
+        try:
+            await async_storage.upload_profile_photo(uid=uid, upload=upload, storage=client, db=db)
+        finally:
+            await db.rollback()
+
+
+async def _wave(request, concurrency: int) -> tuple[float, list[float]]:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def timed():
+        async with semaphore:
+            start = time.perf_counter()
+            await request()
+            latencies.append((time.perf_counter() - start) * 1e3)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(timed() for _ in range(REQUESTS)))
+    return REQUESTS / (time.perf_counter() - start), latencies
+
+
+async def _main(uid: str):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _FakeStorage)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/storage/v1/"
+    http = httpx.AsyncClient(limits=STORAGE_HTTP_LIMITS, timeout=STORAGE_HTTP_TIMEOUT)
+    upload = _staged_photo()
+
+    print(f"{REQUESTS} uploads per run, storage answers after {STORAGE_LATENCY_MS} ms")
+    print(f"{'concurrency':>11} | {'uploads/s':>9} | {'p50 ms':>8} | {'p99 ms':>8}")
+    try:
+        # Warm up the image pool and the connection pools
+        await _async(uid, upload, url, http)
+
+        for concurrency in CONCURRENCY:
+            throughput, latencies = await _wave(lambda: _async(uid, upload, url, http), concurrency)
+            p50, p99 = statistics.quantiles(latencies, n=100)[49], statistics.quantiles(latencies, n=100)[98]
+            print(f"{concurrency:>11} | {throughput:>9.1f} | {p50:>8.1f} | {p99:>8.1f}")
+    finally:
+        upload.close()
+        await http.aclose()
+        await async_engine.dispose()
+        shutdown_image_pool()
+        server.shutdown()
+
+
+def main():
+    if len(sys.argv) != 2:
+        sys.exit("usage: python -m benchmarks.photo_service <uid>")
+    asyncio.run(_main(sys.argv[1]))
+
+
+if __name__ == "__main__":
+    main()
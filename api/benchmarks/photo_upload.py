@@ -0,0 +1,83 @@
+import asyncio
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from fastapi import UploadFile
+
+from services.uploads import stage_upload
+
+"""
+BENCHMARK FOR 'services/uploads.py'. HANDLES 100 CONCURRENT 10 MB UPLOADS THE OLD WAY ('await photo.read()' AND
+PASSING THE BYTES ON) AND THE STAGED WAY (CHUNKED COPY TO A TEMP FILE, THEN READ BACK IN CHUNKS THE WAY THE STORAGE
+CLIENT STREAMS IT) AND REPORTS THE PEAK RSS OF EACH. STORAGE ITSELF IS SIMULATED, NOTHING IS SENT ANYWHERE.
+
+EACH MODE RUNS IN ITS OWN PROCESS SO THE PEAKS DON'T MIX. RUN FROM THE /api FOLDER WITH 'python -m benchmarks.photo_upload'
+"""
+
+UPLOADS = 100
+UPLOAD_MB = 10
+STREAM_CHUNK_BYTES = 64 * 1024 # httpx reads file bodies in chunks of this size
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _upload_file() -> UploadFile:
+    """An UploadFile the way Starlette hands it over: spooled to disk past 1 MB."""
+    spooled = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    chunk = os.urandom(1024 * 1024)
+    for _ in range(UPLOAD_MB):
+        spooled.write(chunk)
+    spooled.seek(0)
+    return UploadFile(file=spooled, size=UPLOAD_MB * 1024 * 1024, headers={"content-type": "image/jpeg"})
+
+
+async def _buffered(upload: UploadFile):
+    data = await upload.read()
+    await asyncio.sleep(0.5) # The storage call, holding the bytes
+    return len(data)
+
+
+async def _staged(upload: UploadFile):
+    with await stage_upload(upload, max_bytes=UPLOAD_MB * 1024 * 1024) as staged:
+        with staged.open() as file:
+            while file.read(STREAM_CHUNK_BYTES):
+                pass
+        await asyncio.sleep(0.5)
+        return staged.size_bytes
+
+
+def _run(mode: str):
+    uploads = [_upload_file() for _ in range(UPLOADS)]
+    baseline = _peak_rss_mb()
+    handler = _buffered if mode == "buffered" else _staged
+
+    start = time.perf_counter()
+    asyncio.run(_gather(handler, uploads))
+    elapsed = time.perf_counter() - start
+    print(f"{mode:>9} | {baseline:>12.0f} | {_peak_rss_mb():>12.0f} | {_peak_rss_mb() - baseline:>10.0f} | {elapsed:>6.2f}")
+
+
+async def _gather(handler, uploads):
+    return await asyncio.gather(*(handler(upload) for upload in uploads))
+
+
+def main():
+    if len(sys.argv) == 2:
+        _run(sys.argv[1])
+        return
+
+    print(f"{UPLOADS} concurrent uploads of {UPLOAD_MB} MB")
+    print(f"{'mode':>9} | {'baseline MB':>12} | {'peak RSS MB':>12} | {'growth MB':>10} | {'secs':>6}")
+    for mode in ("buffered", "staged"):
+        subprocess.run([sys.executable, "-m", "benchmarks.photo_upload", mode], check=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import asyncio
+import random
+import time
+
+from services.presence import PresenceService
+from services.sockets import socket_registry
+
+"""
+BENCHMARK FOR 'services/presence.py'. SIMULATES USERS ON FLAKY CONNECTIONS (EVERY ONE DROPS AND RECONNECTS A FEW TIMES,
+SOMETIMES WITHIN THE GRACE WINDOW, SOMETIMES AFTER IT) AND COUNTS THE WRITES TO 'users.users': ONE UPDATE (PLUS A
+SELECT AND A COMMIT) PER CONNECT / DISCONNECT LIKE THE SOCKET HANDLERS USED TO DO, AGAINST THE PRESENCE BATCHES.
+
+NO POSTGRES IS NEEDED, THE BATCHES ARE RECORDED INSTEAD OF WRITTEN. TIMES ARE SCALED DOWN (SECONDS -> 1/100 SECONDS).
+RUN FROM THE /api FOLDER WITH 'python -m benchmarks.presence'
+"""
+
+USERS = 500
+FLAPS_PER_USER = 10
+SCALE = 0.01 # 1 simulated second = 10 ms
+GRACE_SECONDS = 5
+FLUSH_SECONDS = 1
+RECONNECT_AFTER_SECONDS = (0.5, 15) # A dropped socket comes back after this long (uniform)
+
+
+async def _user(uid: str, presence: PresenceService, rng: random.Random):
+    for flap in range(FLAPS_PER_USER):
+        sid = f"{uid}:{flap}"
+        await socket_registry.add(uid, sid)
+        presence.connected(uid)
+        await asyncio.sleep(rng.uniform(1, 30) * SCALE)
+        await socket_registry.remove(sid)
+        if not await socket_registry.is_connected(uid):
+            presence.disconnected(uid)
+        await asyncio.sleep(rng.uniform(*RECONNECT_AFTER_SECONDS) * SCALE)
+
+
+async def _main():
+    presence = PresenceService(grace_seconds=GRACE_SECONDS * SCALE, flush_seconds=FLUSH_SECONDS * SCALE)
+    batches = []
+    presence._write = lambda changes: batches.append(len(changes))
+    rng = random.Random(0)
+
+    start = time.perf_counter()
+    await presence.start()
+    await asyncio.gather(*(_user(f"user-{i}", presence, rng) for i in range(USERS)))
+    await presence.stop()
+    elapsed = time.perf_counter() - start
+
+    events = presence.stats["connects"] + presence.stats["disconnects"]
+    print(f"{USERS} users, {FLAPS_PER_USER} connects each, {elapsed / SCALE:.0f} simulated seconds")
+    print(f"{'':>14} | {'statements':>10} | {'commits':>8} | {'rows written':>12}")
+    print(f"{'per event':>14} | {events * 2:>10} | {events:>8} | {events:>12}")
+    print(f"{'presence':>14} | {len(batches):>10} | {len(batches):>8} | {sum(batches):>12}")
+    print(f"reconnects within the grace window (nothing written): {presence.stats['debounced']}")
+
+
+def main():
+    asyncio.run(_main())
+
+
+if __name__ == "__main__":
+    main()
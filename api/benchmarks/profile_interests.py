@@ -0,0 +1,72 @@
+import sys
+import time
+
+from sqlalchemy import event, text
+
+from models.db import SessionLocal, engine
+from controllers.interests import _update_profile_interests, _delete_profile_interests
+from services.lookups import lookups
+
+"""
+BENCHMARK FOR '_update_profile_interests'. SAVES 1, 10 AND 50 INTERESTS FOR A USER WITH THE SET-BASED WRITER AND WITH
+THE OLD ROW-BY-ROW PATH (A SELECT PER NAME, DELETE EVERYTHING, AN INSERT PER INTEREST) AND COUNTS THE ROUND TRIPS.
+
+NEEDS THE DATABASE FROM .env AND AN EXISTING USER. EVERYTHING RUNS INSIDE A TRANSACTION THAT IS ROLLED BACK.
+RUN FROM THE /api FOLDER WITH 'python -m benchmarks.profile_interests <uid>'
+"""
+
+INTEREST_COUNTS = [1, 10, 50]
+ROUNDS = 20
+
+
+def _update_profile_interests_rowwise(names: list[str], uid: str, db):
+    """The pre set-based implementation, kept here for comparison."""
+    interest_ids = [
+        db.execute(text("SELECT id FROM public.interests WHERE name = :name LIMIT 1"), {"name": name}).scalar()
+        for name in names
+    ]
+    _delete_profile_interests(uid=uid, db=db)
+    for interest_id in interest_ids:
+        db.execute(text("INSERT INTO profiles.interests (uid, interest_id) VALUES (:uid, :interest_id)"),
+                   {"uid": uid, "interest_id": interest_id})
+
+
+def main():
+    if len(sys.argv) != 2:
+        sys.exit("usage: python -m benchmarks.profile_interests <uid>")
+    uid = sys.argv[1]
+
+    statements = [0]
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _count(*args):
+        statements[0] += 1
+
+    db = SessionLocal()
+    try:
+        names = [row["name"] for row in lookups.rows("interests", db=db)]
+        print(f"{len(names)} interests available")
+        print(f"{'interests':>9} | {'path':>9} | {'ms/save':>8} | {'statements/save':>15}")
+
+        for count in INTEREST_COUNTS:
+            if count > len(names):
+                continue
+            # Alternate between two overlapping sets so each save adds and removes some interests
+            sets = [names[:count], names[len(names) - count:]]
+            for path in ("rowwise", "set-based"):
+                statements[0] = 0
+                start = time.perf_counter()
+                for i in range(ROUNDS):
+                    if path == "rowwise":
+                        _update_profile_interests_rowwise(sets[i % 2], uid, db)
+                    else:
+                        _update_profile_interests(sets[i % 2], uid=uid, db=db)
+                elapsed_ms = (time.perf_counter() - start) * 1e3 / ROUNDS
+                print(f"{count:>9} | {path:>9} | {elapsed_ms:>8.2f} | {statements[0] / ROUNDS:>15.1f}")
+    finally:
+        db.rollback()
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
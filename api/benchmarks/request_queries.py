@@ -0,0 +1,89 @@
+import sys
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from main import app
+from middleware.auth import auth_user
+from models.db import engine, get_db, get_read_db
+from services.lookups import lookups
+
+"""
+BENCHMARK FOR THE REQUEST SCOPED IDENTITY ('middleware/identity.py'). CALLS THE MAIN PRIVATE ENDPOINTS AS A USER AND
+COUNTS THE STATEMENTS EACH REQUEST SENDS TO THE DATABASE (LOOKUP TABLES ARE LOADED FIRST, LIKE ON STARTUP).
+
+NEEDS THE DATABASE FROM .env AND AN EXISTING USER WITH A PROFILE. EVERY REQUEST RUNS IN A SAVEPOINT OF ONE
+TRANSACTION THAT IS ROLLED BACK AT THE END, SO NOTHING IS KEPT.
+RUN FROM THE /api FOLDER WITH 'python -m benchmarks.request_queries <uid>'
+"""
+
+SAVEPOINT_STATEMENTS = ("SAVEPOINT", "RELEASE SAVEPOINT", "ROLLBACK TO SAVEPOINT") # The benchmark's own, not counted
+
+
+def _requests(client: TestClient) -> list[tuple[str, str, object]]:
+    """(method, path, json body) of the endpoints, bodies built from what the user already has"""
+    gender = lookups.rows("genders", db=None)[0]["name"] # Already loaded, no session needed
+    interests = [row["name"] for row in client.get("/profile/me/interests").json()]
+    return [
+        ("GET", "/user/me", None),
+        ("PUT", "/user/me/pause", None),
+        ("PUT", "/user/me/pause", None),
+        ("GET", "/user/me/preferences", None),
+        ("GET", "/profile/me", None),
+        ("GET", "/profile/me/gender", None),
+        ("PUT", "/profile/me/gender", {"gender": gender}),
+        ("GET", "/profile/me/orientation", None),
+        ("GET", "/profile/me/interests", None),
+        ("POST", "/profile/me/interests", interests),
+        ("GET", "/matchmaking/me/queue", None),
+        ("GET", "/matchmaking/me/session", None),
+        ("DELETE", "/matchmaking/me/session", None),
+    ]
+
+
+def main():
+    if len(sys.argv) != 2:
+        sys.exit("usage: python -m benchmarks.request_queries <uid>")
+    uid = sys.argv[1]
+    lookups.load()
+
+    conn = engine.connect()
+    outer = conn.begin()
+    statements = [0]
+
+    @event.listens_for(conn, "before_cursor_execute")
+    def _count(conn, cursor, statement, *args):
+        if not statement.startswith(SAVEPOINT_STATEMENTS):
+            statements[0] += 1
+
+    def _db():
+        db = Session(bind=conn, join_transaction_mode="create_savepoint")
+        try:
+            yield db
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    app.dependency_overrides[auth_user] = lambda: uid
+    app.dependency_overrides[get_db] = _db
+    app.dependency_overrides[get_read_db] = _db
+    client = TestClient(app)
+
+    print(f"{'endpoint':>32} | {'status':>6} | {'queries':>7}")
+    try:
+        for method, path, body in _requests(client):
+            statements[0] = 0
+            status = client.request(method, path, json=body).status_code
+            print(f"{method + ' ' + path:>32} | {status:>6} | {statements[0]:>7}")
+    finally:
+        outer.rollback()
+        conn.close()
+        app.dependency_overrides.clear()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import random
+import time
+
+import numpy as np
+
+from controllers.matchmaking import _are_preferences_compatible, _calculate_age_from_dob
+from services.geo import parse_location
+from services.scoring import build_columns, score_candidates
+
+"""
+BENCHMARK FOR 'services/scoring.py'. CHECKS ONE GUEST AGAINST N HOSTS WITH THE SCALAR '_are_preferences_compatible'
+AND WITH THE VECTORIZED 'score_candidates', AND ASSERTS THAT BOTH AGREE ON EVERY PAIR.
+
+RUN FROM THE /api FOLDER WITH 'python -m benchmarks.scoring'
+"""
+
+CANDIDATE_COUNTS = [20, 1_000, 100_000]
+GENDERS = ["g-male", "g-female", "g-nonbinary"]
+
+
+def _random_user(rng: random.Random) -> tuple[dict, dict]:
+    age_min = rng.randint(18, 40)
+    prefs = {
+        "target_gender_id": rng.choice(GENDERS + [None]),
+        "age_min": age_min,
+        "age_max": age_min + rng.randint(0, 30),
+        "max_distance": rng.choice([5, 10, 25, 50, 100]),
+    }
+    profile = {
+        "gender_id": rng.choice(GENDERS + [None]),
+        "dob": f"{rng.randint(1960, 2006)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}" if rng.random() < 0.95 else None,
+        "location": f"{40 + rng.uniform(-1, 1):.5f},{-74 + rng.uniform(-1, 1):.5f}" if rng.random() < 0.9 else None,
+    }
+    return prefs, profile
+
+
+def _parsed(prefs: dict, profile: dict):
+    age = _calculate_age_from_dob(profile["dob"]) if profile["dob"] else 0
+    return (prefs, profile["gender_id"], age, parse_location(profile["location"]))
+
+
+def main():
+    rng = random.Random(484)
+    guest_prefs, guest_profile = _random_user(rng)
+    guest = build_columns([_parsed(guest_prefs, guest_profile)])
+
+    print(f"{'hosts':>8} | {'scalar ms':>10} | {'build ms':>10} | {'score ms':>10} | {'compatible':>10}")
+    for count in CANDIDATE_COUNTS:
+        hosts = [_random_user(rng) for _ in range(count)]
+
+        start = time.perf_counter()
+        expected = [_are_preferences_compatible(h_prefs, guest_prefs, h_profile, guest_profile) for h_prefs, h_profile in hosts]
+        scalar_ms = (time.perf_counter() - start) * 1e3
+
+        start = time.perf_counter()
+        columns = build_columns([_parsed(h_prefs, h_profile) for h_prefs, h_profile in hosts])
+        build_ms = (time.perf_counter() - start) * 1e3
+
+        start = time.perf_counter()
+        mask, _ = score_candidates(guest, columns)
+        score_ms = (time.perf_counter() - start) * 1e3
+
+        assert np.array_equal(mask, np.array(expected)), "vectorized mask disagrees with _are_preferences_compatible"
+        print(f"{count:>8} | {scalar_ms:>10.2f} | {build_ms:>10.2f} | {score_ms:>10.2f} | {int(mask.sum()):>10}")
+
+
+if __name__ == "__main__":
+    main()
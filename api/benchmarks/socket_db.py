@@ -0,0 +1,65 @@
+import asyncio
+import statistics
+import time
+
+from services.sockets import _run_db, _run_with_db, socket_db_executor
+
+"""
+BENCHMARK FOR THE SOCKET HANDLERS' DB WORK ('_run_db' IN 'services/sockets.py'). WHILE SIMULATED HANDLERS HIT A SLOW
+DATABASE, A FAN-OUT TASK BROADCASTS A MESSAGE EVERY MILLISECOND AND RECORDS HOW LATE EACH ONE WENT OUT. THIS IS RUN
+TWICE: ONCE WITH THE QUERIES RUNNING DIRECTLY ON THE EVENT LOOP (HOW THE HANDLERS USED TO WORK) AND ONCE THROUGH THE POOL.
+
+THE DATABASE IS SIMULATED WITH A BLOCKING SLEEP SO NO POSTGRES IS NEEDED (THE DB SESSION IS OPENED BUT NEVER CONNECTS).
+RUN FROM THE /api FOLDER WITH 'python -m benchmarks.socket_db'
+"""
+
+QUERY_MS = [5, 20, 50] # How slow the simulated database is
+HANDLERS = 50 # Socket events hitting the database during the run
+FANOUT_INTERVAL_MS = 1
+FANOUT_MESSAGES = 500
+
+
+def _slow_query(query_ms: float, db):
+    time.sleep(query_ms / 1e3)
+
+
+async def _fanout(latencies: list[float]):
+    """Broadcast on a fixed schedule and record how far behind schedule each broadcast was."""
+    start = time.perf_counter()
+    for i in range(FANOUT_MESSAGES):
+        due = start + i * FANOUT_INTERVAL_MS / 1e3
+        await asyncio.sleep(max(0, due - time.perf_counter()))
+        latencies.append((time.perf_counter() - due) * 1e3)
+
+
+async def _handlers(query_ms: float, pooled: bool):
+    async def handle():
+        if pooled:
+            await _run_db(_slow_query, query_ms=query_ms)
+        else:
+            _run_with_db(_slow_query, query_ms=query_ms)
+
+    for _ in range(HANDLERS):
+        await handle()
+        await asyncio.sleep(FANOUT_MESSAGES * FANOUT_INTERVAL_MS / 1e3 / HANDLERS)
+
+
+async def _run(query_ms: float, pooled: bool) -> list[float]:
+    latencies = []
+    await asyncio.gather(_fanout(latencies), _handlers(query_ms, pooled))
+    return latencies
+
+
+def main():
+    print(f"{'query ms':>8} | {'mode':>8} | {'p50 ms':>8} | {'p99 ms':>8} | {'max ms':>8}")
+    for query_ms in QUERY_MS:
+        for pooled in (False, True):
+            latencies = asyncio.run(_run(query_ms, pooled))
+            p99 = statistics.quantiles(latencies, n=100)[98]
+            print(f"{query_ms:>8} | {'pool' if pooled else 'inline':>8} | "
+                  f"{statistics.median(latencies):>8.2f} | {p99:>8.2f} | {max(latencies):>8.2f}")
+    socket_db_executor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -4,20 +4,21 @@ from fastapi.encoders import jsonable_encoder
 from fastapi import HTTPException
 from schemas.preferences import InterestsEnum
 from controllers.profile import _profile_exists
-from controllers.user import _user_exists
+from middleware.identity import Identity, identity_for
+from services.lookups import lookups
 
 from typing import List
 
 
 def _interest_name_to_id(name: str, db: Session) -> str | HTTPException:
-    id = db.execute(text("SELECT id FROM public.interests WHERE name = :name LIMIT 1"), {"name": name}).scalar()
+    id = lookups.name_to_id("interests", name, db=db)
     if id:
         return id
     else:
         raise HTTPException(status_code=400, detail=f"User interest '{name}' is not registered in the database!")
 
 def _interest_id_to_name(id: str, db: Session) -> str | HTTPException:
-    name = db.execute(text("SELECT name FROM public.interests WHERE id = :id LIMIT 1"), {"id": id}).scalar()
+    name = lookups.id_to_name("interests", id, db=db)
     if name:
         return name
     else:
@@ -31,7 +32,7 @@ def _interests_to_id_arr(arr: List[str], db: Session) -> List[str]:
     return res
 
 def _get_all_interest_options(db: Session):
-    res = db.execute(text("SELECT * FROM public.interests")).mappings().all()
+    res = lookups.rows("interests", db=db)
     return res
 
 def _get_profile_interests(uid: str, db: Session):
@@ -48,19 +49,39 @@ def _get_profile_interests(uid: str, db: Session):
     ]
 
 def _update_profile_interests(payload: List[InterestsEnum], uid: str, db: Session):
-    if not _user_exists(uid=uid, db=db):
+    """
+    Make the user's interests exactly 'payload' in one statement: only interests that were removed are deleted
+    and only new ones are inserted, the rest are left alone.
+    """
+    # Answered from the request's identity for the caller, no query of its own
+    identity = identity_for(uid) or Identity(str(uid))
+    if not identity.user_exists(db):
         raise HTTPException(status_code=404, detail=f"User with id '{uid}' does not exist!")
-    
+
     payload = jsonable_encoder(payload)
-    interest_ids = _interests_to_id_arr(payload, db=db) # List of str
-    _delete_profile_interests(uid=uid, db=db) # Delete existing user interests for said user
+    interest_ids = [str(id) for id in _interests_to_id_arr(payload, db=db)] # Resolved from memory, raises on unknown names
 
-    for interest_id in interest_ids:
-        stmt = text("""
-            INSERT INTO profiles.interests (uid, interest_id)
-            VALUES (:uid, :interest_id)
-        """)
-        db.execute(stmt, {"uid": uid, "interest_id": interest_id})
+    stmt = text("""
+        WITH desired AS (
+            SELECT i.id
+            FROM public.interests i
+            WHERE i.id::text = ANY(CAST(:interest_ids AS text[]))
+        ),
+        removed AS (
+            DELETE FROM profiles.interests
+            WHERE uid = CAST(:uid AS uuid)
+              AND interest_id NOT IN (SELECT id FROM desired)
+        )
+        INSERT INTO profiles.interests (uid, interest_id)
+        SELECT CAST(:uid AS uuid), d.id
+        FROM desired d
+        WHERE NOT EXISTS (
+            SELECT 1 FROM profiles.interests pi
+            WHERE pi.uid = CAST(:uid AS uuid)
+              AND pi.interest_id = d.id
+        )
+    """)
+    db.execute(stmt, {"uid": uid, "interest_ids": interest_ids})
     return {"ok": True}
 
 """Delete all existing interests for a given user"""
@@ -1,28 +1,68 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import text
+from sqlalchemy import text, event
 from fastapi import HTTPException
 from fastapi.encoders import jsonable_encoder
 import json
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
+from typing import Optional, List
 
 from controllers.preferences import _get_user_prefs
-from controllers.profile import _get_profile
+from services.geo import cell_ids_within, parse_location
 
 # Configurable matchmaking settings
 MATCHMAKING_TIMEOUT_SECONDS = 15
 MATCHMAKING_POLL_INTERVAL_SECONDS = 3
 
+# Socket events for push-based matchmaking (polling is only a fallback)
+MATCHMAKING_SOCKET_EVENTS = {
+    "join": "matchmaking_join",
+    "joined": "matchmaking_joined",
+    "leave": "matchmaking_leave",
+    "left": "matchmaking_left",
+    "searching": "matchmaking_searching",
+    "matched": "match_found",
+    "host": "matchmaking_host",
+    "timeout": "matchmaking_timeout",
+}
+
+QUEUE_CHANGES_KEY = "matchmaker_changes" # 'Session.info' key of the resident matchmaker changes to apply on commit
+
+def _queue_change_on_commit(db: Session, add=None, remove: Optional[str] = None):
+    """
+    Add a QueueEntry to ('add') or remove a uid from ('remove') the resident matchmaker once 'db' commits, so a
+    rolled back join / leave never reaches the engine.
+    """
+    db.info.setdefault(QUEUE_CHANGES_KEY, []).append((add, remove))
+
+@event.listens_for(Session, "after_commit")
+def _apply_committed_queue_changes(db: Session):
+    changes = db.info.pop(QUEUE_CHANGES_KEY, None)
+    if not changes:
+        return
+
+    from services.matchmaker import matchmaker
+    for add, remove in changes:
+        if add is not None:
+            matchmaker.add(add)
+        else:
+            matchmaker.remove(remove)
+
+@event.listens_for(Session, "after_rollback")
+def _forget_rolled_back_queue_changes(db: Session):
+    if not db.in_nested_transaction(): # A savepoint rolling back leaves the outer transaction's changes
+        db.info.pop(QUEUE_CHANGES_KEY, None)
+
+GET_QUEUE_STMT = text("""
+    SELECT *
+    FROM sessions.matchmaking_queue
+    WHERE uid = :uid
+    AND expires_at > NOW()
+    LIMIT 1
+""")
+
 def _get_queue(uid: str, db: Session):
     """Get user's current queue entry."""
-    stmt = text("""
-        SELECT *
-        FROM sessions.matchmaking_queue
-        WHERE uid = :uid
-        AND expires_at > NOW()
-        LIMIT 1
-    """)
-    queue = db.execute(stmt, {"uid": uid}).mappings().first()
+    queue = db.execute(GET_QUEUE_STMT, {"uid": uid}).mappings().first()
     
     if not queue:
         raise HTTPException(status_code=404, detail=f"User with uid '{uid}' is not currently in the queue!")
@@ -30,20 +70,100 @@ def _get_queue(uid: str, db: Session):
     return queue
 
 
+USER_IN_QUEUE_STMT = text("""
+    SELECT EXISTS(
+        SELECT 1
+        FROM sessions.matchmaking_queue
+        WHERE uid = :uid
+        AND expires_at > NOW()
+    ) as in_queue
+""")
+
 def _user_in_queue(uid: str, db: Session) -> bool:
     """Check if user is in queue (and not expired)."""
-    stmt = text("""
-        SELECT EXISTS(
-            SELECT 1
-            FROM sessions.matchmaking_queue
-            WHERE uid = :uid
-            AND expires_at > NOW()
-        ) as in_queue
-    """)
-    result = db.execute(stmt, {"uid": uid}).mappings().first()
+    result = db.execute(USER_IN_QUEUE_STMT, {"uid": uid}).mappings().first()
     return result['in_queue'] if result else False
 
 
+CLAIM_QUEUE_ENTRY_STMT = text("""
+    SELECT uid
+    FROM sessions.matchmaking_queue
+    WHERE uid = :uid
+    AND expires_at > NOW()
+    FOR UPDATE SKIP LOCKED
+""")
+
+def _claim_queue_entry(uid: str, db: Session) -> bool:
+    """
+    Lock the user's queue row until the transaction ends, so only one worker acts on it at a time.
+    False if another worker holds it right now, or the user is no longer queued.
+    """
+    return db.execute(CLAIM_QUEUE_ENTRY_STMT, {"uid": uid}).first() is not None
+
+
+GET_MATCH_PROFILE_STMT = text("""
+    SELECT
+        pr.gender_id::text AS gender_id,
+        to_char(u.birthdate, 'YYYY-MM-DD') AS dob,
+        pr.location,
+        pr.location_lat,
+        pr.location_lon,
+        pr.location_cell
+    FROM profiles.profiles pr
+    JOIN users.users u
+        ON u.id = pr.uid
+    WHERE pr.uid = :uid
+    LIMIT 1
+""")
+
+def _get_match_profile(uid: str, db: Session):
+    """Get the profile fields matchmaking compares on (gender, date of birth, location)."""
+    profile = db.execute(GET_MATCH_PROFILE_STMT, {"uid": uid}).mappings().first()
+
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+
+    return profile
+
+
+ACTIVE_QUEUE_ENTRIES_STMT = text("""
+    SELECT
+        q.uid,
+        q.mode_id,
+        q.enqueued_at,
+        q.expires_at,
+        q.prefs_snapshot,
+        pr.gender_id::text AS gender_id,
+        to_char(u.birthdate, 'YYYY-MM-DD') AS dob,
+        pr.location,
+        q.location_lat,
+        q.location_lon,
+        s.id AS session_id
+    FROM sessions.matchmaking_queue q
+    JOIN users.users u
+        ON u.id = q.uid
+    AND u.deleted_at IS NULL
+    AND u.paused = FALSE
+    LEFT JOIN profiles.profiles pr
+        ON pr.uid = q.uid
+    LEFT JOIN sessions.sessions s
+        ON s.host_uid = q.uid
+    AND s.status = 'open'
+    AND s.guest_uid IS NULL
+    AND s.closed_at IS NULL
+    WHERE q.expires_at > NOW()
+    ORDER BY q.enqueued_at ASC
+    LIMIT :limit
+""")
+
+def _get_active_queue_entries(db: Session, limit: Optional[int] = None):
+    """
+    Get every unexpired queue entry along with the profile fields and open session (if hosting) of its user.
+    'limit' keeps only the longest waiting entries.
+    """
+    return db.execute(ACTIVE_QUEUE_ENTRIES_STMT, {"limit": limit}).mappings().all()
+
+
 def _join_queue(uid: str, db: Session):
     """Add user to matchmaking queue with their current preferences."""
     if _user_in_queue(uid=uid, db=db):
@@ -56,12 +176,12 @@ def _join_queue(uid: str, db: Session):
     
     # Get user's current preferences and profile
     user_prefs = _get_user_prefs(uid=uid, db=db)
-    user_profile = _get_profile(uid=uid, db=db)
+    user_profile = _get_match_profile(uid=uid, db=db)
     
     stmt = text("""
         INSERT INTO sessions.matchmaking_queue
-            (uid, mode_id, prefs_snapshot, location_snapshot, expires_at)
-        VALUES (:uid, :mode_id, CAST(:prefs_snapshot AS jsonb), CAST(:location_snapshot AS jsonb), :expires_at)
+            (uid, mode_id, prefs_snapshot, location_snapshot, location_lat, location_lon, location_cell, expires_at)
+        VALUES (:uid, :mode_id, CAST(:prefs_snapshot AS jsonb), CAST(:location_snapshot AS jsonb), :location_lat, :location_lon, :location_cell, :expires_at)
         RETURNING *
     """)
     
@@ -73,10 +193,18 @@ def _join_queue(uid: str, db: Session):
         "mode_id": None,
         "prefs_snapshot": json.dumps(jsonable_encoder(user_prefs)),
         "location_snapshot": json.dumps(user_profile.get("location", "")),
+        "location_lat": user_profile.get("location_lat"),
+        "location_lon": user_profile.get("location_lon"),
+        "location_cell": user_profile.get("location_cell"),
         "expires_at": expires_at
     }
     
     res = db.execute(stmt, params).mappings().first()
+
+    # Hand the entry to the resident matchmaker (once committed) so it can be paired without polling
+    from services.matchmaker import QueueEntry
+    _queue_change_on_commit(db, add=QueueEntry.from_row({**res, **user_profile}))
+
     return res
 
 
@@ -88,6 +216,8 @@ def _leave_queue(uid: str, db: Session):
         RETURNING *
     """)
     res = db.execute(stmt, {"uid": uid}).mappings().first()
+
+    _queue_change_on_commit(db, remove=uid)
     
     if not res:
         return None
@@ -105,48 +235,13 @@ def _calculate_age_from_dob(dob: str) -> int:
     except:
         return 0
 
-def _parse_location(location_text: str) -> Optional[tuple[float, float]]:
-    """
-    Parse location text to extract latitude and longitude.
-    
-    Supports formats:
-    - JSON string: '{"lat": 40.7128, "lng": -74.0060}'
-    - Comma-separated: '40.7128,-74.0060'
-    - Dict (if already parsed): {'lat': 40.7128, 'lng': -74.0060}
-    
-    Returns tuple of (latitude, longitude) or None if parsing fails.
-    """
-    if not location_text:
-        return None
-    
-    try:
-        # If it's a string, try to parse as JSON first
-        if isinstance(location_text, str):
-            # Try JSON format
-            if location_text.strip().startswith('{'):
-                loc_dict = json.loads(location_text)
-                lat = loc_dict.get('lat') or loc_dict.get('latitude')
-                lng = loc_dict.get('lng') or loc_dict.get('longitude') or loc_dict.get('lon')
-                if lat is not None and lng is not None:
-                    return (float(lat), float(lng))
-            
-            # Try comma-separated format
-            if ',' in location_text:
-                parts = location_text.split(',')
-                if len(parts) == 2:
-                    return (float(parts[0].strip()), float(parts[1].strip()))
-        
-        # If it's already a dict
-        elif isinstance(location_text, dict):
-            lat = location_text.get('lat') or location_text.get('latitude')
-            lng = location_text.get('lng') or location_text.get('longitude') or location_text.get('lon')
-            if lat is not None and lng is not None:
-                return (float(lat), float(lng))
-    
-    except (ValueError, json.JSONDecodeError, KeyError, AttributeError):
-        return None
-    
-    return None
+def _profile_coords(profile: dict) -> Optional[tuple[float, float]]:
+    """Use the pre-parsed coordinates when a profile has them, otherwise fall back to parsing its location text."""
+    lat = profile.get('location_lat')
+    lon = profile.get('location_lon')
+    if lat is not None and lon is not None:
+        return (float(lat), float(lon))
+    return parse_location(profile.get('location'))
 
 
 def _calculate_distance_miles(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
@@ -204,8 +299,6 @@ def _are_preferences_compatible(host_prefs: dict, guest_prefs: dict, host_profil
     guest_gender_id = guest_profile.get('gender_id')
     host_dob = host_profile.get('dob')
     guest_dob = guest_profile.get('dob')
-    host_location = host_profile.get('location')
-    guest_location = guest_profile.get('location')
     
     # Calculate ages
     host_age = _calculate_age_from_dob(host_dob) if host_dob else 0
@@ -230,9 +323,8 @@ def _are_preferences_compatible(host_prefs: dict, guest_prefs: dict, host_profil
             return False
     
     # Check location/distance compatibility (both ways)
-    # Parse locations
-    host_coords = _parse_location(host_location)
-    guest_coords = _parse_location(guest_location)
+    host_coords = _profile_coords(host_profile)
+    guest_coords = _profile_coords(guest_profile)
     
     # Only check distance if both users have valid coordinates
     if host_coords and guest_coords:
@@ -254,54 +346,119 @@ def _are_preferences_compatible(host_prefs: dict, guest_prefs: dict, host_profil
     return True
 
 
-def _find_compatible_session(guest_uid: str, guest_prefs: dict, guest_profile: dict, db: Session) -> Optional[str]:
+COMPATIBLE_SESSIONS_STMT = text("""
+    SELECT 
+        s.id,
+        s.host_uid,
+        q.prefs_snapshot AS host_prefs,
+        to_char(u.birthdate, 'YYYY-MM-DD') AS host_dob,
+        pr.gender_id::text AS host_gender_id,
+        q.location_lat AS host_location_lat,
+        q.location_lon AS host_location_lon
+    FROM sessions.sessions s
+    JOIN sessions.matchmaking_queue q
+        ON q.uid = s.host_uid
+    AND q.expires_at > NOW()
+    JOIN users.users u
+        ON u.id = s.host_uid
+    AND u.deleted_at IS NULL
+    AND u.paused = FALSE
+    LEFT JOIN profiles.profiles pr
+        ON pr.uid = s.host_uid
+    WHERE s.status = 'open'
+    AND s.guest_uid IS NULL
+    AND s.closed_at IS NULL
+    AND s.host_uid != :guest_uid
+    AND (
+        CAST(:cells AS text[]) IS NULL
+        OR q.location_cell IS NULL
+        OR q.location_cell = ANY(CAST(:cells AS text[]))
+    )
+    ORDER BY q.enqueued_at ASC
+    LIMIT 20
+""")
+
+def _find_compatible_sessions(guest_uid: str, guest_prefs: dict, guest_profile: dict, db: Session) -> List[str]:
     """
-    Find a compatible open session based on preferences.
-    Returns session_id if found, None otherwise.
+    Find compatible open sessions based on preferences, longest-waiting host first.
+    Nothing is locked here, pass the result to '_claim_session' to actually join one.
     """
+    # Only consider hosts in grid cells that fall within the guest's max distance
+    cells = None
+    guest_coords = _profile_coords(guest_profile)
+    if guest_coords:
+        cells = cell_ids_within(guest_coords[0], guest_coords[1], guest_prefs.get('max_distance', 999999))
     
-    stmt = text("""
-        SELECT 
-            s.id,
-            s.host_uid,
-            q.prefs_snapshot AS host_prefs,
-            u.birthdate AS host_birthdate,
-            pr.gender_id AS host_gender_id,
-            pr.location AS host_location
-        FROM sessions.sessions s
-        JOIN sessions.matchmaking_queue q
-            ON q.uid = s.host_uid
-        AND q.expires_at > NOW()
-        JOIN users.users u
-            ON u.id = s.host_uid
-        AND u.deleted_at IS NULL
-        AND u.paused = FALSE
-        LEFT JOIN profiles.profiles pr
-            ON pr.uid = s.host_uid
-        WHERE s.status = 'open'
-        AND s.guest_uid IS NULL
-        AND s.closed_at IS NULL
-        AND s.host_uid != :guest_uid
-        ORDER BY q.enqueued_at ASC
-        LIMIT 20
-    """)
-
-    
-    potential_sessions = db.execute(stmt, {"guest_uid": guest_uid}).mappings().all()
+    potential_sessions = db.execute(COMPATIBLE_SESSIONS_STMT, {"guest_uid": guest_uid, "cells": cells}).mappings().all()
     
     # Check compatibility with each potential session
+    compatible = []
     for session in potential_sessions:
         host_prefs = session['host_prefs']
         host_profile = {
             'dob': session['host_dob'],
             'gender_id': session['host_gender_id'],
-            'location': session['host_location']
+            'location_lat': session['host_location_lat'],
+            'location_lon': session['host_location_lon']
         }
         
         if _are_preferences_compatible(host_prefs, guest_prefs, host_profile, guest_profile):
-            return session['id']
+            compatible.append(str(session['id']))
     
-    return None
+    return compatible
+
+
+CLAIM_SESSION_STMT = text("""
+    WITH candidate AS (
+        SELECT s.id
+        FROM sessions.sessions s
+        WHERE s.id = ANY(CAST(:session_ids AS uuid[]))
+        AND s.status = 'open'
+        AND s.guest_uid IS NULL
+        AND s.closed_at IS NULL
+        AND s.host_uid != :guest_uid
+        AND NOT EXISTS (
+            SELECT 1
+            FROM sessions.sessions g
+            WHERE (g.host_uid = :guest_uid OR g.guest_uid = :guest_uid)
+            AND g.status = 'open'
+        )
+        ORDER BY array_position(CAST(:session_ids AS uuid[]), s.id)
+        LIMIT 1
+        FOR UPDATE OF s SKIP LOCKED
+    ),
+    claimed AS (
+        UPDATE sessions.sessions s
+        SET guest_uid = :guest_uid
+        FROM candidate c
+        WHERE s.id = c.id
+        RETURNING s.*
+    ),
+    dequeued AS (
+        DELETE FROM sessions.matchmaking_queue q
+        USING claimed c
+        WHERE q.uid IN (c.host_uid, CAST(:guest_uid AS uuid))
+    )
+    SELECT * FROM claimed
+""")
+
+def _claim_session(session_ids: List[str], guest_uid: str, db: Session):
+    """
+    Atomically join the first of 'session_ids' that is still open, in a single statement:
+    lock it (skipping sessions another guest is claiming right now), set the guest and
+    remove both the host and the guest from the queue.
+    Returns the joined session, or None if every candidate was taken.
+    """
+    session = db.execute(CLAIM_SESSION_STMT, {"session_ids": session_ids, "guest_uid": guest_uid}).mappings().first()
+
+    if session:
+        from controllers.session import _invalidate_session_on_commit
+        _invalidate_session_on_commit(session["id"], db)
+
+        _queue_change_on_commit(db, remove=str(session['host_uid']))
+        _queue_change_on_commit(db, remove=guest_uid)
+
+    return session
 
 
 def _poll_for_match(uid: str, db: Session):
@@ -315,6 +472,13 @@ def _poll_for_match(uid: str, db: Session):
       - 'searching': Still searching, keep polling
       - 'cancelled': User left queue (shouldn't happen in normal flow)
     """
+    # The resident matchmaker answers from memory for any user it is tracking
+    from services.matchmaker import matchmaker
+    if matchmaker.running:
+        result = matchmaker.poll(uid)
+        if result:
+            return result
+
     # Check if user is still in queue
     if not _user_in_queue(uid=uid, db=db):
         # User was either matched or left queue
@@ -363,21 +527,18 @@ def _poll_for_match(uid: str, db: Session):
     
     # Try to find a match
     guest_prefs = queue_entry['prefs_snapshot']
-    guest_profile = _get_profile(uid=uid, db=db)
+    guest_profile = _get_match_profile(uid=uid, db=db)
     
-    session_id = _find_compatible_session(
+    session_ids = _find_compatible_sessions(
         guest_uid=uid,
         guest_prefs=guest_prefs,
         guest_profile=guest_profile,
         db=db
     )
+    session = _claim_session(session_ids=session_ids, guest_uid=uid, db=db) if session_ids else None
     
-    if session_id:
-        # Found a match! Join as guest
-        from controllers.session import _join_session_by_id
-        session = _join_session_by_id(session_id=session_id, guest_uid=uid, db=db)
-        _leave_queue(uid=uid, db=db)
-        
+    if session:
+        # Found a match! Joined as guest and both users left the queue
         # Notify host via WebSocket
         _notify_host_of_match(session['host_uid'], session['id'], uid)
         
@@ -400,28 +561,11 @@ def _poll_for_match(uid: str, db: Session):
 
 
 def _notify_host_of_match(host_uid: str, session_id: str, guest_uid: str):
-    try:
-        from services.sockets import user_sid_map, socket_manager
-        import asyncio
-
-        if socket_manager is None:
-            return
-
-        host_sid = user_sid_map.get(host_uid)
-        if not host_sid:
-            return
-
-        loop = asyncio.get_event_loop()
-        loop.create_task(
-            socket_manager.emit(
-                "match_found",
-                {
-                    "session_id": session_id,
-                    "guest_uid": guest_uid,
-                    "message": "A match has been found!",
-                },
-                room=host_sid,
-            )
-        )
-    except Exception as e:
-        print(f"Failed to send WebSocket notification: {e}")
+    from services.matchmaker import matchmaker
+    matchmaker.notify(host_uid, "match_found", {
+        "session_id": str(session_id),
+        "host_uid": str(host_uid),
+        "guest_uid": guest_uid,
+        "role": "host",
+        "message": "A match has been found!",
+    })
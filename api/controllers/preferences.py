@@ -4,21 +4,22 @@ from fastapi.encoders import jsonable_encoder
 from fastapi import HTTPException
 
 from schemas.preferences import UserProfilePreferencesSchema
-from controllers.user import _user_exists
+from middleware.identity import Identity, identity_for
 from controllers.gender import _gender_name_to_id
 
 from json import dumps
 
 def _user_prefs_exist(uid: str, db: Session):
-    if not _user_exists(uid=uid, db=db):
+    identity = identity_for(uid) or Identity(str(uid))
+    if not identity.user_exists(db):
         raise HTTPException(status_code=404, detail=f"User with id '{uid}' does not exist!")
 
-    stmt = text("""SELECT 1 FROM users.preferences WHERE uid = :uid LIMIT 1""")
-    return bool(db.execute(stmt, {"uid": uid}).scalar())
+    return identity.prefs_exist(db)
+
+GET_USER_PREFS_STMT = text("""SELECT * FROM users.preferences WHERE uid = :uid LIMIT 1""")
 
 def _get_user_prefs(uid: str, db: Session):
-    stmt = text("""SELECT * FROM users.preferences WHERE uid = :uid LIMIT 1""")
-    prefs = db.execute(stmt, {"uid": uid}).mappings().one()
+    prefs = db.execute(GET_USER_PREFS_STMT, {"uid": uid}).mappings().first()
     if not prefs:
         raise HTTPException(status_code=404, detail=f"User with id '{uid}' has no preferences!")
         
@@ -39,12 +40,12 @@ def _create_user_prefs(payload: UserProfilePreferencesSchema, uid: str, db: Sess
     """)
 
     db.execute(stmt, {"uid": uid, "tgid": tgid, "age_min": payload.get("age_min"), "age_max": payload.get("age_max"), "max_distance": payload.get("max_distance"), "extra_options": dumps(payload.get("extra_options"))})
+    identity = identity_for(uid)
+    if identity:
+        identity.mark(prefs_exist=True)
     return {"ok": True}
 
 def _update_user_prefs(payload: UserProfilePreferencesSchema, uid: str, db: Session):
-    if not _user_prefs_exist(uid=uid, db=db):
-        raise HTTPException(status_code=404, detail=f"The user with id '{uid}' does not have preferences created yet!")
-
     payload = jsonable_encoder(payload)
     target_gender_name = payload.get("target_gender")
     tgid = _gender_name_to_id(target_gender_name, db=db)
@@ -61,5 +62,8 @@ def _update_user_prefs(payload: UserProfilePreferencesSchema, uid: str, db: Sess
         WHERE uid = :uid
     """)
 
-    db.execute(stmt, {"uid": uid, "tgid": tgid, "age_min": payload.get("age_min"), "age_max": payload.get("age_max"), "max_distance": payload.get("max_distance"), "extra_options": dumps(payload.get("extra_options"))})
+    # No row updated means there is nothing to update (no such user, or no preferences yet)
+    res = db.execute(stmt, {"uid": uid, "tgid": tgid, "age_min": payload.get("age_min"), "age_max": payload.get("age_max"), "max_distance": payload.get("max_distance"), "extra_options": dumps(payload.get("extra_options"))})
+    if res.rowcount == 0:
+        raise HTTPException(status_code=404, detail=f"The user with id '{uid}' does not have preferences created yet!")
     return {"ok": True}
\ No newline at end of file
@@ -1,27 +1,89 @@
+from typing import List
+
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 from fastapi import HTTPException
 
-from controllers.user import _user_exists
+from middleware.identity import IDENTITY_STMT, Identity, identity_for
 
 def _profile_exists(uid: str, db: Session) -> bool:
-    if not _user_exists(uid=uid, db=db):
+    # The user and profile checks come back in one query, and for the caller only once per request
+    identity = identity_for(uid) or Identity(str(uid))
+    if not identity.user_exists(db):
         raise HTTPException(status_code=404, detail=f"User with id '{uid}' does not exist!")
     
-    return bool(
-        db.execute(
-            text("""SELECT 1 FROM profiles.profiles WHERE uid = :uid LIMIT 1"""),
-            {"uid": uid}
-        ).scalar()
-    )
+    return identity.profile_exists(db)
+
+async def _async_profile_exists(uid: str, db: AsyncSession) -> bool:
+    """'_profile_exists' for the async endpoints, always for another user than the caller so no Identity to reuse."""
+    flags = (await db.execute(IDENTITY_STMT, {"uid": uid})).mappings().one()
+    if not flags["user_exists"]:
+        raise HTTPException(status_code=404, detail=f"User with id '{uid}' does not exist!")
+
+    return flags["profile_exists"]
+
+GET_PROFILE_STMT = text("""
+    SELECT * FROM profiles.profiles WHERE uid = :tuid LIMIT 1
+""")
 
 def _get_profile(uid: str, db: Session):
-    stmt = text("""
-        SELECT * FROM profiles.profiles WHERE uid = :tuid LIMIT 1
-    """)
-    profile = db.execute(stmt, {'tuid': uid}).mappings().first()
+    profile = db.execute(GET_PROFILE_STMT, {'tuid': uid}).mappings().first()
     
     if not profile:
         raise HTTPException(status_code=404, detail="Profile not found")
     
-    return profile
\ No newline at end of file
+    return profile
+
+PROFILE_CARDS_STMT = text("""
+    SELECT
+        u.id AS uid,
+        jsonb_build_object(
+            'id', u.id,
+            'first_name', u.first_name,
+            'last_name', u.last_name,
+            'birthdate', u.birthdate
+        ) AS user_info,
+        to_jsonb(p) AS profile,
+        g.name AS gender,
+        o.name AS orientation,
+        COALESCE((
+            SELECT jsonb_agg(jsonb_build_object('id', i.id, 'name', i.name) ORDER BY i.name)
+            FROM profiles.interests pi
+            JOIN public.interests i
+                ON i.id = pi.interest_id
+            WHERE pi.uid = u.id
+        ), '[]'::jsonb) AS interests,
+        COALESCE((
+            SELECT jsonb_agg(jsonb_build_object(
+                'id', ph.id,
+                'path', ph.path,
+                'derivatives', ph.derivatives,
+                'mime_type', ph.mime_type,
+                'size_bytes', ph.size_bytes,
+                'slot', ph.slot,
+                'is_primary', ph.is_primary,
+                'moderation_status', ph.moderation_status
+            ) ORDER BY ph.is_primary DESC, ph.created_at DESC)
+            FROM profiles.photos ph
+            WHERE ph.uid = u.id
+            AND ph.moderation_status = 'approved'
+        ), '[]'::jsonb) AS photos
+    FROM users.users u
+    JOIN profiles.profiles p
+        ON p.uid = u.id
+    LEFT JOIN public.genders g
+        ON g.id = p.gender_id
+    LEFT JOIN public.orientations o
+        ON o.id = p.orientation_id
+    WHERE u.id = ANY(CAST(:uids AS uuid[]))
+    AND u.deleted_at IS NULL
+    ORDER BY array_position(CAST(:uids AS uuid[]), u.id)
+""")
+
+async def _get_profile_cards(uids: List[str], db: AsyncSession):
+    """
+    User info, profile, gender / orientation names, interests and approved photos of several users
+    in one query (in the order of 'uids'). Users without a profile are left out. Photo URLs still need signing.
+    """
+    return (await db.execute(PROFILE_CARDS_STMT, {"uids": uids})).mappings().all()
@@ -1,5 +1,8 @@
+import threading
+import time
+
 from sqlalchemy.orm import Session
-from sqlalchemy import text
+from sqlalchemy import text, event
 from fastapi import HTTPException
 from fastapi.encoders import jsonable_encoder
 from typing import Mapping, Optional
@@ -8,6 +11,79 @@ from schemas.user import UserInfoSchema
 from schemas.session import SessionSchema, CreateSessionSchema
 from schemas.session.status import SessionStatusEnum
 from controllers.matchmaking import _user_in_queue, _leave_queue, _join_queue
+from services.metrics import register_metrics
+
+# In-process cache of open sessions (host / guest / status) by id, so socket auth and chat don't hit the DB per event.
+# Functions here that change a session's members or status invalidate it once their transaction commits, on every
+# worker when 'redis_url' is set (see 'services/session_invalidations.py'). SESSION_CACHE_TTL_SECONDS only bounds
+# how stale an entry can get if an invalidation is lost
+SESSION_CACHE_TTL_SECONDS = 30
+SESSION_CACHE_MAX_ENTRIES = 50000
+INVALIDATED_SESSIONS_KEY = "invalidated_sessions" # 'Session.info' key of the session ids to invalidate on commit
+
+_session_cache: dict[str, tuple[float, dict]] = {}
+_session_cache_lock = threading.Lock()
+_session_cache_generation = 0 # Bumped by every invalidation, a read that raced one doesn't get cached
+_session_cache_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+register_metrics("session_cache", lambda: {**_session_cache_stats, "size": len(_session_cache)})
+
+
+def _get_cached_session(session_id: str) -> Mapping | None:
+    """Open session from the cache only (no DB), or None if it isn't cached or the entry is too old."""
+    with _session_cache_lock:
+        cached = _session_cache.get(str(session_id))
+        if cached and time.monotonic() - cached[0] < SESSION_CACHE_TTL_SECONDS:
+            _session_cache_stats["hits"] += 1
+            return cached[1]
+    return None
+
+def _cache_session(session: Mapping, generation: int):
+    """Cache a session read while the cache was at 'generation', unless something was invalidated since."""
+    with _session_cache_lock:
+        if generation != _session_cache_generation:
+            return
+        if len(_session_cache) >= SESSION_CACHE_MAX_ENTRIES:
+            _session_cache.clear()
+        _session_cache[str(session["id"])] = (time.monotonic(), session)
+
+def _invalidate_session(session_id: str):
+    """Drop a session from this worker's cache now."""
+    global _session_cache_generation
+    with _session_cache_lock:
+        _session_cache_generation += 1
+        if _session_cache.pop(str(session_id), None) is not None:
+            _session_cache_stats["invalidations"] += 1
+
+def _clear_session_cache():
+    """Drop every cached session (e.g. when invalidations from other workers may have been missed)."""
+    global _session_cache_generation
+    with _session_cache_lock:
+        _session_cache_generation += 1
+        _session_cache.clear()
+
+def _invalidate_session_on_commit(session_id: str, db: Session):
+    """
+    Drop a session from the cache once 'db' commits, on every worker. Invalidating before the commit would let
+    another request read (and cache) the old row in between.
+    """
+    db.info.setdefault(INVALIDATED_SESSIONS_KEY, set()).add(str(session_id))
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed_sessions(db: Session):
+    session_ids = db.info.pop(INVALIDATED_SESSIONS_KEY, None)
+    if not session_ids:
+        return
+    for session_id in session_ids:
+        _invalidate_session(session_id)
+
+    from services.session_invalidations import session_invalidations
+    session_invalidations.publish(session_ids)
+
+@event.listens_for(Session, "after_rollback")
+def _forget_rolled_back_sessions(db: Session):
+    if not db.in_nested_transaction(): # A savepoint rolling back leaves the outer transaction's changes
+        db.info.pop(INVALIDATED_SESSIONS_KEY, None)
 
 def _user_in_session(uid: str, db: Session):
     exists = _get_active_session(uid=uid, db=db)
@@ -24,30 +100,46 @@ def _get_all_user_sessions(uid: str, db: Session):
     sessions = db.execute(stmt, {"uid": uid}).mappings().all()
     return sessions
 
+GET_ACTIVE_SESSION_BY_ID_STMT = text("""
+    SELECT id, host_uid, guest_uid, status
+    FROM sessions.sessions
+    WHERE id = :session_id
+    AND status = 'open'
+    LIMIT 1
+""")
+
 def _get_active_session_by_id(session_id: str, db: Session) -> Mapping | None:
     """
-    Retrieves an active (open) session by its ID. Used primarily by WebSocket handlers.
+    Retrieves an active (open) session by its ID. Used primarily by WebSocket handlers, so it is served
+    from the session cache when possible.
     """
-    stmt = text("""
-        SELECT host_uid, guest_uid, status
-        FROM sessions.sessions
-        WHERE id = :session_id
-        AND status = 'open'
-        LIMIT 1
-    """)
-    session = db.execute(stmt, {"session_id": session_id}).mappings().first()
+    cached = _get_cached_session(session_id)
+    if cached:
+        return cached
+
+    with _session_cache_lock:
+        _session_cache_stats["misses"] += 1
+        generation = _session_cache_generation
+
+    session = db.execute(GET_ACTIVE_SESSION_BY_ID_STMT, {"session_id": session_id}).mappings().first()
+    if not session:
+        return None
+
+    session = dict(session)
+    _cache_session(session, generation)
     return session
 
+GET_ACTIVE_SESSION_STMT = text("""
+    SELECT *
+    FROM sessions.sessions
+    WHERE (
+        host_uid = :uid OR guest_uid = :uid
+    ) AND status = 'open'
+    LIMIT 1
+""")
+
 def _get_active_session(uid: str, db: Session):
-    stmt = text("""
-        SELECT *
-        FROM sessions.sessions
-        WHERE (
-            host_uid = :uid OR guest_uid = :uid
-        ) AND status = 'open'
-        LIMIT 1
-    """)
-    session = db.execute(stmt, {"uid": uid}).mappings().first()
+    session = db.execute(GET_ACTIVE_SESSION_STMT, {"uid": uid}).mappings().first()
     return session
 
 
@@ -99,7 +191,9 @@ def _join_session(guest_uid: str, db: Session):
     
     if not res:
         raise HTTPException(status_code=404, detail="No available open session found to join")
-    
+
+    _invalidate_session_on_commit(res["id"], db)
+
     # Remove from queue after successfully joining
     _leave_queue(uid=guest_uid, db=db)
     
@@ -129,7 +223,8 @@ def _join_session_by_id(session_id: str, guest_uid: str, db: Session):
     
     if not res:
         raise HTTPException(status_code=404, detail="Session not available")
-    
+
+    _invalidate_session_on_commit(session_id, db)
     return res
 
 def _create_session_from_queue(
@@ -159,16 +254,68 @@ def _create_session_from_queue(
     
     # Keep user in queue so their session can be found by others
     # They'll be removed from queue when someone joins
-    
+
+    if res:
+        _invalidate_session_on_commit(res["id"], db)
+    return res
+
+def _create_matched_sessions(pairs: list[tuple[str, str, Optional[str]]], db: Session):
+    """
+    Create sessions that already have both users in them, for a whole batch of (host_uid, guest_uid, mode_id)
+    pairs, and remove those users from the queue in a single statement (used by the matchmaker every tick).
+
+    Both users' queue rows are locked first, pairs where either row is gone or locked by another worker are
+    skipped, so only the returned sessions were created.
+    """
+    if not pairs:
+        return []
+
+    stmt = text("""
+        WITH pairs AS (
+            SELECT *
+            FROM unnest(CAST(:host_uids AS uuid[]), CAST(:guest_uids AS uuid[]), CAST(:mode_ids AS uuid[]))
+                AS p(host_uid, guest_uid, mode_id)
+        ),
+        locked AS (
+            SELECT uid
+            FROM sessions.matchmaking_queue
+            WHERE uid IN (SELECT host_uid FROM pairs UNION ALL SELECT guest_uid FROM pairs)
+            FOR UPDATE SKIP LOCKED
+        ),
+        ready AS (
+            SELECT p.*
+            FROM pairs p
+            WHERE p.host_uid IN (SELECT uid FROM locked)
+              AND p.guest_uid IN (SELECT uid FROM locked)
+              AND NOT EXISTS (
+                  SELECT 1 FROM sessions.sessions s
+                  WHERE s.status = 'open'
+                    AND (s.host_uid IN (p.host_uid, p.guest_uid) OR s.guest_uid IN (p.host_uid, p.guest_uid))
+              )
+        ),
+        created AS (
+            INSERT INTO sessions.sessions (status, host_uid, guest_uid, mode_id)
+            SELECT :status, host_uid, guest_uid, mode_id FROM ready
+            RETURNING *
+        ),
+        dequeued AS (
+            DELETE FROM sessions.matchmaking_queue
+            WHERE uid IN (SELECT host_uid FROM ready UNION ALL SELECT guest_uid FROM ready)
+        )
+        SELECT * FROM created
+    """)
+
+    res = db.execute(stmt, {
+        "status": SessionStatusEnum.open.value,
+        "host_uids": [host_uid for host_uid, _, _ in pairs],
+        "guest_uids": [guest_uid for _, guest_uid, _ in pairs],
+        "mode_ids": [mode_id for _, _, mode_id in pairs]
+    }).mappings().all()
+
     return res
 
 def _leave_session(uid: str, db: Session):
-    """Leave current session and handle cleanup."""
-    if not _user_in_session(uid=uid, db=db):
-        raise HTTPException(status_code=404, detail=f"User with uid '{uid}' is not in a session!")
-    
-    session = _get_active_session(uid=uid, db=db)
-    
+    """Leave current session and handle cleanup. The UPDATE only matches the user's open session, so no row means none."""
     stmt = text("""
         UPDATE sessions.sessions
         SET 
@@ -194,7 +341,7 @@ def _leave_session(uid: str, db: Session):
     res = db.execute(stmt, {"uid": uid}).mappings().first()
     
     if not res:
-        raise HTTPException(status_code=404, detail="No active session found to leave")
+        raise HTTPException(status_code=404, detail=f"User with uid '{uid}' is not in a session!")
     
     # If host left and there was a guest (abandoned), re-queue the guest
     if res['status'] == 'abandoned' and res['guest_uid']:
@@ -212,7 +359,8 @@ def _leave_session(uid: str, db: Session):
             RETURNING *
         """)
         res = db.execute(clear_guest_stmt, {"session_id": res['id']}).mappings().first()
-    
+
+    _invalidate_session_on_commit(res["id"], db)
     return res
 
 def _add_chat_message(session_id: str, author_uid: str, content: str, db: Session) -> Mapping:
@@ -249,4 +397,37 @@ def _add_chat_message(session_id: str, author_uid: str, content: str, db: Sessio
         "content": content
     }).mappings().first()
     
-    return res
\ No newline at end of file
+    return res
+
+ADD_CHAT_MESSAGES_STMT = text("""
+    INSERT INTO sessions.chats (id, session_id, author_uid, receiver_uid, content, created_at)
+    SELECT *
+    FROM unnest(
+        CAST(:ids AS uuid[]),
+        CAST(:session_ids AS uuid[]),
+        CAST(:author_uids AS uuid[]),
+        CAST(:receiver_uids AS uuid[]),
+        CAST(:contents AS text[]),
+        CAST(:created_ats AS timestamptz[])
+    )
+    ON CONFLICT (id) DO NOTHING
+""")
+
+def _add_chat_messages(messages: list[Mapping], db: Session) -> int:
+    """
+    Persist a batch of chat messages (id, session_id, author_uid, receiver_uid, content, created_at) in one INSERT.
+    Ids are generated by the caller, so re-inserting a batch after a failed commit won't duplicate messages.
+    Session / membership checks are the caller's job (see 'services/chat_writer.py').
+    """
+    if not messages:
+        return 0
+
+    res = db.execute(ADD_CHAT_MESSAGES_STMT, {
+        "ids": [m["id"] for m in messages],
+        "session_ids": [m["session_id"] for m in messages],
+        "author_uids": [m["author_uid"] for m in messages],
+        "receiver_uids": [m["receiver_uid"] for m in messages],
+        "contents": [m["content"] for m in messages],
+        "created_ats": [m["created_at"] for m in messages]
+    })
+    return res.rowcount
@@ -1,17 +1,21 @@
+from datetime import datetime
+
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 from fastapi import HTTPException
 from fastapi.encoders import jsonable_encoder
 
 from schemas.user import UserInfoSchema
+from middleware.identity import identity_for
+
+USER_EXISTS_STMT = text("SELECT 1 FROM users.users WHERE id = :id LIMIT 1")
 
 def _user_exists(uid: str, db: Session) -> bool:
-    return bool(
-        db.execute(
-            text("SELECT 1 FROM users.users WHERE id = :id LIMIT 1"),
-            {"id": uid}
-        ).scalar()
-    )
+    """Answered once per request for the caller (see 'middleware/identity.py'), one query for anyone else"""
+    identity = identity_for(uid)
+    if identity:
+        return identity.user_exists(db)
+    return bool(db.execute(USER_EXISTS_STMT, {"id": uid}).scalar())
     
 def _create_user(uid: str, phone: str, db: Session):
     stmt = text("""
@@ -22,63 +26,59 @@ def _create_user(uid: str, phone: str, db: Session):
     user = db.execute(stmt, {"id": uid, "phone": phone})
     return user
 
+GET_USER_STMT = text("""
+    SELECT * FROM users.users WHERE id = :uid LIMIT 1
+""")
+
 def _get_user_by_id(uid: str, db: Session):
     """Private helper to fetch user by ID"""
-    stmt = text("""
-        SELECT * FROM users.users WHERE id = :uid LIMIT 1
-    """)
-    return db.execute(stmt, {"uid": uid}).mappings().first()
+    return db.execute(GET_USER_STMT, {"uid": uid}).mappings().first()
 
-def _set_user_online(uid: str, db: Session):
-    """Sets the user's online status to True and updates last seen timestamp."""
-    if not _user_exists(uid=uid, db=db):
-        # User not found; typically acceptable during socket connect if user is new,
-        # but we need to ensure the user is created elsewhere if they don't exist.
-        return None 
-    
-    stmt = text("""
-        UPDATE users.users 
-        SET is_online = TRUE, last_seen_at = now()
-        WHERE id = :uid
-        RETURNING id
-    """)
-    res = db.execute(stmt, {"uid": uid}).mappings().first()
-    return res
+SET_USERS_PRESENCE_STMT = text("""
+    UPDATE users.users AS u
+    SET is_online = p.is_online, last_seen_at = p.last_seen_at
+    FROM unnest(
+        CAST(:uids AS uuid[]),
+        CAST(:is_online AS boolean[]),
+        CAST(:last_seen_at AS timestamptz[])
+    ) AS p(uid, is_online, last_seen_at)
+    WHERE u.id = p.uid
+    AND (u.last_seen_at IS NULL OR u.last_seen_at <= p.last_seen_at)
+""")
 
-def _set_user_offline(uid: str, db: Session):
-    """Sets the user's online status to False and updates last seen timestamp."""
-    if not _user_exists(uid=uid, db=db):
-        return None 
+def _set_users_presence(changes: list[tuple[str, bool, datetime]], db: Session) -> int:
+    """
+    Write a batch of (uid, is_online, last_seen_at) in one UPDATE. A change older than the user's stored 'last_seen_at'
+    is skipped, so a late write (e.g. from another worker) can't undo a newer one. Unknown uids are ignored.
+    """
+    if not changes:
+        return 0
 
-    stmt = text("""
-        UPDATE users.users 
-        SET is_online = FALSE, last_seen_at = now()
-        WHERE id = :uid
-        RETURNING id
-    """)
-    res = db.execute(stmt, {"uid": uid}).mappings().first()
-    return res
+    res = db.execute(SET_USERS_PRESENCE_STMT, {
+        "uids": [uid for uid, _, _ in changes],
+        "is_online": [is_online for _, is_online, _ in changes],
+        "last_seen_at": [last_seen_at for _, _, last_seen_at in changes],
+    })
+    return res.rowcount
 
 def _toggle_user_pause(uid: str, db: Session):
     """Private helper to toggle user's paused status"""
-    if not _user_exists(uid=uid, db=db):
-        raise HTTPException(status_code=404, detail="User not found")
-
     stmt = text("""
         UPDATE users.users 
         SET paused = NOT paused
         WHERE id = :uid
         RETURNING *
     """)
-    return db.execute(stmt, {"uid": uid}).mappings().first()
+    user = db.execute(stmt, {"uid": uid}).mappings().first()
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user
 
 
 def _update_user_info(payload: UserInfoSchema, uid: str, db: Session):
     """Private helper to update user's non-changeable info (first use only)"""
-    if not _user_exists(uid=uid, db=db):
-        raise HTTPException(status_code=404, detail="User not found")
-    
     payload = jsonable_encoder(payload)
+    # Fields already set keep their value, so the row comes back whether or not anything changed
     stmt = text("""
         UPDATE users.users AS u
         SET
@@ -86,26 +86,23 @@ def _update_user_info(payload: UserInfoSchema, uid: str, db: Session):
         last_name  = COALESCE(NULLIF(u.last_name,  ''), :ln),
         birthdate  = COALESCE(u.birthdate, :dob)
         WHERE u.id = :uid
-        AND (
-            u.first_name IS NULL OR u.first_name = '' OR
-            u.last_name  IS NULL OR u.last_name  = '' OR
-            u.birthdate  IS NULL
-        )
-        RETURNING first_name, last_name, birthdate
+        RETURNING *
     """)
-    
-    db.execute(stmt, {"fn": payload.get("fname"), "ln": payload.get("lname"), "dob": payload.get("dob"), "uid": uid})
-    return _get_user_by_id(uid, db)
 
-def _soft_delete_user(uid: str, db: Session):
-    """Private helper to soft delete user by setting deleted_at timestamp"""
-    if not _user_exists(uid=uid, db=db):
+    user = db.execute(stmt, {"fn": payload.get("fname"), "ln": payload.get("lname"), "dob": payload.get("birthdate"), "uid": uid}).mappings().one_or_none()
+    if user is None:
         raise HTTPException(status_code=404, detail="User not found")
+    return user
 
+def _soft_delete_user(uid: str, db: Session):
+    """Private helper to soft delete user by setting deleted_at timestamp"""
     stmt = text("""
         UPDATE users.users 
         SET deleted_at = now()
         WHERE id = :uid
         RETURNING *
     """)
-    return db.execute(stmt, {"uid": uid}).mappings().first()
\ No newline at end of file
+    user = db.execute(stmt, {"uid": uid}).mappings().first()
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user
\ No newline at end of file
@@ -1,3 +1,6 @@
+import asyncio
+import logging
+
 from fastapi_socketio import SocketManager
 from fastapi import FastAPI, APIRouter, Depends
 from fastapi.staticfiles import StaticFiles
@@ -13,17 +16,46 @@ from routers.private.profile import router as private_profile_router
 from routers.private.user import router as private_user_router
 from routers.private.matchmaking import router as private_matchmaking_router
 
-from models.db import get_db
+from models.db import get_db, async_engine
+from middleware.identity import identity_context
+from middleware.auth import metrics_auth
 from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import Session
 from config import settings
-from services.sockets import register_socket_handlers
+from services.sockets import register_socket_handlers, socket_registry
+from services.socket_registry import create_client_manager
+from services.matchmaker import matchmaker
+from services.chat_writer import chat_writer
+from services.presence import presence
+from services.session_invalidations import session_invalidations
+from services.lookups import lookups
+from services.images import shutdown_image_pool
+from services.supabase import close_storage_http
+from services.metrics import collect_metrics
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # startup
+    try:
+        await asyncio.to_thread(lookups.load)
+    except SQLAlchemyError as e:
+        logging.error(f"Failed to preload lookup tables, they will load on first use: {e}")
+    await socket_registry.start()
+    await session_invalidations.start()
+    await matchmaker.start()
+    await chat_writer.start()
+    await presence.start()
     yield
     # shutdown
+    await matchmaker.stop()
+    await chat_writer.stop()
+    await presence.stop() # Before the registry closes, it checks who is still connected
+    await socket_registry.close()
+    await session_invalidations.stop()
+    await asyncio.to_thread(shutdown_image_pool)
+    await close_storage_http()
+    await async_engine.dispose()
 
 public_router = APIRouter(tags=["Public"])
 public_router.include_router(public_auth_router) 
@@ -31,7 +63,8 @@ public_router.include_router(public_user_router)
 public_router.include_router(public_profile_router)
 
 
-private_router = APIRouter(tags=["Private"])
+# Every private endpoint shares one lazy existence check of the caller's user / profile / preferences (see 'middleware/identity.py')
+private_router = APIRouter(tags=["Private"], dependencies=[Depends(identity_context)])
 private_router.include_router(private_user_router)
 private_router.include_router(private_profile_router)
 private_router.include_router(private_matchmaking_router)
@@ -47,7 +80,8 @@ socket_manager = SocketManager(
     app=app, 
     cors_allowed_origins=origins,
     async_mode='asgi',
-    mount_location='/socket.io'
+    mount_location='/socket.io',
+    client_manager=create_client_manager(settings.redis_url)
 )
 
 register_socket_handlers(socket_manager)
@@ -61,6 +95,13 @@ app.add_middleware(
 )
 
 
+# Internal only: needs the 'metrics_token' setting as bearer token, and is left out of the API docs
+@app.get("/metrics", include_in_schema=False, dependencies=[Depends(metrics_auth)])
+def get_metrics():
+    """Runtime stats reported by the services (matchmaker pairs per tick, tick duration, wait times...)."""
+    return collect_metrics()
+
+
 app.include_router(private_router) # private needs to be mounted before public
 app.include_router(public_router)
 
@@ -1,10 +1,17 @@
-from fastapi import Depends, HTTPException
+import hashlib
+import hmac
+import threading
+import time
+from collections import OrderedDict
+
+from fastapi import Depends, HTTPException, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from jose import jwt, JWTError
 from config import settings
+from services.metrics import register_metrics
 
 
-from typing import Annotated
+from typing import Annotated, Optional
 
 """
 THE PURPOSE OF THIS FILE IS TO VERIFY JWT INCOMING FROM THE USER. ALL API CALLS THAT UPDATE / INTERACT
@@ -12,18 +19,59 @@ WITH A USERS PROFILE REQUIRE US TO KNOW THAT THAT USER IS LOGGED IN & AUTHENTICA
 AND DECODE THEIR JWT AGAINST OUR "SOURCE OF TRUTH" SECRET FROM SUPABASE
 
 THIS IS USED IN EVERY API ENDPOINT THAT INTERACTS WITH A USER PROFILE WITH THE PARAMS 'def foo(uid: str = Depends(auth_user))'
+
+A TOKEN THAT VERIFIED ONCE IS REMEMBERED (BY ITS SHA-256, NEVER THE TOKEN ITSELF) UNTIL IT EXPIRES, SO THE SAME TOKEN
+ISN'T RE-DECODED BY EVERY DEPENDENCY, POLL AND SOCKET CONNECT. FAILED TOKENS ARE NEVER CACHED
 """
 
 SECRET = settings.supabase_jwt_secret
 SECURITY = HTTPBearer(auto_error=True)
+OPTIONAL_SECURITY = HTTPBearer(auto_error=False)
+
+JWT_CACHE_MAX_ENTRIES = 10000
+JWT_CACHE_MAX_SECONDS = 300 # Tokens without an 'exp' claim are only trusted this long
+
+_jwt_cache: OrderedDict[str, tuple[float, dict]] = OrderedDict() # token hash -> (valid until, claims), least recently used first
+_jwt_cache_lock = threading.Lock()
+_jwt_cache_stats = {"hits": 0, "misses": 0}
+
+register_metrics("jwt_cache", lambda: {**_jwt_cache_stats, "size": len(_jwt_cache)})
+
+
+def verify_jwt(token: str) -> dict:
+    """Verified claims of a Supabase access token. Raises JWTError if the token is invalid or expired."""
+    key = hashlib.sha256(token.encode()).hexdigest()
+    now = time.time()
+
+    with _jwt_cache_lock:
+        cached = _jwt_cache.get(key)
+        if cached and cached[0] > now:
+            _jwt_cache.move_to_end(key)
+            _jwt_cache_stats["hits"] += 1
+            return cached[1]
+        if cached:
+            del _jwt_cache[key]
+        _jwt_cache_stats["misses"] += 1
 
-def auth_user(creds: Annotated[HTTPAuthorizationCredentials, Depends(SECURITY)]) -> str:
+    claims = jwt.decode(token, SECRET, algorithms=["HS256"], audience="authenticated")
+    valid_until = claims.get("exp") or now + JWT_CACHE_MAX_SECONDS
+
+    with _jwt_cache_lock:
+        _jwt_cache[key] = (valid_until, claims)
+        _jwt_cache.move_to_end(key)
+        while len(_jwt_cache) > JWT_CACHE_MAX_ENTRIES:
+            _jwt_cache.popitem(last=False)
+    return claims
+
+
+def auth_user(request: Request, creds: Annotated[HTTPAuthorizationCredentials, Depends(SECURITY)]) -> str:
     try:
-        payload = jwt.decode(creds.credentials, SECRET, algorithms=["HS256"], audience="authenticated")
+        payload = verify_jwt(creds.credentials)
         sub = payload.get("sub")
         if not sub:
             raise ValueError("Missing sub")
         print("User authenticated successfully!")
+        request.state.uid = sub # Lets 'get_db' know whose writes it committed
         return sub # user_id (UUID)
     except (JWTError, ValueError):
         print("User failed to authenticate!")
@@ -31,13 +79,24 @@ def auth_user(creds: Annotated[HTTPAuthorizationCredentials, Depends(SECURITY)])
 
 def get_user_jwt(creds: Annotated[HTTPAuthorizationCredentials, Depends(SECURITY)]) -> str:
     try:
-        jwt.decode(
-            creds.credentials,
-            SECRET,
-            algorithms=["HS256"],
-            audience="authenticated",
-        )
+        verify_jwt(creds.credentials)
         return creds.credentials
     except (JWTError, ValueError):
         print("User failed to authenticate!")
-        raise HTTPException(status_code=401, detail="Invalid or expired authorization token")
\ No newline at end of file
+        raise HTTPException(status_code=401, detail="Invalid or expired authorization token")
+
+def optional_auth_user(creds: Annotated[Optional[HTTPAuthorizationCredentials], Depends(OPTIONAL_SECURITY)]) -> Optional[str]:
+    """uid of the caller if they sent a valid token, else None. Never raises, endpoints needing a login use 'auth_user'."""
+    if not creds:
+        return None
+    try:
+        return verify_jwt(creds.credentials).get("sub")
+    except JWTError:
+        return None
+
+def metrics_auth(creds: Annotated[Optional[HTTPAuthorizationCredentials], Depends(OPTIONAL_SECURITY)]):
+    """Only lets internal callers presenting the 'metrics_token' setting through. Without the setting the endpoint doesn't exist (404)."""
+    if not settings.metrics_token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not creds or not hmac.compare_digest(creds.credentials.encode(), settings.metrics_token.encode()):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
@@ -0,0 +1,72 @@
+from contextvars import ContextVar
+from typing import Annotated, Optional
+
+from fastapi import Depends
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from middleware.auth import auth_user
+
+"""
+THE PURPOSE OF THIS FILE IS TO CHECK WHAT EXISTS FOR THE CALLER (USER ROW, PROFILE, PREFERENCES) ONCE PER REQUEST,
+INSTEAD OF EVERY CONTROLLER ON THE WAY RE-RUNNING ITS OWN 'SELECT 1' (E.G. '_profile_exists' ALSO CHECKING THE USER,
+THEN '_update_profile_interests' CHECKING THE USER AGAIN).
+
+EVERY PRIVATE ENDPOINT GETS AN Identity THROUGH 'identity_context' (ADDED TO THE PRIVATE ROUTER IN main.py). IT IS
+LAZY: NOTHING IS QUERIED UNTIL A CONTROLLER ASKS, THEN ALL THREE FLAGS COME BACK IN ONE QUERY. CONTROLLERS CALL
+'identity_for(uid)', WHICH IS THE REQUEST'S Identity WHEN 'uid' IS THE CALLER, AND None FOR ANY OTHER UID / OUTSIDE A
+REQUEST (SOCKETS, WORKERS), WHERE THEY RUN THEIR OWN QUERY. A CONTROLLER THAT CREATES ONE OF THESE ROWS UPDATES THE
+FLAG WITH 'Identity.mark'
+"""
+
+IDENTITY_STMT = text("""
+    SELECT
+        EXISTS(SELECT 1 FROM users.users WHERE id = :uid) AS user_exists,
+        EXISTS(SELECT 1 FROM profiles.profiles WHERE uid = :uid) AS profile_exists,
+        EXISTS(SELECT 1 FROM users.preferences WHERE uid = :uid) AS prefs_exist
+""")
+
+
+class Identity:
+    def __init__(self, uid: str):
+        self.uid = uid
+        self._flags: Optional[dict[str, bool]] = None
+
+    def _load(self, db: Session) -> dict[str, bool]:
+        if self._flags is None:
+            self._flags = dict(db.execute(IDENTITY_STMT, {"uid": self.uid}).mappings().one())
+        return self._flags
+
+    def user_exists(self, db: Session) -> bool:
+        return self._load(db)["user_exists"]
+
+    def profile_exists(self, db: Session) -> bool:
+        return self._load(db)["profile_exists"]
+
+    def prefs_exist(self, db: Session) -> bool:
+        return self._load(db)["prefs_exist"]
+
+    def mark(self, **flags: bool):
+        """Record a row this request just created / deleted, e.g. 'mark(profile_exists=True)'. No-op if nothing was loaded yet."""
+        if self._flags is not None:
+            self._flags.update(flags)
+
+
+_current_identity: ContextVar[Optional[Identity]] = ContextVar("current_identity", default=None)
+
+
+async def identity_context(uid: Annotated[str, Depends(auth_user)]) -> Identity:
+    """
+    Router dependency starting the caller's Identity for this request. Async on purpose: it runs in the request's own
+    task, so the context var is seen by the (threadpool) endpoint and its controllers, and dies with the request.
+    """
+    identity = Identity(uid)
+    _current_identity.set(identity)
+    return identity
+
+
+def identity_for(uid: str) -> Optional[Identity]:
+    identity = _current_identity.get()
+    if identity is not None and identity.uid == str(uid):
+        return identity
+    return None
@@ -0,0 +1,16 @@
+-- Pre-parsed location columns so matchmaking reads floats instead of parsing profiles.location text on every match.
+-- location_cell is the grid cell id from services/geo.py ('cell_id'), e.g. '163:-297'.
+-- Existing rows are filled in by running 'python -m scripts.backfill_locations' from the /api folder.
+
+ALTER TABLE profiles.profiles
+    ADD COLUMN IF NOT EXISTS location_lat double precision,
+    ADD COLUMN IF NOT EXISTS location_lon double precision,
+    ADD COLUMN IF NOT EXISTS location_cell text;
+
+ALTER TABLE sessions.matchmaking_queue
+    ADD COLUMN IF NOT EXISTS location_lat double precision,
+    ADD COLUMN IF NOT EXISTS location_lon double precision,
+    ADD COLUMN IF NOT EXISTS location_cell text;
+
+CREATE INDEX IF NOT EXISTS matchmaking_queue_location_cell_idx
+    ON sessions.matchmaking_queue (location_cell);
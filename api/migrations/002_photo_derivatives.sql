@@ -0,0 +1,5 @@
+-- Resized WebP copies of each photo made by services/images.py, as {"thumb": path, "card": path, "full": path}.
+-- Photos uploaded before this column existed have none and are served from their original path.
+
+ALTER TABLE profiles.photos
+    ADD COLUMN IF NOT EXISTS derivatives jsonb;
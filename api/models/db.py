@@ -1,11 +1,36 @@
+import logging
+import threading
+import time
+from typing import Annotated, Optional
+
+from fastapi import Depends, Request
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.exc import OperationalError, TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
 from config import settings
+from middleware.auth import optional_auth_user
+from models.pools import TimedAsyncQueuePool, TimedQueuePool, instrument_engine
+from models.query_stats import instrument_queries
+from services.metrics import register_metrics
 
 """
 THE PURPOSE OF THIS FILE IS TO CREATE A REUSABLE SINGLETON SESSION WITH THE SUPABASE DATABASE
 IT IS USED IN ALL DATABASE DEPENDENT API ENDPOINTS VIA THE PARAM 'def foo(db: Session = Depends(get_db))'
 
+ASYNC ENDPOINTS THAT SHOULDN'T TIE UP A THREAD PER REQUEST USE THE asyncpg VERSION INSTEAD,
+'def foo(db: AsyncSession = Depends(get_async_db))', WITH 'await db.execute(...)'
+
+POOL SIZES COME FROM THE 'db_pool_*' SETTINGS. WITH 'db_separate_pools' ON, SOCKET HANDLERS ('SocketSessionLocal')
+AND BACKGROUND WORKERS ('BackgroundSessionLocal') GET THEIR OWN SMALL POOLS SO A BURST OF ONE CAN'T STARVE THE OTHERS,
+OTHERWISE THEY SHARE THE API'S.
+
+ENDPOINTS THAT ONLY READ USE 'get_read_db', WHICH GOES TO THE READ REPLICA ('db_replica_url') WHEN THERE IS ONE. IT
+FALLS BACK TO THE PRIMARY WHEN THE REPLICA CAN'T BE REACHED, AND FOR 'read_your_writes_seconds' AFTER A USER'S WRITE
+(SO THEY SEE THEIR OWN CHANGE DESPITE REPLICA LAG). WRITES ARE NOTED PER PROCESS BY 'get_db' / 'get_async_db'.
+
+EVERY POOL REPORTS ITS STATS UNDER 'db_pools' ON '/metrics' (SEE 'models/pools.py')
+
 IT HAS A VERBOSE SAFETY ROLLBACK ALTHOUGH THIS IS REDUNDANT BECAUSE WHEN USING THE DATABASE YOU SHOULD
 USE 'with db.begin():' WHICH AUTOMATICALLY COMMITS IF NO EXCEPTIONS / ROLLBACK IF THERE ARE EXCEPTIONS
 """
@@ -22,8 +47,39 @@ if not all([USER, PASSWORD, HOST, PORT, DBNAME]):
 # SQLAlchemy string w/ SSL required for Supabase
 DATABASE_URL = f"postgresql+psycopg2://{USER}:{PASSWORD}@{HOST}:{PORT}/{DBNAME}?sslmode=require"
 
+def _pool_options(name: str, pool_size: int, max_overflow: int) -> dict:
+    return {
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+        "pool_logging_name": name,
+    }
+
+def _instrument(engine):
+    instrument_engine(engine)
+    if settings.db_query_stats:
+        instrument_queries(engine)
+
+def _create_engine(name: str, pool_size: int, max_overflow: int = 0, url: str = DATABASE_URL):
+    engine = create_engine(url, poolclass=TimedQueuePool, future=True, **_pool_options(name, pool_size, max_overflow))
+    _instrument(engine)
+    return engine
+
 # An Engine, which the Session will use for connection
-engine = create_engine(DATABASE_URL, pool_pre_ping=True, future=True)
+engine = _create_engine("api", pool_size=settings.db_pool_size, max_overflow=settings.db_max_overflow)
+
+if settings.db_separate_pools:
+    socket_engine = _create_engine("sockets", pool_size=settings.db_socket_pool_size)
+    background_engine = _create_engine("background", pool_size=settings.db_background_pool_size)
+else:
+    socket_engine = background_engine = engine
+
+if settings.db_replica_url:
+    read_engine = _create_engine("replica", pool_size=settings.db_pool_size, max_overflow=settings.db_max_overflow, url=settings.db_replica_url)
+else:
+    read_engine = engine
 
 # Session generator
 # https://docs.sqlalchemy.org/en/20/orm/session_basics.html
@@ -31,15 +87,104 @@ engine = create_engine(DATABASE_URL, pool_pre_ping=True, future=True)
 As such it also has its own sessionmaker.begin() method, analogous to Engine.begin(), which returns a Session object 
 and also maintains a begin/commit/rollback block"""
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
+SocketSessionLocal = sessionmaker(bind=socket_engine, autoflush=False, autocommit=False, future=True)
+BackgroundSessionLocal = sessionmaker(bind=background_engine, autoflush=False, autocommit=False, future=True)
+ReadSessionLocal = sessionmaker(bind=read_engine, autoflush=False, autocommit=False, future=True)
+
+REPLICA_RETRY_SECONDS = 30 # After the replica fails to connect, reads stay on the primary this long
+RECENT_WRITES_MAX_ENTRIES = 50000
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+_recent_writes: dict[str, float] = {} # uid -> reads go to the primary until (monotonic)
+_recent_writes_lock = threading.Lock()
+_replica_down_until = 0.0
+_read_stats = {"replica": 0, "primary": 0, "sticky": 0, "fallbacks": 0}
+
+register_metrics("db_reads", lambda: {**_read_stats, "sticky_users": len(_recent_writes), "replica_configured": read_engine is not engine})
+
+def _note_write(request: Request):
+    """Remember that the caller of a (non GET) request just committed, see 'read_your_writes_seconds'."""
+    uid = getattr(request.state, "uid", None)
+    if not uid or request.method in SAFE_METHODS or read_engine is engine or settings.read_your_writes_seconds <= 0:
+        return
+
+    now = time.monotonic()
+    with _recent_writes_lock:
+        if len(_recent_writes) >= RECENT_WRITES_MAX_ENTRIES:
+            for key in [key for key, until in _recent_writes.items() if until <= now]:
+                del _recent_writes[key]
+            if len(_recent_writes) >= RECENT_WRITES_MAX_ENTRIES:
+                _recent_writes.clear()
+        _recent_writes[uid] = now + settings.read_your_writes_seconds
+
+def _wrote_recently(uid: Optional[str]) -> bool:
+    until = _recent_writes.get(uid) if uid else None
+    return until is not None and until > time.monotonic()
+
+def _read_session(uid: Optional[str]) -> Session:
+    global _replica_down_until
+    if read_engine is engine or time.monotonic() < _replica_down_until:
+        _read_stats["primary"] += 1
+        return SessionLocal()
+    if _wrote_recently(uid):
+        _read_stats["sticky"] += 1
+        return SessionLocal()
+
+    db = ReadSessionLocal()
+    try:
+        db.connection() # Connect now, so a dead replica falls back here rather than failing the endpoint
+    except (OperationalError, PoolTimeoutError) as e:
+        db.close()
+        if isinstance(e, OperationalError):
+            _replica_down_until = time.monotonic() + REPLICA_RETRY_SECONDS
+        logging.warning(f"Read replica unavailable, reading from the primary: {e}")
+        _read_stats["fallbacks"] += 1
+        return SessionLocal()
+    _read_stats["replica"] += 1
+    return db
 
 # FastAPI dependency with verbose safety rollback and close if it fails
-def get_db():
+def get_db(request: Request):
     db = SessionLocal()
     try:
         yield db
         db.commit()
+        _note_write(request)
     except Exception:
         db.rollback()
         raise
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+# For endpoints that only read: 'def foo(db: Session = Depends(get_read_db))'. Nothing is committed
+def get_read_db(caller_uid: Annotated[Optional[str], Depends(optional_auth_user)]):
+    db = _read_session(caller_uid)
+    try:
+        yield db
+    finally:
+        db.close()
+
+# Same database through asyncpg, for endpoints that await the database instead of running it in a thread
+# asyncpg prepares statements on the server and reuses them per connection, psycopg2 can't (it only sends text)
+ASYNC_DATABASE_URL = f"postgresql+asyncpg://{USER}:{PASSWORD}@{HOST}:{PORT}/{DBNAME}?prepared_statement_cache_size={settings.db_prepared_statement_cache_size}"
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    poolclass=TimedAsyncQueuePool,
+    connect_args={"ssl": "require"},
+    **_pool_options("api_async", settings.db_pool_size, settings.db_max_overflow),
+)
+_instrument(async_engine.sync_engine)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+# Async version of 'get_db'. Like with any AsyncSession, only await one statement on it at a time
+async def get_async_db(request: Request):
+    db = AsyncSessionLocal()
+    try:
+        yield db
+        await db.commit()
+        _note_write(request)
+    except Exception:
+        await db.rollback()
+        raise
+    finally:
+        await db.close()
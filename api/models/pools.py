@@ -0,0 +1,101 @@
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from services.metrics import register_metrics
+
+"""
+THE PURPOSE OF THIS FILE IS TO SEE HOW THE DATABASE CONNECTION POOLS ARE DOING AT RUNTIME, UNDER 'db_pools' ON
+'/metrics'. FOR EVERY POOL (ONE PER ENGINE, NAMED BY ITS 'pool_logging_name') IT REPORTS HOW MANY CONNECTIONS ARE
+CHECKED OUT RIGHT NOW, HOW LONG CHECKOUTS WAITED, HOW OFTEN THE POOL HAD TO GO OVER 'pool_size' AND HOW OFTEN A
+CHECKOUT GAVE UP AFTER 'pool_timeout'.
+
+ENGINES USE IT BY PASSING 'poolclass=TimedQueuePool' (OR 'TimedAsyncQueuePool') AND CALLING 'instrument_engine'
+"""
+
+_pool_stats: dict[str, dict] = {}
+_pool_stats_lock = threading.Lock()
+_engines: dict[str, Engine] = {}
+
+
+def _stats(name: str) -> dict:
+    with _pool_stats_lock:
+        return _pool_stats.setdefault(name, {
+            "checkouts": 0,
+            "checkins": 0,
+            "overflow_events": 0, # Connections opened beyond 'pool_size'
+            "timeouts": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+        })
+
+
+class _TimedCheckout:
+    """Times every checkout, from asking the pool to having a connection (waiting on the queue or opening one)."""
+
+    def connect(self):
+        stats = _stats(self.logging_name)
+        overflow = self.overflow()
+        start = time.perf_counter()
+        try:
+            conn = super().connect()
+        except PoolTimeoutError:
+            stats["timeouts"] += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            stats["wait_seconds_total"] += waited
+            stats["wait_seconds_max"] = max(stats["wait_seconds_max"], waited)
+
+        # 'overflow' counts up from -pool_size as connections are opened, past 0 they are over 'pool_size'
+        if self.overflow() > max(overflow, 0):
+            stats["overflow_events"] += 1
+        return conn
+
+
+class TimedQueuePool(_TimedCheckout, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+    pass
+
+
+def instrument_engine(engine: Engine):
+    """Count checkouts / checkins of the engine's pool and report it under its logging name. Async engines pass '.sync_engine'."""
+    pool = engine.pool
+    name = pool.logging_name
+    stats = _stats(name)
+    _engines[name] = engine
+
+    @event.listens_for(pool, "checkout")
+    def _on_checkout(*args):
+        stats["checkouts"] += 1
+
+    @event.listens_for(pool, "checkin")
+    def _on_checkin(*args):
+        stats["checkins"] += 1
+
+
+def _pool_metrics() -> dict:
+    metrics = {}
+    for name, engine in _engines.items():
+        # Read through the engine, 'dispose()' swaps in a new pool (listeners carry over)
+        pool = engine.pool
+        stats = _stats(name)
+        metrics[name] = {
+            **stats,
+            "wait_ms_avg": round(stats["wait_seconds_total"] * 1e3 / stats["checkouts"], 3) if stats["checkouts"] else 0.0,
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": max(pool.overflow(), 0),
+        }
+    return metrics
+
+
+register_metrics("db_pools", _pool_metrics)
@@ -0,0 +1,84 @@
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from services.metrics import register_metrics
+
+"""
+THE PURPOSE OF THIS FILE IS TO TIME EVERY SQL STATEMENT THE ENGINES RUN, SPLIT INTO THE TIME SQLALCHEMY SPENDS
+BEFORE THE DRIVER GETS IT ('prepare': COMPILING OR FINDING THE COMPILED FORM IN ITS CACHE, BINDING PARAMS) AND THE
+TIME THE DRIVER / DATABASE TAKES ('db'). THE SLOWEST STATEMENTS IN TOTAL ARE SHOWN UNDER 'db_queries' ON '/metrics'.
+
+STATEMENTS ARE TRACKED BY THEIR SQL TEXT, SO A HOT QUERY SHOULD BE A MODULE LEVEL 'text()' (SEE THE CONTROLLERS),
+NOT ONE BUILT WITH DIFFERENT SQL PER CALL
+"""
+
+QUERY_STATS_MAX_STATEMENTS = 500 # Distinct statements tracked, the rest are only counted
+QUERY_STATS_TOP = 10
+
+_query_stats: dict[str, dict] = {} # sql -> stats
+_query_stats_lock = threading.Lock()
+_untracked = {"calls": 0}
+
+
+def _record(statement: str, prepare_seconds: float, db_seconds: float):
+    stats = _query_stats.get(statement)
+    if stats is None:
+        with _query_stats_lock:
+            if len(_query_stats) >= QUERY_STATS_MAX_STATEMENTS:
+                _untracked["calls"] += 1
+                return
+            stats = _query_stats.setdefault(statement, {
+                "sql": " ".join(statement.split())[:160],
+                "calls": 0,
+                "prepare_seconds": 0.0,
+                "db_seconds": 0.0,
+            })
+    stats["calls"] += 1
+    stats["prepare_seconds"] += prepare_seconds
+    stats["db_seconds"] += db_seconds
+
+
+def instrument_queries(engine: Engine):
+    """Time the statements run by 'engine'. Async engines pass '.sync_engine'."""
+
+    @event.listens_for(engine, "before_execute")
+    def _before_execute(conn, *args):
+        conn.info["query_started"] = time.perf_counter()
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info["query_sent"] = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        done = time.perf_counter()
+        sent = conn.info.pop("query_sent", done)
+        # Statements SQLAlchemy runs on its own (pre ping...) don't go through 'before_execute'
+        started = conn.info.pop("query_started", sent)
+        _record(statement, prepare_seconds=sent - started, db_seconds=done - sent)
+
+
+def reset_query_stats():
+    with _query_stats_lock:
+        _query_stats.clear()
+        _untracked["calls"] = 0
+
+
+def query_stats() -> list[dict]:
+    """Every tracked statement with its call count and average prepare (us) / db (ms) time, slowest in total first."""
+    with _query_stats_lock:
+        rows = [dict(stats) for stats in _query_stats.values()]
+    rows.sort(key=lambda stats: stats["prepare_seconds"] + stats["db_seconds"], reverse=True)
+    return [{
+        "sql": stats["sql"],
+        "calls": stats["calls"],
+        "total_ms": round((stats["prepare_seconds"] + stats["db_seconds"]) * 1e3, 3),
+        "avg_prepare_us": round(stats["prepare_seconds"] * 1e6 / stats["calls"], 1),
+        "avg_db_ms": round(stats["db_seconds"] * 1e3 / stats["calls"], 3),
+    } for stats in rows]
+
+
+register_metrics("db_queries", lambda: {"top": query_stats()[:QUERY_STATS_TOP], "statements": len(_query_stats), "untracked_calls": _untracked["calls"]})
@@ -8,7 +8,8 @@ from controllers.matchmaking import (
     _leave_queue, 
     _poll_for_match,
     MATCHMAKING_TIMEOUT_SECONDS,
-    MATCHMAKING_POLL_INTERVAL_SECONDS
+    MATCHMAKING_POLL_INTERVAL_SECONDS,
+    MATCHMAKING_SOCKET_EVENTS
 )
 
 router = APIRouter(prefix="/me")
@@ -28,7 +29,11 @@ def enqueue(uid: str = Depends(auth_user), db: Session = Depends(get_db)):
     """
     Join matchmaking queue.
     
-    After joining, frontend should:
+    After joining, results are pushed over the socket connection ('matchmaking_searching',
+    'match_found', 'matchmaking_host', 'matchmaking_timeout'). The socket event 'matchmaking_join'
+    does the same as this endpoint.
+
+    If the socket is not connected, frontend should fall back to:
     1. Start polling GET /matchmaking/me/poll every 3 seconds
     2. Show "Searching for match..." UI with countdown
     3. Continue until status is 'matched' or 'timeout'
@@ -41,6 +46,7 @@ def enqueue(uid: str = Depends(auth_user), db: Session = Depends(get_db)):
         "message": "Joined matchmaking queue",
         "queue_entry": dict(queue_entry),
         "next_steps": {
+            "socket_events": MATCHMAKING_SOCKET_EVENTS,
             "poll_endpoint": "/matchmaking/me/poll",
             "poll_interval_seconds": MATCHMAKING_POLL_INTERVAL_SECONDS,
             "timeout_seconds": MATCHMAKING_TIMEOUT_SECONDS
@@ -51,7 +57,8 @@ def enqueue(uid: str = Depends(auth_user), db: Session = Depends(get_db)):
 @router.get("/poll")
 def poll_for_match(uid: str = Depends(auth_user), db: Session = Depends(get_db)):
     """
-    Poll for match status. Frontend should call this every POLL_INTERVAL seconds.
+    Poll for match status. Only needed as a fallback when the socket connection is down,
+    otherwise the same statuses are pushed as socket events. Call this every POLL_INTERVAL seconds.
     
     Response status values:
     - 'searching': Still looking for match, keep polling
@@ -88,11 +95,12 @@ def dequeue(uid: str = Depends(auth_user), db: Session = Depends(get_db)):
 def get_matchmaking_config():
     """
     Get matchmaking configuration.
-    Frontend uses this to configure polling behavior.
+    Frontend uses this to know which socket events to listen for, and to configure fallback polling.
     """
     return {
         "timeout_seconds": MATCHMAKING_TIMEOUT_SECONDS,
         "poll_interval_seconds": MATCHMAKING_POLL_INTERVAL_SECONDS,
+        "socket_events": MATCHMAKING_SOCKET_EVENTS,
         "description": f"Poll every {MATCHMAKING_POLL_INTERVAL_SECONDS}s for up to {MATCHMAKING_TIMEOUT_SECONDS}s"
     }
 
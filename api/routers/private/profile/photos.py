@@ -1,47 +1,43 @@
-import asyncio
 from fastapi import APIRouter, File, UploadFile, Depends, HTTPException, Form
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from middleware.auth import auth_user, get_user_jwt
-from models.db import get_db
-from services.storage import upload_profile_photo, get_user_photos, delete_profile_photo, update_profile_photo, update_profile_photo_metadata
+from models.db import get_async_db
+from services.async_storage import upload_profile_photo, get_user_photos, delete_profile_photo, update_profile_photo, update_profile_photo_metadata
+from services.uploads import stage_upload
 
-from services.supabase import storage_for_user
+from services.supabase import async_storage_for_user
 
-from schemas.photos import PhotoMetaSchema, PhotoSchema, UpdatePhotoMetaSchema
-from typing import Annotated, List
+from schemas.photos import PhotoMetaSchema, PhotoSchema, UpdatePhotoMetaSchema, PhotoTierEnum
+from typing import Annotated, List, Optional
 
 
 router = APIRouter(prefix="/me/photos", tags=["Profile: Photos"])
 
 @router.get("", response_model=List[PhotoMetaSchema])
-async def get_profile_photos(uid: Annotated[str, Depends(auth_user)], user_jwt: Annotated[str, Depends(get_user_jwt)], db: Annotated[Session, Depends(get_db)]):
-    storage = storage_for_user(user_jwt=user_jwt)
-    result = await asyncio.to_thread(
-        get_user_photos,
+async def get_profile_photos(uid: Annotated[str, Depends(auth_user)], user_jwt: Annotated[str, Depends(get_user_jwt)], db: Annotated[AsyncSession, Depends(get_async_db)], tier: Optional[PhotoTierEnum] = None):
+    storage = async_storage_for_user(user_jwt=user_jwt)
+    result = await get_user_photos(
         uid=uid,
         db=db,
         storage=storage,
-        ttl_seconds=500
+        ttl_seconds=500,
+        tier=tier.value if tier else None
     )
 
     return result
 
 @router.post("")
-async def add_profile_photo(photo: UploadFile, user_jwt: Annotated[str, Depends(get_user_jwt)], uid: Annotated[str, Depends(auth_user)], db: Annotated[Session, Depends(get_db)]):
-    photo_bytes = await photo.read()
-    if not photo_bytes:
-        raise HTTPException(status_code=400, detail="Empty file uploaded")
+async def add_profile_photo(photo: UploadFile, user_jwt: Annotated[str, Depends(get_user_jwt)], uid: Annotated[str, Depends(auth_user)], db: Annotated[AsyncSession, Depends(get_async_db)]):
+    storage = async_storage_for_user(user_jwt=user_jwt)
 
-    storage = storage_for_user(user_jwt=user_jwt)
-
-    result = await asyncio.to_thread(
-        upload_profile_photo,
-        uid=uid,
-        file_bytes=photo_bytes,
-        mime_type=photo.content_type,
-        db=db,
-        storage=storage
-    )
+    # Read in chunks to a temp file (size limit, hash) and stream it to storage from there
+    with await stage_upload(photo) as upload:
+        result = await upload_profile_photo(
+            uid=uid,
+            upload=upload,
+            db=db,
+            storage=storage
+        )
 
     return {
         "message": "Photo uploaded successfully",
@@ -56,7 +52,7 @@ async def set_profile_photo(
     new_photo: UploadFile,
     user_jwt: Annotated[str, Depends(get_user_jwt)],
     uid: Annotated[str, Depends(auth_user)],
-    db: Annotated[Session, Depends(get_db)]
+    db: Annotated[AsyncSession, Depends(get_async_db)]
 ):
     # Convert JSON string to dict, then to PhotoSchema
     try:
@@ -65,20 +61,15 @@ async def set_profile_photo(
     except (json.JSONDecodeError, ValueError) as e:
         raise HTTPException(status_code=400, detail=f"Invalid photo data: {str(e)}")
     
-    new_photo_bytes = await new_photo.read()
-    if not new_photo_bytes:
-        raise HTTPException(status_code=400, detail="Empty file uploaded")
-    
-    storage = storage_for_user(user_jwt=user_jwt)
-    result = await asyncio.to_thread(
-        update_profile_photo,
-        photo=photo_schema,
-        uid=uid,
-        file_bytes=new_photo_bytes,
-        mime_type=new_photo.content_type,
-        db=db,
-        storage=storage
-    )
+    storage = async_storage_for_user(user_jwt=user_jwt)
+    with await stage_upload(new_photo) as upload:
+        result = await update_profile_photo(
+            photo=photo_schema,
+            uid=uid,
+            upload=upload,
+            db=db,
+            storage=storage
+        )
     
     return {
         "message": "Photo updated successfully",
@@ -90,12 +81,11 @@ async def set_profile_photo_metadata(
     data: UpdatePhotoMetaSchema,
     user_jwt: Annotated[str, Depends(get_user_jwt)],
     uid: Annotated[str, Depends(auth_user)],
-    db: Annotated[Session, Depends(get_db)]
+    db: Annotated[AsyncSession, Depends(get_async_db)]
 ):
-    storage = storage_for_user(user_jwt=user_jwt)
+    storage = async_storage_for_user(user_jwt=user_jwt)
     
-    result = await asyncio.to_thread(
-        update_profile_photo_metadata,
+    result = await update_profile_photo_metadata(
         photo=data.photo,
         metadata=data.metadata,
         uid=uid,
@@ -109,10 +99,9 @@ async def set_profile_photo_metadata(
     }
 
 @router.delete("")
-async def del_profile_photo(photo: PhotoSchema, user_jwt: Annotated[str, Depends(get_user_jwt)], uid: Annotated[str, Depends(auth_user)], db: Annotated[Session, Depends(get_db)]):
-    storage = storage_for_user(user_jwt=user_jwt)
-    result = await asyncio.to_thread(
-        delete_profile_photo,
+async def del_profile_photo(photo: PhotoSchema, user_jwt: Annotated[str, Depends(get_user_jwt)], uid: Annotated[str, Depends(auth_user)], db: Annotated[AsyncSession, Depends(get_async_db)]):
+    storage = async_storage_for_user(user_jwt=user_jwt)
+    result = await delete_profile_photo(
         photo=photo,
         uid=uid,
         db=db,
@@ -12,6 +12,8 @@ from .orientation import _orientation_name_to_id
 from .interests import _update_profile_interests
 
 from controllers.profile import _profile_exists, _get_profile
+from middleware.identity import identity_for
+from services.geo import location_columns
 
 router = APIRouter(prefix='/me')
 
@@ -40,6 +42,9 @@ def create_profile(payload: UserProfileSchema, uid: str = Depends(auth_user), db
         gender_id,
         orientation_id,
         location,
+        location_lat,
+        location_lon,
+        location_cell,
         location_label,
         show_precise_location,
         pronouns,
@@ -68,6 +73,9 @@ def create_profile(payload: UserProfileSchema, uid: str = Depends(auth_user), db
         :gender_id,
         :orientation_id,
         :location,
+        :location_lat,
+        :location_lon,
+        :location_cell,
         :location_label,
         :show_precise_location,
         :pronouns,
@@ -100,6 +108,7 @@ def create_profile(payload: UserProfileSchema, uid: str = Depends(auth_user), db
             "gender_id": gender_id,
             "orientation_id": orientation_id,
             "location": payload.get("location"),
+            **location_columns(payload.get("location")),
             "location_label": payload.get("location_label"),
             "show_precise_location": payload.get("show_precise_location"),
             "pronouns": payload.get("pronouns"),
@@ -121,6 +130,9 @@ def create_profile(payload: UserProfileSchema, uid: str = Depends(auth_user), db
             "sleep_schedule": payload.get("sleep_schedule"),
         },
     )
+    identity = identity_for(uid)
+    if identity:
+        identity.mark(profile_exists=True)
 
 """Used to update a user's profile information"""
 @router.put("")
@@ -148,6 +160,9 @@ def update_profile(
             gender_id = :gender_id,
             orientation_id = :orientation_id,
             location = :location,
+            location_lat = :location_lat,
+            location_lon = :location_lon,
+            location_cell = :location_cell,
             location_label = :location_label,
             show_precise_location = :show_precise_location,
             pronouns = :pronouns,
@@ -181,6 +196,7 @@ def update_profile(
             "gender_id": gender_id,
             "orientation_id": orientation_id,
             "location": payload.get("location"),
+            **location_columns(payload.get("location")),
             "location_label": payload.get("location_label"),
             "show_precise_location": payload.get("show_precise_location"),
             "pronouns": payload.get("pronouns"),
@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
-from models.db import get_db
+from models.db import get_read_db
 from middleware.auth import auth_user
 from schemas.preferences import InterestsEnum
 
@@ -16,13 +16,13 @@ router = APIRouter(tags=["Profile: Interests"])
 
 # API ENDPOINTS
 @router.get("/interests")
-def get_all_interest_options(db: Session = Depends(get_db)):
+def get_all_interest_options(db: Session = Depends(get_read_db)):
     return _get_all_interest_options(db=db)
 
 @router.get("/{target_uid}/interests")
 def get_user_profile_interests(
     target_uid: str,
     caller_uid: Annotated[str, Depends(auth_user)],
-    db: Annotated[Session, Depends(get_db)]
+    db: Annotated[Session, Depends(get_read_db)]
 ):
     return _get_profile_interests(uid=target_uid, db=db)
\ No newline at end of file
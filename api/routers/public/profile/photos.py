@@ -1,16 +1,14 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
 from middleware.auth import auth_user
-from models.db import get_db
+from models.db import get_async_db
 
-from schemas.photos import PhotoMetaSchema
-from typing import Annotated, List
+from schemas.photos import PhotoMetaSchema, PhotoTierEnum
+from typing import Annotated, List, Optional
 
-import asyncio
-from controllers.profile import _profile_exists
-from services.supabase import supabase_for_service
-from services.storage import get_user_photos
+from controllers.profile import _async_profile_exists
+from services.supabase import async_storage_for_service
+from services.async_storage import get_user_photos
 
 router = APIRouter(tags=["Profile: Photos"])
 
@@ -18,19 +16,20 @@ router = APIRouter(tags=["Profile: Photos"])
 async def get_user_profile_photos(
     target_uid: str,
     caller_uid: Annotated[str, Depends(auth_user)],
-    db: Annotated[Session, Depends(get_db)]
+    db: Annotated[AsyncSession, Depends(get_async_db)],
+    tier: Optional[PhotoTierEnum] = None
 ):
-    if not _profile_exists(target_uid, db=db):
+    """Approved photos of a user. Pass 'tier' (thumb / card / full) to get URLs of resized copies instead of the originals."""
+    if not await _async_profile_exists(target_uid, db=db):
         raise HTTPException(status_code=404, detail="Profile not found")
     # TODO: enforce blocks/visibility before fetching
 
-    storage = supabase_for_service.storage
-    result = await asyncio.to_thread(
-        get_user_photos,
+    storage = async_storage_for_service()
+    return await get_user_photos(
         storage=storage,
         uid=target_uid,
         db=db,
         ttl_seconds=500,
-        only_approved=True, 
+        only_approved=True,
+        tier=tier.value if tier else None,
     )
-    return result
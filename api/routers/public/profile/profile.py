@@ -1,18 +1,53 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
-from models.db import get_db
+from models.db import get_async_db, get_read_db
 from middleware.auth import auth_user
 
-from typing import Annotated
+from uuid import UUID
+from fastapi import Query
+from typing import Annotated, List
 from controllers.profile import _get_profile
+from schemas.profile import ProfileCardSchema
+from schemas.photos import PhotoTierEnum
+from services.supabase import async_storage_for_service
+from services.async_storage import get_profile_cards
+
+MAX_PROFILE_CARDS = 50
 
 router = APIRouter()
 
+# Must be declared before '/{target_uid}' so 'cards' isn't taken for a uid
+@router.get("/cards", response_model=List[ProfileCardSchema])
+async def get_user_profile_cards(
+    uids: Annotated[List[UUID], Query(min_length=1)],
+    caller_uid: Annotated[str, Depends(auth_user)],
+    db: Annotated[AsyncSession, Depends(get_async_db)],
+    tier: PhotoTierEnum = PhotoTierEnum.card
+):
+    """
+    Profile cards (user info, profile, gender, orientation, interests and signed photo URLs) for one or more users,
+    e.g. '/profile/cards?uids=<a>&uids=<b>'. Replaces calling '/profile/{uid}' and its gender, orientation,
+    interests and photos endpoints one by one. Users without a profile are left out. Photo URLs are for the
+    resized 'tier' (card by default).
+    """
+    if len(uids) > MAX_PROFILE_CARDS:
+        raise HTTPException(status_code=400, detail=f"Can only fetch up to {MAX_PROFILE_CARDS} profile cards at once!")
+    # TODO: enforce blocks/visibility before fetching
+
+    return await get_profile_cards(
+        storage=async_storage_for_service(),
+        uids=[str(uid) for uid in dict.fromkeys(uids)],
+        db=db,
+        ttl_seconds=500,
+        tier=tier.value,
+    )
+
 @router.get("/{target_uid}")
 def get_user_profile(
     target_uid: str,
     caller_uid: Annotated[str, Depends(auth_user)],
-    db: Annotated[Session, Depends(get_db)]
+    db: Annotated[Session, Depends(get_read_db)]
 ):
     return _get_profile(uid=target_uid, db=db)
\ No newline at end of file
@@ -5,7 +5,7 @@ from sqlalchemy import text
 from typing import Annotated
 from controllers.profile import _profile_exists
 from middleware.auth import auth_user
-from models.db import get_db
+from models.db import get_read_db
 
 from controllers.preferences import _update_user_prefs, _create_user_prefs, _get_user_prefs
 from schemas.preferences import UserProfilePreferencesSchema
@@ -18,6 +18,6 @@ router = APIRouter(tags=["User: Preferences"])
 def get_user_preferences(
     target_uid: str,
     caller_uid: Annotated[str, Depends(auth_user)],
-    db: Annotated[Session, Depends(get_db)]
+    db: Annotated[Session, Depends(get_read_db)]
 ):
     return _get_user_prefs(uid=target_uid, db=db)
\ No newline at end of file
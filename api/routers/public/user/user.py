@@ -1,7 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from sqlalchemy import text
-from models.db import get_db
+from models.db import get_read_db
 from middleware.auth import auth_user
 from sqlalchemy import text
 from typing import Annotated
@@ -13,6 +13,6 @@ router = APIRouter()
 def get_user_info(
     target_uid: str,
     caller_uid: Annotated[str, Depends(auth_user)],
-    db: Annotated[Session, Depends(get_db)]
+    db: Annotated[Session, Depends(get_read_db)]
 ):
     return _get_user_by_id(uid=target_uid, db=db)
\ No newline at end of file
@@ -1,5 +1,6 @@
 from pydantic import BaseModel, field_validator
 from .moderation_status import ModerationStatusEnum 
+from .tier import PhotoTierEnum
 from uuid import UUID
 from typing import Optional
 
@@ -0,0 +1,6 @@
+from enum import Enum
+
+class PhotoTierEnum(Enum):
+    thumb = "thumb" # Avatars in queue / chat views
+    card = "card" # Profile cards
+    full = "full" # Full screen
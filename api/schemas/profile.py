@@ -24,6 +24,7 @@ from .preferences.drink_frequency import DrinkFrequencyEnum
 from .preferences.smoke_frequency import SmokeFrequencyEnum
 from .preferences.sleep_schedule import SleepScheduleEnum
 from .preferences.zodiac_signs import ZodiacSignsEnum 
+from .photos import PhotoMetaSchema
 
 class UserProfileSchema(BaseModel):
     created_at: Optional[datetime] = None
@@ -64,3 +65,18 @@ class UserProfileSchema(BaseModel):
     smoke_frequency: Optional[SmokeFrequencyEnum] = None
     drink_frequency: Optional[DrinkFrequencyEnum] = None
     sleep_schedule: Optional[SleepScheduleEnum] = None
+
+
+class ProfileInterestSchema(BaseModel):
+    id: UUID
+    name: str
+
+class ProfileCardSchema(BaseModel):
+    """Everything needed to render someone's profile card, see 'GET /profile/cards'."""
+    uid: UUID
+    user: dict
+    profile: dict
+    gender: Optional[str] = None
+    orientation: Optional[str] = None
+    interests: List[ProfileInterestSchema] = []
+    photos: List[PhotoMetaSchema] = []
@@ -0,0 +1,75 @@
+from sqlalchemy import text
+
+from models.db import SessionLocal
+from services.geo import location_columns
+
+"""
+ONE-OFF COMMAND TO FILL IN THE PRE-PARSED LOCATION COLUMNS (SEE migrations/001_location_columns.sql) FOR PROFILES
+THAT WERE SAVED BEFORE THEY EXISTED, AND TO COPY THEM ONTO ANY MATCHMAKING QUEUE ENTRIES FOR THOSE USERS.
+
+RUN FROM THE /api FOLDER WITH 'python -m scripts.backfill_locations'. SAFE TO RE-RUN, ONLY ROWS WITHOUT A CELL ARE TOUCHED
+"""
+
+BATCH_SIZE = 500
+
+
+def backfill_profiles(db) -> int:
+    select_stmt = text("""
+        SELECT uid, location
+        FROM profiles.profiles
+        WHERE location IS NOT NULL
+        AND location_cell IS NULL
+        AND uid > :after
+        ORDER BY uid
+        LIMIT :limit
+    """)
+    update_stmt = text("""
+        UPDATE profiles.profiles
+        SET location_lat = :location_lat, location_lon = :location_lon, location_cell = :location_cell
+        WHERE uid = :uid
+    """)
+
+    updated = 0
+    after = "00000000-0000-0000-0000-000000000000"
+    while True:
+        rows = db.execute(select_stmt, {"after": after, "limit": BATCH_SIZE}).mappings().all()
+        if not rows:
+            return updated
+
+        params = [{"uid": row["uid"], **location_columns(row["location"])} for row in rows]
+        parsed = [p for p in params if p["location_cell"] is not None]
+        if parsed:
+            db.execute(update_stmt, parsed)
+        db.commit()
+
+        updated += len(parsed)
+        after = rows[-1]["uid"]
+        print(f"Parsed {len(parsed)}/{len(rows)} profile locations (up to uid {after})")
+
+
+def backfill_queue(db) -> int:
+    stmt = text("""
+        UPDATE sessions.matchmaking_queue q
+        SET location_lat = pr.location_lat, location_lon = pr.location_lon, location_cell = pr.location_cell
+        FROM profiles.profiles pr
+        WHERE pr.uid = q.uid
+        AND q.location_cell IS NULL
+        AND pr.location_cell IS NOT NULL
+    """)
+    updated = db.execute(stmt).rowcount
+    db.commit()
+    return updated
+
+
+def main():
+    db = SessionLocal()
+    try:
+        profiles = backfill_profiles(db)
+        queue = backfill_queue(db)
+        print(f"Backfilled {profiles} profiles and {queue} queue entries")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from typing import Any, Dict, List, Mapping, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from storage3 import AsyncStorageClient
+
+from controllers.profile import _get_profile_cards
+from schemas.photos import PhotoMetaSchema, PhotoSchema, PhotoMetadataSchema
+from schemas.profile import ProfileCardSchema
+from services.images import IMAGE_TIERS, render_tiers_async, tier_path
+from services.storage import (
+    BUCKET, BASE_PREFIX, MAX_PHOTOS, _mime_to_ext, _photo_url_path, _get_cached_signed_urls, _cache_signed_urls,
+    _parse_signed_urls, _count_signing_call, invalidate_signed_urls,
+)
+from services.uploads import StagedUpload
+
+"""
+THE PURPOSE OF THIS FILE IS TO BE THE PHOTO SERVICE BEHIND THE PHOTO AND CARD ENDPOINTS. STORAGE CALLS GO THROUGH AN
+AsyncStorageClient ('async_storage_for_user' OR 'async_storage_for_service') AND THE DATABASE THROUGH AN AsyncSession
+('get_async_db'), SO A REQUEST WAITING ON SUPABASE DOESN'T HOLD A THREAD. THE BUCKET LAYOUT AND THE CACHE OF SIGNED
+URLS ARE IN 'services/storage.py'.
+
+WHILE A PHOTO IS UPLOADED, THE ROW IS WRITTEN, THE IMAGE IS RESIZED AND THE ORIGINAL IS SENT TO STORAGE ALL AT
+ONCE. THAT'S SAFE BECAUSE THE ROW ONLY GETS COMMITTED IF EVERYTHING WORKED ('get_async_db' COMMITS AFTER THE
+ENDPOINT RETURNS), AND ANYTHING ALREADY IN STORAGE IS REMOVED AGAIN IF SOMETHING DIDN'T.
+UPDATES CHECK THE ROW BEFORE OVERWRITING ANYTHING, AN EXISTING FILE CAN'T BE PUT BACK ONCE REPLACED
+"""
+
+logger = logging.getLogger(__name__)
+
+
+async def _gather_all(*aws) -> list:
+    """Like 'asyncio.gather' but lets every task finish before raising the first error, so nothing is left running."""
+    results = await asyncio.gather(*aws, return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
+
+def _discard_rendered(rendered) -> None:
+    if isinstance(rendered, dict):
+        for local_path in rendered.values():
+            os.unlink(local_path)
+
+def _photo_meta(row: Mapping, url: Optional[str]) -> PhotoMetaSchema:
+    return PhotoMetaSchema(
+        id = row["id"],
+        mime_type = row.get("mime_type"),
+        size_bytes = row.get("size_bytes"),
+        path = row["path"],
+        url = url,
+        metadata=PhotoMetadataSchema(
+            slot = row.get("slot"),
+            is_primary = row["is_primary"],
+            moderation_status = row["moderation_status"],
+        )
+    )
+
+async def sign_paths(storage: AsyncStorageClient, paths: List[str], ttl_seconds: int = 500) -> Dict[str, Optional[str]]:
+    """
+    Signed URLs for many paths in the bucket as {path: url}. URLs signed earlier with the same TTL are reused
+    while enough of their life is left, the rest are signed with a single storage call.
+    """
+    if not paths:
+        return {}
+
+    now = time.monotonic()
+    url_map, missing = _get_cached_signed_urls(paths, ttl_seconds=ttl_seconds, now=now)
+    if not missing:
+        return url_map
+
+    _count_signing_call()
+    signed = _parse_signed_urls(await storage.from_(BUCKET).create_signed_urls(missing, ttl_seconds))
+    _cache_signed_urls(signed, ttl_seconds=ttl_seconds, signed_at=now)
+    url_map.update(signed)
+    return url_map
+
+async def _put_file(bucket, path: str, local_path: str, file_options: Dict[str, Any], update: bool = False):
+    with open(local_path, "rb") as file:
+        if update:
+            return await bucket.update(path=path, file=file, file_options=file_options)
+        return await bucket.upload(path=path, file=file, file_options=file_options)
+
+async def _upload_tiers(bucket, photo_path: str, rendered: Dict[str, str], replace: bool = False):
+    # Upsert rather than update, photos from before derivatives existed have nothing to replace yet
+    await _gather_all(*(
+        _put_file(bucket, tier_path(photo_path, tier), local_path, {"content-type": "image/webp", "upsert": "true" if replace else "false"})
+        for tier, local_path in rendered.items()
+    ))
+
+async def _remove_quietly(bucket, paths: List[str]):
+    """Best effort cleanup after a failed upload, the original error is the one worth raising."""
+    try:
+        await bucket.remove(paths)
+    except Exception:
+        logger.exception("Could not remove %s after a failed upload", paths)
+
+async def get_user_photos(
+    storage: AsyncStorageClient,
+    uid: str,
+    db: AsyncSession,
+    ttl_seconds: int = 500,
+    only_approved: bool = False,
+    tier: Optional[str] = None,
+) -> List[PhotoMetaSchema]:
+    """Photos of a user with signed URLs, for the resized 'tier' (thumb / card / full) when given, else the originals."""
+    where = ["uid = :uid"]
+    if only_approved:
+        where.append("moderation_status = 'approved'")
+
+    stmt = text(f"""
+        SELECT id, uid, path, derivatives, mime_type, size_bytes, slot, is_primary, moderation_status, created_at
+        FROM profiles.photos
+        WHERE {' AND '.join(where)}
+        ORDER BY is_primary DESC, created_at DESC
+    """)
+    rows = (await db.execute(stmt, {"uid": uid})).mappings().all()
+    if not rows:
+        return []
+
+    url_map = await sign_paths(storage=storage, paths=[_photo_url_path(r, tier) for r in rows], ttl_seconds=ttl_seconds)
+    return [_photo_meta(row, url_map.get(_photo_url_path(row, tier))) for row in rows]
+
+def _profile_cards(rows: List[Mapping], url_map: Dict[str, Optional[str]], tier: Optional[str]) -> List[ProfileCardSchema]:
+    """Cards out of PROFILE_CARDS_STMT rows, photos without a signed URL are left out."""
+    return [
+        ProfileCardSchema(
+            uid = row["uid"],
+            user = row["user_info"],
+            profile = row["profile"],
+            gender = row["gender"],
+            orientation = row["orientation"],
+            interests = row["interests"],
+            photos = [
+                _photo_meta(photo, url_map.get(_photo_url_path(photo, tier)))
+                for photo in row["photos"] if url_map.get(_photo_url_path(photo, tier))
+            ]
+        ) for row in rows
+    ]
+
+async def get_profile_cards(
+    storage: AsyncStorageClient,
+    uids: List[str],
+    db: AsyncSession,
+    ttl_seconds: int = 500,
+    tier: Optional[str] = "card",
+) -> List[ProfileCardSchema]:
+    """Profile cards of several users: one query for everything, one storage call to sign every photo."""
+    rows = await _get_profile_cards(uids=uids, db=db)
+    url_map = await sign_paths(
+        storage=storage,
+        paths=[_photo_url_path(photo, tier) for row in rows for photo in row["photos"]],
+        ttl_seconds=ttl_seconds,
+    )
+    return _profile_cards(rows, url_map, tier)
+
+async def _insert_photo(photo_id: uuid.UUID, uid: str, path: str, derivatives: Dict[str, str], upload: StagedUpload, slot: Optional[int], db: AsyncSession) -> Optional[Mapping]:
+    """The new photo's row, or None when the user already has MAX_PHOTOS."""
+    # Literally cannot get the database to handle this with RLS idk why
+    count = (await db.execute(text("SELECT count(*) FROM profiles.photos WHERE uid = :uid"), {"uid": uid})).scalar_one()
+    if count + 1 > MAX_PHOTOS:
+        return None
+
+    stmt = text("""
+        INSERT INTO profiles.photos
+            (id, uid, bucket, path, derivatives, mime_type, size_bytes, slot)
+        VALUES
+            (:photo_id, :uid, :bucket, :path, CAST(:derivatives AS jsonb), :mime_type, :size_bytes, :slot)
+        RETURNING *
+    """)
+    result = await db.execute(stmt, {"photo_id": photo_id, "uid": uid, "bucket": BUCKET, "path": path, "derivatives": json.dumps(derivatives), "mime_type": upload.mime_type, "size_bytes": upload.size_bytes, "slot": slot})
+    return result.mappings().one()
+
+async def upload_profile_photo(
+    uid: str,
+    upload: StagedUpload,
+    storage: AsyncStorageClient,
+    db: AsyncSession,
+    slot: Optional[int] = None,
+) -> PhotoMetaSchema:
+    """Store a staged upload as a new photo. Writes the row, resizes and uploads the original concurrently."""
+    mime_type = upload.mime_type
+    photo_id = uuid.uuid4()
+    path = f"{BASE_PREFIX}/{uid}/photos/{photo_id}{_mime_to_ext(mime_type)}"
+    derivatives = {tier: tier_path(path, tier) for tier in IMAGE_TIERS}
+
+    bucket = storage.from_(BUCKET)
+    original_options = {"content-type": mime_type, "upsert": False, "metadata": {"sha256": upload.sha256}}
+    row, rendered, uploaded = await asyncio.gather(
+        _insert_photo(photo_id=photo_id, uid=uid, path=path, derivatives=derivatives, upload=upload, slot=slot, db=db),
+        render_tiers_async(upload.path),
+        _put_file(bucket, path, upload.path, original_options),
+        return_exceptions=True,
+    )
+
+    try:
+        for result in (rendered, row, uploaded):
+            if isinstance(result, BaseException):
+                raise result
+        if not row:
+            raise HTTPException(status_code=400, detail=f"There can only be a maximum of {MAX_PHOTOS} per user!")
+        await _upload_tiers(bucket, photo_path=path, rendered=rendered)
+    except BaseException:
+        # The row is rolled back with the request, the files have to go by hand
+        await _remove_quietly(bucket, [path, *derivatives.values()])
+        raise
+    finally:
+        _discard_rendered(rendered)
+
+    url = (await sign_paths(storage=storage, paths=[path], ttl_seconds=300)).get(path)
+    return _photo_meta(row, url)
+
+async def delete_profile_photo(photo: PhotoSchema, uid: str, storage: AsyncStorageClient, db: AsyncSession):
+    stmt = text("""
+        DELETE FROM profiles.photos WHERE id = :id AND uid = :uid
+        RETURNING path, derivatives;
+    """)
+    row = (await db.execute(stmt, {"id": str(photo.id), "uid": uid})).mappings().first()
+    if not row:
+        raise HTTPException(status_code=404, detail=f"The photo with id '{photo.id}' does not exist!")
+
+    paths = [row["path"], *(row["derivatives"] or {}).values()]
+    res = await storage.from_(BUCKET).remove(paths)
+    for path in paths:
+        invalidate_signed_urls(path)
+    return res
+
+async def update_profile_photo(photo: PhotoSchema, upload: StagedUpload, uid: str, storage: AsyncStorageClient, db: AsyncSession) -> PhotoMetaSchema:
+    """Replace the file of a photo. The row is updated while the image is resized, files are only overwritten once both worked."""
+    derivatives = {tier: tier_path(photo.path, tier) for tier in IMAGE_TIERS}
+    mime_type = upload.mime_type
+
+    stmt = text("""
+        UPDATE profiles.photos
+        SET updated_at = now(),
+            size_bytes = :size_bytes,
+            mime_type = :mime_type,
+            derivatives = CAST(:derivatives AS jsonb)
+        WHERE id = :id AND uid = :uid AND path = :path
+        RETURNING *
+    """)
+    updated, rendered = await asyncio.gather(
+        db.execute(stmt, {"size_bytes": upload.size_bytes, "mime_type": mime_type, "derivatives": json.dumps(derivatives), "id": str(photo.id), "uid": uid, "path": photo.path}),
+        render_tiers_async(upload.path),
+        return_exceptions=True,
+    )
+
+    bucket = storage.from_(BUCKET)
+    try:
+        for result in (rendered, updated):
+            if isinstance(result, BaseException):
+                raise result
+        row = updated.mappings().one_or_none()
+        if not row:
+            raise HTTPException(status_code=404, detail=f"The photo with id '{photo.id}' does not exist!")
+
+        await _gather_all(
+            _put_file(bucket, photo.path, upload.path, {"content-type": mime_type, "upsert": True, "metadata": {"sha256": upload.sha256}}, update=True),
+            _upload_tiers(bucket, photo_path=photo.path, rendered=rendered, replace=True),
+        )
+    finally:
+        _discard_rendered(rendered)
+
+    # New content at the same path, don't keep handing out URLs that browsers may have cached the old image for
+    for path in [photo.path, *derivatives.values()]:
+        invalidate_signed_urls(path)
+    url = (await sign_paths(storage=storage, paths=[photo.path], ttl_seconds=300)).get(photo.path)
+    return _photo_meta(row, url)
+
+async def update_profile_photo_metadata(photo: PhotoSchema, metadata: PhotoMetadataSchema, storage: AsyncStorageClient, uid: str, db: AsyncSession) -> PhotoMetaSchema:
+    stmt = text("""
+        UPDATE profiles.photos
+        SET
+            updated_at = now(),
+            slot = COALESCE(:slot, slot),
+            moderation_status = COALESCE(:moderation_status, moderation_status),
+            is_primary = COALESCE(:is_primary, is_primary)
+        WHERE id = :id AND uid = :uid
+        RETURNING *
+    """)
+
+    row = (await db.execute(stmt, {"slot": metadata.slot, "moderation_status": metadata.moderation_status.value or None, "is_primary": metadata.is_primary, "id": str(photo.id), "uid": uid})).mappings().one_or_none()
+    if not row:
+        raise HTTPException(status_code=404, detail=f"The photo with id '{photo.id}' does not exist!")
+
+    url = (await sign_paths(storage=storage, paths=[photo.path], ttl_seconds=300)).get(photo.path)
+    return _photo_meta(row, url)
@@ -0,0 +1,196 @@
+import asyncio
+import logging
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Optional
+
+from fastapi import HTTPException
+from sqlalchemy.exc import OperationalError, InterfaceError, TimeoutError as PoolTimeoutError
+
+from config import settings
+from models.db import BackgroundSessionLocal
+from controllers.session import _add_chat_messages
+from services.metrics import register_metrics
+
+"""
+THE PURPOSE OF THIS FILE IS TO TAKE THE DATABASE OUT OF CHAT DELIVERY. THE 'chat_message' HANDLER BROADCASTS A
+MESSAGE STRAIGHT AWAY AND HANDS IT TO THE WRITER, WHICH BUFFERS MESSAGES AND INSERTS THEM INTO 'sessions.chats' IN
+BATCHES, EITHER WHEN 'chat_flush_size' MESSAGES ARE WAITING OR 'chat_flush_seconds' AFTER THE OLDEST ONE ARRIVED.
+
+- IDS AND TIMESTAMPS ARE ASSIGNED HERE WHEN A MESSAGE IS SUBMITTED, SO WHAT CLIENTS RECEIVE MATCHES WHAT IS STORED
+- BATCHES ARE WRITTEN ONE AT A TIME IN SUBMISSION ORDER. A BATCH THAT FAILS BECAUSE OF THE DATABASE (CONNECTION LOST,
+  POOL TIMEOUT) IS RETRIED (WITH BACKOFF) BEFORE ANYTHING NEWER IS WRITTEN, AND RE-INSERTING AN ALREADY WRITTEN ID IS A NO-OP
+- A BATCH THAT FAILS BECAUSE OF ITS CONTENT (E.G. A SESSION DELETED MEANWHILE, A VALUE POSTGRES REFUSES) IS SPLIT IN
+  HALVES UNTIL THE BAD MESSAGES ARE ALONE, THOSE ARE LOGGED AND DROPPED AND THE REST IS WRITTEN
+- THE BUFFER IS FLUSHED ON SHUTDOWN ('lifespan' IN main.py). IF IT FILLS UP (DATABASE DOWN) NEW MESSAGES ARE REFUSED
+"""
+
+CHAT_FLUSH_SIZE = settings.chat_flush_size
+CHAT_FLUSH_SECONDS = settings.chat_flush_seconds
+CHAT_MAX_BUFFERED = settings.chat_max_buffered
+RETRY_BACKOFF_SECONDS = [0.1, 0.5, 1, 2, 5] # Waits between retries of a failed batch, the last one repeats
+TRANSIENT_ERRORS = (OperationalError, InterfaceError, PoolTimeoutError, OSError) # Worth retrying, anything else is the batch's fault
+
+
+class ChatWriter:
+    def __init__(
+        self,
+        flush_size: int = CHAT_FLUSH_SIZE,
+        flush_seconds: float = CHAT_FLUSH_SECONDS,
+        max_buffered: int = CHAT_MAX_BUFFERED,
+    ):
+        self.flush_size = flush_size
+        self.flush_seconds = flush_seconds
+        self.max_buffered = max_buffered
+
+        self._buffer: list[dict] = []
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+        self._stats = {
+            "submitted": 0,
+            "written": 0,
+            "batches": 0,
+            "failed_batches": 0,
+            "dropped": 0,
+            "last_batch_size": 0,
+            "last_flush_seconds": 0.0,
+        }
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    @property
+    def stats(self) -> dict:
+        return {**self._stats, "buffered": len(self._buffer)}
+
+    async def start(self):
+        self._stopping = False
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Write everything still buffered, then stop."""
+        if not self._task:
+            return
+        self._stopping = True
+        self._wake.set()
+        await self._task
+        self._task = None
+
+    def submit(self, session_id: str, author_uid: str, receiver_uid: str, content: str) -> dict:
+        """
+        Queue a message to be written and return it with its id and created_at filled in, ready to broadcast.
+        Raises a 503 if too many messages are waiting to be written.
+        """
+        if not self.running:
+            raise HTTPException(status_code=503, detail="Chat is not available right now")
+        if len(self._buffer) >= self.max_buffered:
+            logging.error(f"Chat writer buffer full ({len(self._buffer)} messages), refusing message from {author_uid}")
+            raise HTTPException(status_code=503, detail="Chat is busy, try again in a moment")
+
+        message = {
+            "id": str(uuid.uuid4()),
+            "session_id": session_id,
+            "author_uid": author_uid,
+            "receiver_uid": receiver_uid,
+            "content": content.replace("\x00", ""), # Postgres text can't hold NUL characters
+            "created_at": datetime.now(timezone.utc),
+        }
+        self._buffer.append(message)
+        self._stats["submitted"] += 1
+        if len(self._buffer) == 1 or len(self._buffer) >= self.flush_size:
+            self._wake.set()
+        return message
+
+    async def _run(self):
+        while True:
+            if not self._buffer:
+                if self._stopping:
+                    return
+                # Nothing buffered, sleep until the first message arrives
+                await self._wake.wait()
+                self._wake.clear()
+                if self._buffer and not self._stopping and len(self._buffer) < self.flush_size:
+                    # Give the batch up to 'flush_seconds' to fill up
+                    try:
+                        await asyncio.wait_for(self._wake.wait(), timeout=self.flush_seconds)
+                    except asyncio.TimeoutError:
+                        pass
+                    self._wake.clear()
+                continue
+
+            try:
+                await self._flush()
+            except Exception as e:
+                # Never let the task die, 'submit' would refuse every message from then on
+                logging.exception(f"Chat writer flush failed unexpectedly: {e}")
+                await asyncio.sleep(RETRY_BACKOFF_SECONDS[-1])
+
+    async def _flush(self):
+        """Write the oldest buffered messages, retrying until they are stored (or dropped, see '_store')."""
+        batch = self._buffer[:self.flush_size]
+        started = time.perf_counter()
+        dropped = self._stats["dropped"]
+        if not await self._store(batch):
+            # Don't hold shutdown forever on a database that is down
+            logging.error(f"Giving up on {len(self._buffer)} unwritten chat messages at shutdown")
+            self._buffer.clear()
+            return
+
+        # Only drop the batch once it is stored, anything submitted meanwhile stays behind it
+        del self._buffer[:len(batch)]
+        self._stats["written"] += len(batch) - (self._stats["dropped"] - dropped)
+        self._stats["batches"] += 1
+        self._stats["last_batch_size"] = len(batch)
+        self._stats["last_flush_seconds"] = round(time.perf_counter() - started, 4)
+
+    async def _store(self, batch: list[dict]) -> bool:
+        """
+        Write 'batch', retrying database errors with backoff. A batch refused for its content is split in halves
+        (each written on its own) until the messages at fault are alone, those are dropped.
+        Returns False if it gave up because the writer is stopping.
+        """
+        attempt = 0
+        while True:
+            try:
+                await asyncio.to_thread(self._write, batch)
+                return True
+            except TRANSIENT_ERRORS as e:
+                self._stats["failed_batches"] += 1
+                if self._stopping and attempt >= len(RETRY_BACKOFF_SECONDS):
+                    return False
+                delay = RETRY_BACKOFF_SECONDS[min(attempt, len(RETRY_BACKOFF_SECONDS) - 1)]
+                logging.error(f"Failed to write {len(batch)} chat messages (attempt {attempt + 1}), retrying in {delay}s: {e}")
+                attempt += 1
+                await asyncio.sleep(delay)
+            except Exception as e:
+                self._stats["failed_batches"] += 1
+                if len(batch) == 1:
+                    message = batch[0]
+                    logging.error(
+                        f"Dropping chat message {message['id']} from {message['author_uid']} "
+                        f"in session {message['session_id']}, it can't be written: {e}"
+                    )
+                    self._stats["dropped"] += 1
+                    return True
+                half = len(batch) // 2
+                return await self._store(batch[:half]) and await self._store(batch[half:])
+
+    def _write(self, batch: list[dict]):
+        db = BackgroundSessionLocal()
+        try:
+            _add_chat_messages(messages=batch, db=db)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+
+chat_writer = ChatWriter()
+register_metrics("chat_writer", lambda: chat_writer.stats)
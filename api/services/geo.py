@@ -0,0 +1,193 @@
+import json
+import math
+from typing import Any, Dict, Hashable, Iterable, Optional
+
+"""
+THE PURPOSE OF THIS FILE IS TO BUCKET COORDINATES INTO A FIXED LAT/LON GRID SO THAT "WHO IS WITHIN X MILES OF ME"
+ONLY HAS TO LOOK AT THE HANDFUL OF CELLS AROUND A POINT INSTEAD OF EVERY USER IN THE QUEUE.
+
+- 'GeoGridIndex' IS THE LOCATION INDEX OF THE MATCHMAKER'S PREFILTER ('QueueIndex' IN services/matchmaker.py)
+- 'cell_id' / 'cell_ids_within' ARE WHAT THE SQL FALLBACK ('_find_compatible_session') FILTERS HOSTS ON
+- 'parse_location' / 'location_columns' TURN A PROFILE'S LOCATION TEXT INTO COORDINATES AND THE TYPED lat / lon / cell
+  COLUMNS (WHEN A PROFILE IS WRITTEN, AND BY scripts/backfill_locations.py)
+
+THE GRID ONLY NARROWS THINGS DOWN (A CELL CAN STICK OUT PAST THE RADIUS), THE EXACT HAVERSINE CHECK IN
+'controllers.matchmaking' STILL DECIDES WHETHER TWO USERS ARE CLOSE ENOUGH
+"""
+
+CELL_DEGREES = 0.25 # ~17 miles of latitude per cell
+MILES_PER_DEGREE_LAT = 69.0
+MAX_QUERY_CELLS = 2500 # Past this many cells a distance filter is no better than scanning everyone
+
+_LON_CELLS = round(360.0 / CELL_DEGREES)
+
+
+def cell_key(lat: float, lon: float) -> tuple[int, int]:
+    """Grid cell containing a point. Longitude wraps so cells either side of the antimeridian line up."""
+    lon_cell = math.floor(lon / CELL_DEGREES)
+    return (math.floor(lat / CELL_DEGREES), (lon_cell + _LON_CELLS // 2) % _LON_CELLS - _LON_CELLS // 2)
+
+
+def cell_id(lat: float, lon: float) -> str:
+    """Text form of 'cell_key', as stored in the 'location_cell' columns."""
+    lat_cell, lon_cell = cell_key(lat, lon)
+    return f"{lat_cell}:{lon_cell}"
+
+
+def cells_within(lat: float, lon: float, miles: float) -> Optional[list[tuple[int, int]]]:
+    """
+    Every cell overlapping the bounding box of a radius around a point.
+    Returns None when the box is too large (or reaches a pole) to be worth filtering on.
+    """
+    lat_span = miles / MILES_PER_DEGREE_LAT
+    if abs(lat) + lat_span >= 90.0:
+        return None
+
+    # Longitude degrees shrink towards the poles, so widen the box using the latitude furthest from the equator
+    lon_span = lat_span / math.cos(math.radians(abs(lat) + lat_span))
+    if lon_span >= 180.0:
+        return None
+
+    lat_cells = range(math.floor((lat - lat_span) / CELL_DEGREES), math.floor((lat + lat_span) / CELL_DEGREES) + 1)
+    lon_cells = range(math.floor((lon - lon_span) / CELL_DEGREES), math.floor((lon + lon_span) / CELL_DEGREES) + 1)
+    if len(lat_cells) * len(lon_cells) > MAX_QUERY_CELLS:
+        return None
+
+    half = _LON_CELLS // 2
+    return [(la, (lo + half) % _LON_CELLS - half) for la in lat_cells for lo in lon_cells]
+
+
+def cell_ids_within(lat: float, lon: float, miles: float) -> Optional[list[str]]:
+    """Text form of 'cells_within', for filtering on the 'location_cell' columns."""
+    cells = cells_within(lat, lon, miles)
+    if cells is None:
+        return None
+    return [f"{lat_cell}:{lon_cell}" for lat_cell, lon_cell in cells]
+
+
+def parse_location(location_text: str) -> Optional[tuple[float, float]]:
+    """
+    Parse location text to extract latitude and longitude.
+    
+    Supports formats:
+    - JSON string: '{"lat": 40.7128, "lng": -74.0060}'
+    - Comma-separated: '40.7128,-74.0060'
+    - Dict (if already parsed): {'lat': 40.7128, 'lng': -74.0060}
+    
+    Returns tuple of (latitude, longitude) or None if parsing fails.
+    """
+    if not location_text:
+        return None
+    
+    try:
+        # If it's a string, try to parse as JSON first
+        if isinstance(location_text, str):
+            # Try JSON format
+            if location_text.strip().startswith('{'):
+                loc_dict = json.loads(location_text)
+                lat = loc_dict.get('lat') or loc_dict.get('latitude')
+                lng = loc_dict.get('lng') or loc_dict.get('longitude') or loc_dict.get('lon')
+                if lat is not None and lng is not None:
+                    return (float(lat), float(lng))
+            
+            # Try comma-separated format
+            if ',' in location_text:
+                parts = location_text.split(',')
+                if len(parts) == 2:
+                    return (float(parts[0].strip()), float(parts[1].strip()))
+        
+        # If it's already a dict
+        elif isinstance(location_text, dict):
+            lat = location_text.get('lat') or location_text.get('latitude')
+            lng = location_text.get('lng') or location_text.get('longitude') or location_text.get('lon')
+            if lat is not None and lng is not None:
+                return (float(lat), float(lng))
+    
+    except (ValueError, json.JSONDecodeError, KeyError, AttributeError):
+        return None
+    
+    return None
+
+
+def location_columns(location_text: str) -> Dict[str, Any]:
+    """
+    Parse location text once (when a profile is written) into the typed columns
+    stored on profiles.profiles and copied into the matchmaking queue snapshot.
+    """
+    coords = parse_location(location_text)
+    if not coords:
+        return {"location_lat": None, "location_lon": None, "location_cell": None}
+
+    lat, lon = coords
+    return {"location_lat": lat, "location_lon": lon, "location_cell": cell_id(lat, lon)}
+
+
+class GeoGridIndex:
+    """
+    Maps grid cells to the keys (e.g. uids) located in them. Keys added without coordinates
+    are kept aside and returned by every query, since distance can't rule them out.
+    """
+
+    def __init__(self):
+        self._cells: dict[tuple[int, int], set[Hashable]] = {}
+        self._key_cells: dict[Hashable, Optional[tuple[int, int]]] = {}
+        self._unlocated: set[Hashable] = set()
+
+    def __len__(self) -> int:
+        return len(self._key_cells)
+
+    def add(self, key: Hashable, coords: Optional[tuple[float, float]]):
+        self.remove(key)
+        if coords is None:
+            self._unlocated.add(key)
+            self._key_cells[key] = None
+            return
+
+        cell = cell_key(*coords)
+        self._cells.setdefault(cell, set()).add(key)
+        self._key_cells[key] = cell
+
+    def remove(self, key: Hashable):
+        if key not in self._key_cells:
+            return
+
+        cell = self._key_cells.pop(key)
+        if cell is None:
+            self._unlocated.discard(key)
+            return
+
+        bucket = self._cells.get(cell)
+        if bucket is not None:
+            bucket.discard(key)
+            if not bucket:
+                del self._cells[cell]
+
+    def cell(self, key: Hashable) -> Optional[tuple[int, int]]:
+        """Cell a key was added in, None if it was added without coordinates."""
+        return self._key_cells.get(key)
+
+    def query(self, coords: tuple[float, float], miles: float) -> Optional[set[Hashable]]:
+        """Keys that could be within 'miles' of a point, or None if the radius is too large to filter on."""
+        buckets = self.buckets(coords, miles)
+        if buckets is None:
+            return None
+        return set().union(*buckets)
+
+    def buckets(self, coords: tuple[float, float], miles: float) -> Optional[list[set[Hashable]]]:
+        """
+        Like 'query', but the (live, don't modify them) sets of keys per non-empty cell plus the unlocated keys,
+        for callers that walk them without building the union.
+        """
+        cells = cells_within(coords[0], coords[1], miles)
+        if cells is None:
+            return None
+        return self.buckets_in(cells)
+
+    def buckets_in(self, cells: Iterable[tuple[int, int]]) -> list[set[Hashable]]:
+        """'buckets' for cells the caller already has from 'cells_within'."""
+        found = [self._unlocated]
+        for cell in cells:
+            bucket = self._cells.get(cell)
+            if bucket:
+                found.append(bucket)
+        return found
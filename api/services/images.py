@@ -0,0 +1,94 @@
+import asyncio
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from fastapi import HTTPException
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+"""
+THE PURPOSE OF THIS FILE IS TO TURN AN UPLOADED PHOTO INTO THE SIZES CLIENTS ACTUALLY SHOW (SEE PhotoTierEnum), SO A
+CHAT AVATAR DOESN'T DOWNLOAD A 10 MB ORIGINAL. EVERY TIER IS A WEBP FITTED INSIDE A SQUARE OF ITS SIZE, ROTATED
+UPRIGHT AND WITHOUT ANY OF THE ORIGINAL'S METADATA (EXIF, GPS...).
+
+DECODING / RESIZING IS CPU BOUND, SO IT RUNS IN A SEPARATE PROCESS POOL ('render_tiers'), NOT ON THE EVENT LOOP OR
+THE THREADPOOL. THE POOL SPAWNS FRESH PROCESSES (NOT FORK) SINCE THE API PROCESS IS FULL OF THREADS
+"""
+
+IMAGE_TIERS = {
+    "thumb": 160,
+    "card": 640,
+    "full": 1600,
+}
+WEBP_QUALITY = 80
+MAX_IMAGE_PIXELS = 50_000_000 # Refuse decompression bombs
+
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        from config import settings
+        _pool = ProcessPoolExecutor(max_workers=settings.image_workers, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def shutdown_image_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
+
+
+def _render(src_path: str) -> dict[str, str]:
+    """Runs in a pool process. Writes every tier to its own temp file and returns {tier: temp path}."""
+    with Image.open(src_path) as img:
+        img = ImageOps.exif_transpose(img)
+        img = img.convert("RGBA" if img.mode in ("RGBA", "LA", "P") else "RGB")
+
+        rendered = {}
+        try:
+            for tier, size in IMAGE_TIERS.items():
+                copy = img.copy()
+                copy.thumbnail((size, size), Image.Resampling.LANCZOS)
+
+                fd, path = tempfile.mkstemp(prefix=f"{tier}-", suffix=".webp")
+                with os.fdopen(fd, "wb") as out:
+                    # Only pixels are written, no exif / icc / xmp from the original
+                    copy.save(out, format="WEBP", quality=WEBP_QUALITY, method=4)
+                rendered[tier] = path
+        except BaseException:
+            for path in rendered.values():
+                os.unlink(path)
+            raise
+        return rendered
+
+
+def render_tiers(src_path: str) -> dict[str, str]:
+    """
+    Render every tier of the image at 'src_path' in the process pool (blocks until done, call it off the event loop).
+    Returns {tier: temp file path}, delete them once uploaded. Raises a 400 if the file isn't a readable image.
+    """
+    try:
+        return _get_pool().submit(_render, src_path).result()
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError):
+        raise HTTPException(status_code=400, detail="Uploaded file is not a supported image!")
+
+
+async def render_tiers_async(src_path: str) -> dict[str, str]:
+    """Same as 'render_tiers', awaiting the process pool instead of blocking a thread on it."""
+    try:
+        return await asyncio.wrap_future(_get_pool().submit(_render, src_path))
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError):
+        raise HTTPException(status_code=400, detail="Uploaded file is not a supported image!")
+
+
+def tier_path(photo_path: str, tier: str) -> str:
+    """Bucket path of a tier, next to the original: 'profile/<uid>/photos/<id>.jpg' -> 'profile/<uid>/photos/<id>/card.webp'."""
+    base, _ = os.path.splitext(photo_path)
+    return f"{base}/{tier}.webp"
@@ -0,0 +1,116 @@
+import logging
+import threading
+import time
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from models.db import BackgroundSessionLocal
+from services.metrics import register_metrics
+
+"""
+THE PURPOSE OF THIS FILE IS TO KEEP THE SMALL, ALMOST STATIC OPTION TABLES (public.genders, public.orientations,
+public.interests) IN MEMORY, SO TURNING A NAME INTO AN ID (OR BACK) DOESN'T COST A DATABASE ROUND TRIP.
+
+THE TABLES ARE LOADED ON STARTUP ('lifespan' IN main.py) AND RELOADED WHEN OLDER THAN LOOKUP_TTL_SECONDS. LOOKING UP A
+NAME / ID THAT ISN'T KNOWN RELOADS THE TABLE ONCE (AT MOST EVERY LOOKUP_MISS_REFRESH_SECONDS) IN CASE IT WAS JUST ADDED.
+CALL 'lookups.refresh()' AFTER CHANGING ONE OF THESE TABLES TO PICK IT UP STRAIGHT AWAY
+"""
+
+LOOKUP_TABLES = {
+    "genders": "public.genders",
+    "orientations": "public.orientations",
+    "interests": "public.interests",
+}
+LOOKUP_TTL_SECONDS = 600
+LOOKUP_MISS_REFRESH_SECONDS = 5
+
+
+class LookupTable:
+    def __init__(self, rows: list[dict]):
+        self.rows = rows
+        self.by_name = {row["name"]: row["id"] for row in rows}
+        self.by_id = {str(row["id"]): row["name"] for row in rows}
+        self.loaded_at = time.monotonic()
+
+
+class LookupRegistry:
+    def __init__(self, tables: dict[str, str] = LOOKUP_TABLES):
+        self.tables = tables
+        self._loaded: dict[str, LookupTable] = {}
+        self._miss_refreshed_at: dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "reloads": 0}
+
+    @property
+    def stats(self) -> dict:
+        return {**self._stats, "tables": {name: len(table.rows) for name, table in self._loaded.items()}}
+
+    def load(self, db: Optional[Session] = None):
+        """(Re)load every table. Opens its own DB session when none is given."""
+        if db is not None:
+            for name in self.tables:
+                self._load_table(name, db)
+            return
+
+        db = BackgroundSessionLocal()
+        try:
+            self.load(db)
+        finally:
+            db.close()
+
+    def refresh(self, name: Optional[str] = None):
+        """Forget one table (or all), so it is reloaded the next time it's used."""
+        with self._lock:
+            if name is None:
+                self._loaded.clear()
+            else:
+                self._loaded.pop(name, None)
+
+    def _load_table(self, name: str, db: Session) -> LookupTable:
+        rows = db.execute(text(f"SELECT * FROM {self.tables[name]}")).mappings().all()
+        table = LookupTable([dict(row) for row in rows])
+        with self._lock:
+            self._loaded[name] = table
+            self._stats["reloads"] += 1
+        logging.info(f"Loaded {len(rows)} {name} lookups")
+        return table
+
+    def _table(self, name: str, db: Session) -> LookupTable:
+        table = self._loaded.get(name)
+        if table is None or time.monotonic() - table.loaded_at > LOOKUP_TTL_SECONDS:
+            table = self._load_table(name, db)
+        return table
+
+    def _lookup(self, name: str, mapping: str, key, db: Session):
+        table = self._table(name, db)
+        value = getattr(table, mapping).get(key)
+        if value is not None:
+            self._stats["hits"] += 1
+            return value
+
+        self._stats["misses"] += 1
+        now = time.monotonic()
+        if now - self._miss_refreshed_at.get(name, 0) < LOOKUP_MISS_REFRESH_SECONDS:
+            return None
+        self._miss_refreshed_at[name] = now
+        return getattr(self._load_table(name, db), mapping).get(key)
+
+    def rows(self, name: str, db: Session) -> list[dict]:
+        """Every row of a table, e.g. to list the options."""
+        return self._table(name, db).rows
+
+    def name_to_id(self, name: str, value: str, db: Session):
+        """Id of the row called 'value' in table 'name', or None if there is none."""
+        return self._lookup(name, "by_name", value, db)
+
+    def id_to_name(self, name: str, id, db: Session) -> Optional[str]:
+        """Name of the row with 'id' in table 'name', or None if there is none."""
+        if id is None:
+            return None
+        return self._lookup(name, "by_id", str(id), db)
+
+
+lookups = LookupRegistry()
+register_metrics("lookups", lambda: lookups.stats)
@@ -0,0 +1,584 @@
+import asyncio
+import itertools
+import logging
+import statistics
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy.exc import SQLAlchemyError
+
+from config import settings
+from models.db import BackgroundSessionLocal
+from controllers.matchmaking import (
+    _get_active_queue_entries,
+    _claim_session,
+    _claim_queue_entry,
+    _calculate_age_from_dob,
+    _profile_coords,
+    MATCHMAKING_TIMEOUT_SECONDS,
+    MATCHMAKING_POLL_INTERVAL_SECONDS,
+)
+from controllers.session import _create_matched_sessions, _create_session_from_queue
+from services.geo import GeoGridIndex, cells_within
+from services.scoring import build_columns, score_candidates, DEFAULT_AGE_MIN, DEFAULT_AGE_MAX
+from services.metrics import register_metrics
+
+"""
+THE PURPOSE OF THIS FILE IS TO KEEP THE MATCHMAKING QUEUE RESIDENT IN THE API PROCESS. QUEUED USERS ARE HELD
+IN MEMORY AND A BACKGROUND TASK PAIRS THEM ON A FIXED TICK. EACH TICK INDEXES THE QUEUE BY GENDER, AGE BUCKET AND
+LOCATION CELL ('QueueIndex'), SO ONLY USERS THAT CAN SATISFY SOMEONE'S PREFERENCES ARE SCORED AGAINST THEM.
+
+EVERY TICK RELOADS THE QUEUE WITH ONE QUERY (SO USERS QUEUED BY OTHER WORKERS ARE INCLUDED, UP TO 'max_batch' OF THE
+LONGEST WAITING), PAIRS THEM GREEDILY, LONGEST WAITING FIRST, EACH WITH THEIR BEST SCORING CANDIDATE ('_pair'), AND
+CREATES THE NEW SESSIONS IN BULK.
+PAIRING RUNS IN A THREAD ON A SNAPSHOT OF THE QUEUE, SO THE EVENT LOOP AND THE ENDPOINTS ARE NEVER HELD UP BY IT.
+
+POSTGRES IS ONLY USED FOR THE DURABLE WRITES (CREATING / JOINING SESSIONS AND REMOVING QUEUE ROWS), SO POLLING
+'/matchmaking/me/poll' IS ANSWERED FROM MEMORY. THE ENGINE IS STARTED AND STOPPED FROM THE 'lifespan' HOOK IN main.py
+
+RESULTS ARE PUSHED TO THE USER'S SOCKET AS THEY HAPPEN (POLLING IS ONLY A FALLBACK):
+- 'matchmaking_searching': still searching, sent every MATCHMAKING_POLL_INTERVAL_SECONDS
+- 'match_found': paired with someone, sent to both users
+- 'matchmaking_host': nobody was found in time, the user now hosts an open session
+- 'matchmaking_timeout': the queue entry expired without a match
+"""
+
+MATCHMAKER_TICK_SECONDS = settings.matchmaker_tick_seconds
+MATCHMAKER_MAX_BATCH = settings.matchmaker_max_batch
+AGE_BUCKET_YEARS = 5
+MAX_CANDIDATES_PER_USER = 64 # Prefiltered candidates scored per user per tick, bounds a tick's work on a large queue
+MAX_SCANNED_PER_USER = 512 # Index entries looked at per user per tick while collecting those candidates
+RECENT_WAITS = 1000 # How many matched users the median wait time is taken over
+RESULT_TTL_SECONDS = 120 # A matched / timeout result nobody polled for is dropped after this long
+
+
+@dataclass
+class QueueEntry:
+    uid: str
+    enqueued_at: datetime
+    expires_at: datetime
+    prefs: dict
+    profile: dict
+    mode_id: Optional[str] = None
+    age: int = 0
+    coords: Optional[tuple[float, float]] = None
+    session_id: Optional[str] = None # Set once the user timed out and is hosting an open session
+    notified_at: Optional[datetime] = None # Last 'matchmaking_searching' push
+
+    @classmethod
+    def from_row(cls, row) -> "QueueEntry":
+        """Build an entry from a queue row joined with the user's match profile."""
+        profile = {
+            "gender_id": str(row["gender_id"]) if row.get("gender_id") else None,
+            "dob": row.get("dob"),
+            "location": row.get("location"),
+            "location_lat": row.get("location_lat"),
+            "location_lon": row.get("location_lon"),
+        }
+        return cls(
+            uid=str(row["uid"]),
+            enqueued_at=row["enqueued_at"],
+            expires_at=row["expires_at"],
+            prefs=dict(row["prefs_snapshot"] or {}),
+            profile=profile,
+            mode_id=row.get("mode_id"),
+            age=_calculate_age_from_dob(profile["dob"]) if profile["dob"] else 0,
+            coords=_profile_coords(profile),
+            session_id=str(row["session_id"]) if row.get("session_id") else None,
+        )
+
+
+class QueueIndex:
+    """
+    Positions of a queue snapshot's unpaired users by gender, age bucket and location cell, used to narrow down
+    who a user can be paired with before scoring. Users without a gender / age / location are in every pool,
+    because the compatibility check skips those criteria.
+    """
+
+    def __init__(self, queue: list[QueueEntry]):
+        self._queue = queue
+        self._gender = [e.profile.get("gender_id") for e in queue]
+        self._target_gender = [_target_gender(e) for e in queue]
+        self._age = [e.age for e in queue]
+        self._age_range = [_age_range(e) for e in queue]
+        self._hosting = [e.session_id is not None for e in queue]
+
+        self._by_gender: dict[Optional[str], set[int]] = {}
+        self._by_age: dict[Optional[int], set[int]] = {}
+        self._by_location = GeoGridIndex()
+        for i, entry in enumerate(queue):
+            for index, key in self._keys(i):
+                index.setdefault(key, set()).add(i)
+            self._by_location.add(i, entry.coords)
+
+    def _keys(self, i: int):
+        age = self._age[i] // AGE_BUCKET_YEARS if self._age[i] > 0 else None
+        return ((self._by_gender, self._gender[i]), (self._by_age, age))
+
+    def remove(self, i: int):
+        self._by_location.remove(i)
+        for index, key in self._keys(i):
+            index.get(key, set()).discard(i)
+
+    def candidates(self, i: int, limit: int, max_scanned: int) -> list[int]:
+        """
+        Up to 'limit' unpaired users that pass both users' gender and age preferences and whose cell is within
+        user 'i's distance. Only the smallest of the gender / age / location pools is walked (at most 'max_scanned'
+        of its users), the other criteria are checked per user, so the work per call doesn't grow with the queue.
+        """
+        entry = self._queue[i]
+        gender, target_gender, age, hosting = self._gender[i], self._target_gender[i], self._age[i], self._hosting[i]
+        pools = []
+
+        genders = None
+        if target_gender:
+            genders = {target_gender, None}
+            pools.append([self._by_gender.get(target_gender, set()), self._by_gender.get(None, set())])
+
+        age_min, age_max = self._age_range[i]
+        age_buckets = set(range(max(age_min, 0) // AGE_BUCKET_YEARS, max(age_max, 0) // AGE_BUCKET_YEARS + 1))
+        pools.append([self._by_age.get(None, set()), *(self._by_age.get(b, set()) for b in age_buckets)])
+        age_buckets.add(None)
+
+        cells = None
+        if entry.coords:
+            max_distance = entry.prefs.get("max_distance") or 999999
+            nearby = cells_within(entry.coords[0], entry.coords[1], max_distance)
+            if nearby is not None:
+                cells = set(nearby)
+                pools.append(self._by_location.buckets_in(nearby))
+
+        pool = min(pools, key=lambda buckets: sum(map(len, buckets)))
+        found = []
+        for j in itertools.islice(itertools.chain.from_iterable(pool), max_scanned):
+            if j == i or (hosting and self._hosting[j]):
+                continue
+            if genders is not None and self._gender[j] not in genders:
+                continue
+            if gender and self._target_gender[j] and self._target_gender[j] != gender:
+                continue
+            if self._age[j] > 0 and self._age[j] // AGE_BUCKET_YEARS not in age_buckets:
+                continue
+            if age > 0 and not (self._age_range[j][0] <= age <= self._age_range[j][1]):
+                continue
+            cell = self._by_location.cell(j)
+            if cells is not None and cell is not None and cell not in cells:
+                continue
+            found.append(j)
+            if len(found) >= limit:
+                return found
+        return found
+
+
+def _target_gender(entry: QueueEntry) -> Optional[str]:
+    target_gender_id = entry.prefs.get("target_gender_id")
+    return str(target_gender_id) if target_gender_id else None
+
+
+def _age_range(entry: QueueEntry) -> tuple[int, int]:
+    age_min, age_max = entry.prefs.get("age_min"), entry.prefs.get("age_max")
+    return (DEFAULT_AGE_MIN if age_min is None else age_min, DEFAULT_AGE_MAX if age_max is None else age_max)
+
+
+class MatchmakingEngine:
+    def __init__(self, tick_seconds: float = MATCHMAKER_TICK_SECONDS, max_batch: int = MATCHMAKER_MAX_BATCH):
+        self.tick_seconds = tick_seconds
+        self.max_batch = max_batch
+        self.entries: dict[str, QueueEntry] = {}
+        self.results: dict[str, dict] = {} # Pending poll responses (matched / timeout) keyed by uid
+        self._result_times: dict[str, float] = {} # uid -> when its result was set (monotonic)
+
+        self._lock = threading.RLock() # Sync endpoints call in from the threadpool while ticks run on the loop
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+        self._recent_waits: deque[float] = deque(maxlen=RECENT_WAITS)
+        self._stats = {
+            "ticks": 0,
+            "queue_size": 0,
+            "pairs_last_tick": 0,
+            "pairs_total": 0,
+            "tick_seconds": 0.0,
+        }
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _load_queue(self):
+        db = BackgroundSessionLocal()
+        try:
+            return _get_active_queue_entries(db=db, limit=self.max_batch)
+        finally:
+            db.close()
+
+    def _sync(self, rows):
+        """
+        Bring memory in line with a fresh load of the queue. Entries that are already tracked keep their
+        state (hosted session, last push), and entries missing from the load are dropped unless the load was cut off at 'max_batch'.
+        """
+        loaded = {}
+        for row in rows:
+            entry = QueueEntry.from_row(row)
+            current = self.entries.get(entry.uid)
+            if current and current.enqueued_at == entry.enqueued_at:
+                entry.session_id = entry.session_id or current.session_id
+                entry.notified_at = current.notified_at
+            loaded[entry.uid] = entry
+
+        if len(rows) < self.max_batch:
+            for uid in set(self.entries) - set(loaded):
+                self.remove(uid)
+
+        for entry in loaded.values():
+            self.add(entry)
+
+    @property
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._stats,
+                "queue_size": len(self.entries),
+                "median_wait_seconds": statistics.median(self._recent_waits) if self._recent_waits else None,
+            }
+
+    # Queue state
+
+    def add(self, entry: QueueEntry):
+        with self._lock:
+            current = self.entries.pop(entry.uid, None)
+            if not current or current.enqueued_at != entry.enqueued_at:
+                # A new queue entry, whatever the user's last one ended with is stale
+                self._pop_result(entry.uid)
+            self.entries[entry.uid] = entry
+
+    def remove(self, uid: str) -> Optional[QueueEntry]:
+        with self._lock:
+            self._pop_result(uid)
+            return self.entries.pop(uid, None)
+
+    def _set_result(self, uid: str, result: dict):
+        with self._lock:
+            self.results[uid] = result
+            self._result_times[uid] = time.monotonic()
+
+    def _pop_result(self, uid: str) -> Optional[dict]:
+        with self._lock:
+            self._result_times.pop(uid, None)
+            return self.results.pop(uid, None)
+
+    def _expire_results(self):
+        cutoff = time.monotonic() - RESULT_TTL_SECONDS
+        with self._lock:
+            for uid in [uid for uid, set_at in self._result_times.items() if set_at <= cutoff]:
+                self._pop_result(uid)
+
+    # Polling
+
+    def poll(self, uid: str) -> Optional[dict]:
+        """
+        Answer a poll from memory. Returns None when the engine doesn't know about the user,
+        so the caller can fall back to the database.
+        """
+        with self._lock:
+            result = self.results.get(uid)
+            if result and result["status"] == "matched":
+                return self._pop_result(uid)
+            if result:
+                return result
+
+            entry = self.entries.get(uid)
+            if not entry:
+                return None
+
+            return self._searching_status(entry, datetime.utcnow())
+
+    def _searching_status(self, entry: QueueEntry, now: datetime) -> dict:
+        time_elapsed = (now - entry.enqueued_at).total_seconds()
+        return {
+            "status": "searching",
+            "message": "Still searching for a match...",
+            "time_elapsed": int(time_elapsed),
+            "time_remaining": max(int(MATCHMAKING_TIMEOUT_SECONDS - time_elapsed), 0),
+            "poll_again_in": MATCHMAKING_POLL_INTERVAL_SECONDS
+        }
+
+    # Ticking
+
+    async def _run(self):
+        while True:
+            try:
+                await self.tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Matchmaker tick failed: {e}")
+            await asyncio.sleep(self.tick_seconds)
+
+    async def tick(self):
+        started = time.perf_counter()
+        now = datetime.utcnow()
+
+        try:
+            rows = await asyncio.to_thread(self._load_queue)
+        except SQLAlchemyError as e:
+            logging.error(f"Matchmaker failed to load the queue, pairing from memory: {e}")
+            rows = None
+
+        with self._lock:
+            expired = [e for e in self.entries.values() if e.expires_at <= now]
+            for entry in expired:
+                self.remove(entry.uid)
+            self._expire_results()
+
+            if rows is not None:
+                self._sync(rows)
+            queue = list(self.entries.values())
+
+        pairs = await asyncio.to_thread(self._pair, queue, now)
+
+        with self._lock:
+            # Anyone who left, was matched elsewhere or re-queued while pairing ran keeps their new state
+            pairs = [
+                (host, guest) for host, guest in pairs
+                if self.entries.get(host.uid) is host and self.entries.get(guest.uid) is guest
+            ]
+            for host, guest in pairs:
+                self.remove(host.uid)
+                self.remove(guest.uid)
+
+            timed_out = [
+                e for e in self.entries.values()
+                if not e.session_id and (now - e.enqueued_at).total_seconds() >= MATCHMAKING_TIMEOUT_SECONDS
+            ]
+            searching = [
+                e for e in self.entries.values()
+                if not e.session_id and e not in timed_out
+                and (e.notified_at is None or (now - e.notified_at).total_seconds() >= MATCHMAKING_POLL_INTERVAL_SECONDS)
+            ]
+            for entry in searching:
+                entry.notified_at = now
+
+        for entry in expired:
+            await self.emit(entry.uid, "matchmaking_timeout", {
+                "message": "Matchmaking timed out. Join the queue again to keep searching."
+            })
+
+        matched = await asyncio.to_thread(self._persist_pairs, pairs) if pairs else []
+        for session, host, guest in matched:
+            self._recent_waits.extend((now - e.enqueued_at).total_seconds() for e in (host, guest))
+            await self._announce_match(session, host, guest)
+
+        for entry in timed_out:
+            session = await asyncio.to_thread(self._persist_host, entry)
+            if session:
+                result = {
+                    "status": "timeout",
+                    "role": "host",
+                    "session": session,
+                    "message": "No matches found. Created session as host. Waiting for a compatible user..."
+                }
+                self._set_result(entry.uid, result)
+                await self.emit(entry.uid, "matchmaking_host", result)
+
+        for entry in searching:
+            await self.emit(entry.uid, "matchmaking_searching", self._searching_status(entry, now))
+
+        duration = time.perf_counter() - started
+        with self._lock:
+            self._stats["ticks"] += 1
+            self._stats["pairs_last_tick"] = len(matched)
+            self._stats["pairs_total"] += len(matched)
+            self._stats["tick_seconds"] = round(duration, 4)
+        if matched:
+            stats = self.stats
+            logging.info(
+                f"Matchmaker tick: {len(matched)} pairs from {stats['queue_size'] + 2 * len(matched)} queued "
+                f"in {duration * 1000:.1f}ms, median wait {stats['median_wait_seconds']:.1f}s"
+            )
+
+    def _pair(self, queue: list[QueueEntry], now: datetime) -> list[tuple[QueueEntry, QueueEntry]]:
+        """
+        Pair a snapshot of the queue, without touching the engine (it runs in a thread). This is a greedy matching
+        in order of waiting time, not a maximum weight matching: users take turns from the longest waiting, each one
+        gets up to MAX_CANDIDATES_PER_USER unpaired candidates from a 'QueueIndex' (gender, age bucket and location
+        cell prefilter), and is paired with the compatible one of highest weight, i.e. how long they have waited
+        (in timeouts) plus their compatibility score. Two users both hosting a session are never paired.
+
+        The work per tick is at most queue size x (MAX_SCANNED_PER_USER index lookups + MAX_CANDIDATES_PER_USER
+        scored). A user whose capped candidates all fail the exact check stays queued for the next tick, even if a
+        compatible user was left unpaired.
+        """
+        if len(queue) < 2:
+            return []
+
+        # Positions in wait order, so the index's pools (sets of small ints) tend to yield the longest waiting first
+        waits = np.array([(now - e.enqueued_at).total_seconds() for e in queue]) / MATCHMAKING_TIMEOUT_SECONDS
+        order = np.argsort(-waits, kind="stable")
+        queue, waits = [queue[i] for i in order], waits[order]
+
+        columns = build_columns([(e.prefs, e.profile.get("gender_id"), e.age, e.coords) for e in queue])
+        index = QueueIndex(queue)
+        paired = np.zeros(len(queue), dtype=bool)
+
+        pairs = []
+        for i in range(len(queue)):
+            if paired[i]:
+                continue
+            paired[i] = True
+            index.remove(i)
+
+            candidates = np.array(index.candidates(i, MAX_CANDIDATES_PER_USER, MAX_SCANNED_PER_USER), dtype=np.intp)
+            if not len(candidates):
+                continue
+
+            mask, score = score_candidates(columns.take([i]), columns.take(candidates))
+            if not mask.any():
+                continue
+            j = candidates[np.argmax(np.where(mask, waits[candidates] + score, -np.inf))]
+            paired[j] = True
+            index.remove(j)
+
+            entry, other = queue[i], queue[j]
+            if other.session_id or (not entry.session_id and other.enqueued_at < entry.enqueued_at):
+                entry, other = other, entry # The user hosting (or waiting longest) is the host
+            pairs.append((entry, other))
+        return pairs
+
+    def _persist_pairs(self, pairs: list[tuple[QueueEntry, QueueEntry]]) -> list[tuple[dict, QueueEntry, QueueEntry]]:
+        """
+        Write a tick's pairs. Users that are both only queued get their sessions created in one bulk statement,
+        guests of users already hosting claim that session. Pairs that couldn't be written go back in the queue.
+        """
+        matched = []
+        fresh = [(host, guest) for host, guest in pairs if not host.session_id]
+        hosted = [(host, guest) for host, guest in pairs if host.session_id]
+
+        db = BackgroundSessionLocal()
+        try:
+            if fresh:
+                try:
+                    sessions = _create_matched_sessions(
+                        pairs=[(host.uid, guest.uid, host.mode_id) for host, guest in fresh],
+                        db=db
+                    )
+                    db.commit()
+                except SQLAlchemyError as e:
+                    db.rollback()
+                    logging.error(f"DB error creating {len(fresh)} matched sessions: {e}")
+                    sessions = []
+
+                by_host = {str(session["host_uid"]): session for session in sessions}
+                for host, guest in fresh:
+                    session = by_host.get(host.uid)
+                    if session:
+                        matched.append((jsonable_encoder(dict(session)), host, guest))
+                    else:
+                        # Another worker got to one of them first (or the write failed)
+                        self.add(host)
+                        self.add(guest)
+
+            for host, guest in hosted:
+                try:
+                    session = _claim_session(session_ids=[host.session_id], guest_uid=guest.uid, db=db)
+                    db.commit()
+                except SQLAlchemyError as e:
+                    db.rollback()
+                    logging.error(f"DB error pairing {host.uid} with {guest.uid}: {e}")
+                    self.add(host)
+                    self.add(guest)
+                    continue
+
+                if session:
+                    matched.append((jsonable_encoder(dict(session)), host, guest))
+                else:
+                    # The host's session is no longer joinable, but the guest can keep searching
+                    logging.warning(f"Matchmaker could not pair {host.uid} with {guest.uid}: session {host.session_id} was taken")
+                    self.add(guest)
+        finally:
+            db.close()
+
+        return matched
+
+    def _persist_host(self, entry: QueueEntry) -> Optional[dict]:
+        """
+        Make a timed out user host an open session. Every worker sees the same timed out rows, so the queue row is
+        claimed first: whoever doesn't get it (or finds the session already created) leaves it alone.
+        """
+        db = BackgroundSessionLocal()
+        try:
+            if not _claim_queue_entry(uid=entry.uid, db=db):
+                db.rollback()
+                return None
+            session = _create_session_from_queue(host_uid=entry.uid, mode_id=entry.mode_id, prefs_snapshot=entry.prefs, db=db)
+            db.commit()
+            entry.session_id = str(session["id"])
+            return jsonable_encoder(dict(session))
+        except HTTPException as e:
+            # Already in a session, e.g. another worker created it just before we got the row
+            db.rollback()
+            logging.info(f"Matchmaker skipped the host session for {entry.uid}: {e.detail}")
+            return None
+        except SQLAlchemyError as e:
+            db.rollback()
+            logging.error(f"Matchmaker could not create a host session for {entry.uid}: {e}")
+            return None
+        finally:
+            db.close()
+
+    async def _announce_match(self, session: dict, host: QueueEntry, guest: QueueEntry):
+        for entry, role in ((host, "host"), (guest, "guest")):
+            self._set_result(entry.uid, {
+                "status": "matched",
+                "role": role,
+                "session": session,
+                "message": "Match found!"
+            })
+            await self.emit(entry.uid, "match_found", {
+                "session_id": session["id"],
+                "session": session,
+                "host_uid": host.uid,
+                "guest_uid": guest.uid,
+                "role": role,
+                "message": "A match has been found!",
+            })
+
+    # Push notifications
+
+    async def emit(self, uid: str, event: str, payload: dict):
+        """Push an event to a user's sockets, if they are connected (to any worker)."""
+        from services.sockets import emit_to_user
+        try:
+            await emit_to_user(uid, event, payload)
+        except Exception as e:
+            logging.error(f"Failed to send '{event}' to {uid}: {e}")
+
+    def notify(self, uid: str, event: str, payload: dict):
+        """Thread-safe 'emit' for sync code, e.g. endpoints running in the threadpool."""
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.emit(uid, event, payload), self._loop)
+
+
+matchmaker = MatchmakingEngine()
+register_metrics("matchmaker", lambda: matchmaker.stats)
@@ -0,0 +1,26 @@
+import logging
+from typing import Callable
+
+"""
+THE PURPOSE OF THIS FILE IS TO HAVE ONE PLACE WHERE SERVICES REPORT RUNTIME NUMBERS (QUEUE SIZES, TIMINGS, CACHE HITS...)
+SO THEY CAN ALL BE READ FROM THE '/metrics' ENDPOINT. EACH SERVICE REGISTERS A FUNCTION THAT RETURNS ITS CURRENT STATS
+"""
+
+_sources: dict[str, Callable[[], dict]] = {}
+
+
+def register_metrics(name: str, source: Callable[[], dict]):
+    """Register (or replace) the function reporting the stats of the service called 'name'."""
+    _sources[name] = source
+
+
+def collect_metrics() -> dict:
+    """Current stats of every registered service. A failing source reports its error instead of breaking the rest."""
+    metrics = {}
+    for name, source in _sources.items():
+        try:
+            metrics[name] = source()
+        except Exception as e:
+            logging.error(f"Failed to collect '{name}' metrics: {e}")
+            metrics[name] = {"error": str(e)}
+    return metrics
@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from config import settings
+from models.db import BackgroundSessionLocal
+from controllers.user import _set_users_presence
+from services.metrics import register_metrics
+
+"""
+THE PURPOSE OF THIS FILE IS TO KEEP SOCKET CONNECTS / DISCONNECTS FROM WRITING TO 'users.users' ONE BY ONE. THE SOCKET
+HANDLERS TELL THE PRESENCE SERVICE WHEN A USER COMES ONLINE OR LOSES THEIR LAST SOCKET, AND IT WRITES 'is_online' /
+'last_seen_at' IN ONE BATCHED UPDATE EVERY 'presence_flush_seconds' (ONLY THE LATEST CHANGE PER USER).
+
+- A USER WHO LOSES THEIR LAST SOCKET STAYS ONLINE FOR 'presence_grace_seconds'. RECONNECTING WITHIN IT (A FLAKY MOBILE
+  CONNECTION, A PAGE REFRESH) WRITES NOTHING AT ALL. ONCE IT RUNS OUT THEY ARE WRITTEN OFFLINE AS OF THE DISCONNECT,
+  UNLESS THEY ARE CONNECTED THROUGH ANOTHER WORKER BY THEN
+- WHO IS CONNECTED COMES FROM THE SOCKET REGISTRY ('services/socket_registry.py', SHARED THROUGH REDIS WHEN
+  'redis_url' IS SET), SO 'is_online(uid)' NEVER TOUCHES POSTGRES
+- A BATCH THAT FAILS IS KEPT (UNLESS NEWER CHANGES CAME IN) AND RETRIED ON THE NEXT FLUSH. WHAT IS LEFT IS WRITTEN ON
+  SHUTDOWN ('lifespan' IN main.py), TREATING USERS STILL IN THEIR GRACE WINDOW AS OFFLINE
+"""
+
+PRESENCE_GRACE_SECONDS = settings.presence_grace_seconds
+PRESENCE_FLUSH_SECONDS = settings.presence_flush_seconds
+PRESENCE_FLUSH_SIZE = settings.presence_flush_size
+
+
+async def _is_connected(uid: str) -> bool:
+    # Lazy import, the socket handlers import this service
+    from services.sockets import socket_registry
+    return await socket_registry.is_connected(uid)
+
+
+class PresenceService:
+    def __init__(
+        self,
+        grace_seconds: float = PRESENCE_GRACE_SECONDS,
+        flush_seconds: float = PRESENCE_FLUSH_SECONDS,
+        flush_size: int = PRESENCE_FLUSH_SIZE,
+    ):
+        self.grace_seconds = grace_seconds
+        self.flush_seconds = flush_seconds
+        self.flush_size = flush_size
+
+        self._pending: dict[str, tuple[bool, datetime]] = {} # uid -> (is_online, last_seen_at) waiting to be written
+        self._grace: dict[str, tuple[float, datetime]] = {} # uid -> (offline after (monotonic), disconnected at)
+        self._stop: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self._stats = {
+            "connects": 0,
+            "disconnects": 0,
+            "debounced": 0, # Reconnects within the grace window, nothing written
+            "written": 0,
+            "batches": 0,
+            "failed_batches": 0,
+            "last_batch_size": 0,
+            "last_flush_seconds": 0.0,
+        }
+
+    @property
+    def stats(self) -> dict:
+        return {**self._stats, "pending": len(self._pending), "in_grace": len(self._grace)}
+
+    async def start(self):
+        self._stop = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Write every pending change (users in their grace window as offline), then stop."""
+        if not self._task:
+            return
+        self._stop.set()
+        await self._task
+        self._task = None
+
+    def connected(self, uid: str):
+        """A socket of 'uid' connected to this worker."""
+        self._stats["connects"] += 1
+        if self._grace.pop(uid, None) is not None:
+            self._stats["debounced"] += 1
+            return
+        self._pending[uid] = (True, datetime.now(timezone.utc))
+
+    def disconnected(self, uid: str):
+        """'uid' has no sockets left on any worker. They go offline once the grace window passes without a reconnect."""
+        self._stats["disconnects"] += 1
+        self._grace[uid] = (time.monotonic() + self.grace_seconds, datetime.now(timezone.utc))
+
+    async def is_online(self, uid: str) -> bool:
+        """Whether 'uid' is connected (or within their grace window on this worker), without a database query."""
+        return uid in self._grace or await _is_connected(uid)
+
+    async def _run(self):
+        while not self._stop.is_set():
+            try:
+                await asyncio.wait_for(self._stop.wait(), timeout=self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            await self._expire_grace(everyone=self._stop.is_set())
+            await self._flush(final=self._stop.is_set())
+
+    async def _expire_grace(self, everyone: bool = False):
+        """Queue the offline write of every user whose grace window ran out (or everyone's, on shutdown)."""
+        now = time.monotonic()
+        for uid, (offline_after, disconnected_at) in list(self._grace.items()):
+            if not everyone and offline_after > now:
+                continue
+            try:
+                # Reconnected through another worker in the meantime
+                if await _is_connected(uid):
+                    self._grace.pop(uid, None)
+                    continue
+            except Exception as e:
+                logging.error(f"Presence failed to check whether {uid} is still connected: {e}")
+                if not everyone:
+                    continue
+            # A reconnect while we were awaiting above already cleared the entry, and must win
+            if self._grace.pop(uid, None) is not None:
+                self._pending[uid] = (False, disconnected_at)
+
+    async def _flush(self, final: bool = False):
+        while self._pending:
+            batch = list(self._pending.items())[:self.flush_size]
+            for uid, _ in batch:
+                del self._pending[uid]
+
+            started = time.perf_counter()
+            try:
+                await asyncio.to_thread(self._write, [(uid, is_online, seen) for uid, (is_online, seen) in batch])
+            except SQLAlchemyError as e:
+                self._stats["failed_batches"] += 1
+                if final:
+                    logging.error(f"Giving up on {len(batch) + len(self._pending)} unwritten presence changes at shutdown: {e}")
+                    self._pending.clear()
+                    return
+                logging.error(f"Failed to write {len(batch)} presence changes, retrying on the next flush: {e}")
+                for uid, change in batch:
+                    self._pending.setdefault(uid, change) # A change made meanwhile is newer, keep that one
+                return
+
+            self._stats["written"] += len(batch)
+            self._stats["batches"] += 1
+            self._stats["last_batch_size"] = len(batch)
+            self._stats["last_flush_seconds"] = round(time.perf_counter() - started, 4)
+
+    def _write(self, changes: list[tuple[str, bool, datetime]]):
+        db = BackgroundSessionLocal()
+        try:
+            _set_users_presence(changes=changes, db=db)
+            db.commit()
+        except SQLAlchemyError:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+
+presence = PresenceService()
+register_metrics("presence", lambda: presence.stats)
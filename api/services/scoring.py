@@ -0,0 +1,138 @@
+from dataclasses import dataclass
+from typing import Optional, Sequence
+
+import numpy as np
+
+"""
+THE PURPOSE OF THIS FILE IS TO CHECK ONE USER AGAINST MANY MATCHMAKING CANDIDATES AT ONCE. EVERY CANDIDATE IS
+A ROW IN A SET OF NUMPY COLUMNS, SO THE GENDER / AGE / DISTANCE RULES OF '_are_preferences_compatible' RUN AS A
+HANDFUL OF ARRAY OPERATIONS INSTEAD OF A PYTHON LOOP THAT RE-PARSES DATES AND LOCATIONS FOR EVERY PAIR.
+
+THE MASK RETURNED HERE MUST ALWAYS AGREE WITH '_are_preferences_compatible', IF YOU CHANGE A RULE THERE CHANGE IT HERE TOO
+"""
+
+EARTH_RADIUS_MILES = 3958.8
+
+# Same fallbacks '_are_preferences_compatible' uses when a preference is missing
+DEFAULT_AGE_MIN = 18
+DEFAULT_AGE_MAX = 99
+DEFAULT_MAX_DISTANCE = 999999
+
+# Gender ids are UUID strings, numpy compares small ints much faster. 0 means "not set".
+_gender_codes: dict[str, int] = {}
+
+
+def _gender_code(gender_id: Optional[str]) -> int:
+    if not gender_id:
+        return 0
+    gender_id = str(gender_id)
+    code = _gender_codes.get(gender_id)
+    if code is None:
+        code = _gender_codes.setdefault(gender_id, len(_gender_codes) + 1)
+    return code
+
+
+def _pref(prefs: dict, key: str, default):
+    value = prefs.get(key)
+    return default if value is None else value
+
+
+@dataclass
+class UserColumns:
+    """Columnar view of users. Unknown age is 0, unknown gender is 0 and unknown coordinates are NaN."""
+    age: np.ndarray
+    gender: np.ndarray
+    target_gender: np.ndarray
+    lat: np.ndarray # radians
+    lon: np.ndarray # radians
+    max_distance: np.ndarray
+    age_min: np.ndarray
+    age_max: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.age)
+
+    def take(self, idx) -> "UserColumns":
+        return UserColumns(**{name: column[idx] for name, column in vars(self).items()})
+
+
+def build_columns(users: Sequence[tuple[dict, Optional[str], int, Optional[tuple[float, float]]]]) -> UserColumns:
+    """
+    Build columns from (prefs, gender_id, age, (lat, lon) in degrees) tuples.
+    Age and coordinates should already be parsed once (see '_calculate_age_from_dob' / 'services.geo.parse_location').
+    """
+    n = len(users)
+    age = np.zeros(n, dtype=np.int32)
+    gender = np.zeros(n, dtype=np.int32)
+    target_gender = np.zeros(n, dtype=np.int32)
+    lat = np.full(n, np.nan)
+    lon = np.full(n, np.nan)
+    max_distance = np.empty(n)
+    age_min = np.empty(n)
+    age_max = np.empty(n)
+
+    for i, (prefs, gender_id, user_age, coords) in enumerate(users):
+        age[i] = user_age or 0
+        gender[i] = _gender_code(gender_id)
+        target_gender[i] = _gender_code(prefs.get("target_gender_id"))
+        if coords:
+            lat[i], lon[i] = coords
+        max_distance[i] = _pref(prefs, "max_distance", DEFAULT_MAX_DISTANCE)
+        age_min[i] = _pref(prefs, "age_min", DEFAULT_AGE_MIN)
+        age_max[i] = _pref(prefs, "age_max", DEFAULT_AGE_MAX)
+
+    return UserColumns(
+        age=age,
+        gender=gender,
+        target_gender=target_gender,
+        lat=np.radians(lat),
+        lon=np.radians(lon),
+        max_distance=max_distance,
+        age_min=age_min,
+        age_max=age_max,
+    )
+
+
+def _distance_miles(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """Vectorized version of the haversine in '_calculate_distance_miles' (inputs in radians)."""
+    a = (np.sin((lat2 - lat1) / 2) ** 2 +
+         np.cos(lat1) * np.cos(lat2) *
+         np.sin((lon2 - lon1) / 2) ** 2)
+    return EARTH_RADIUS_MILES * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def score_candidates(user: UserColumns, candidates: UserColumns) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Check one user (a single row of columns) against every candidate in one pass.
+
+    Returns:
+        mask: True where the pair is compatible (both users satisfy each other's criteria)
+        score: 0..1 for compatible pairs (closer together and nearer the middle of each other's
+               age range scores higher), 0 for incompatible ones
+    """
+    u = user.take(0)
+    c = candidates
+
+    # Gender (both ways), only when both sides are set
+    mask = (u.target_gender == 0) | (c.gender == 0) | (c.gender == u.target_gender)
+    mask &= (c.target_gender == 0) | (u.gender == 0) | (u.gender == c.target_gender)
+
+    # Age (both ways), only when the age is known
+    if u.age > 0:
+        mask &= (c.age_min <= u.age) & (u.age <= c.age_max)
+    mask &= (c.age <= 0) | ((u.age_min <= c.age) & (c.age <= u.age_max))
+
+    # Distance (both ways), only when both users have coordinates
+    distance = _distance_miles(u.lat, u.lon, c.lat, c.lon)
+    located = ~np.isnan(distance)
+    limit = np.minimum(c.max_distance, u.max_distance)
+    mask &= ~located | (distance <= limit)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        distance_score = np.where(located, 1 - distance / np.maximum(limit, 1), 0.5)
+
+        half_range = np.maximum((u.age_max - u.age_min) / 2, 1)
+        age_score = np.where(c.age > 0, 1 - np.abs(c.age - (u.age_min + u.age_max) / 2) / half_range, 0.5)
+
+    score = np.where(mask, (np.clip(distance_score, 0, 1) + np.clip(age_score, 0, 1)) / 2, 0.0)
+    return mask, score
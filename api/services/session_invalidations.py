@@ -0,0 +1,81 @@
+import asyncio
+import logging
+from typing import Iterable, Optional
+
+from config import settings
+from controllers.session import _invalidate_session, _clear_session_cache
+
+"""
+THE PURPOSE OF THIS FILE IS TO KEEP THE SESSION CACHE ('controllers/session.py') OF EVERY WORKER IN SYNC. WHEN A
+TRANSACTION THAT CHANGED SESSIONS COMMITS, THEIR IDS ARE PUBLISHED ON A REDIS CHANNEL AND EVERY WORKER DROPS THEM
+FROM ITS CACHE, SO A GUEST LEAVING ON ONE WORKER CAN'T KEEP CHATTING THROUGH ANOTHER ONE'S CACHED COPY.
+
+- PUBLISHING HAPPENS IN THE THREAD THAT COMMITTED (THE DB WORK NEVER RUNS ON THE EVENT LOOP), WITH A SYNC CLIENT
+- IF THE SUBSCRIPTION DROPS, THE WHOLE CACHE IS CLEARED ONCE IT IS BACK, INVALIDATIONS MAY HAVE BEEN MISSED MEANWHILE
+- WITHOUT 'redis_url' THERE IS ONLY ONE WORKER, AND THE LOCAL INVALIDATION ON COMMIT IS ALL THAT IS NEEDED
+"""
+
+SESSION_INVALIDATIONS_CHANNEL = "sessions:invalidate"
+RESUBSCRIBE_SECONDS = 1 # Wait before subscribing again after the Redis connection drops
+
+
+class SessionInvalidations:
+    def __init__(self, redis_url: Optional[str], channel: str = SESSION_INVALIDATIONS_CHANNEL):
+        self._redis_url = redis_url
+        self._channel = channel
+        self._publisher = None
+        self._task: Optional[asyncio.Task] = None
+
+        if redis_url:
+            import redis
+            self._publisher = redis.Redis.from_url(redis_url, decode_responses=True)
+
+    def publish(self, session_ids: Iterable[str]):
+        """Tell every worker to drop these sessions from its cache. Called from the thread that committed."""
+        if self._publisher is None:
+            return
+        try:
+            self._publisher.publish(self._channel, ",".join(session_ids))
+        except Exception as e:
+            # Other workers keep the old entries until SESSION_CACHE_TTL_SECONDS
+            logging.error(f"Failed to publish session cache invalidations: {e}")
+
+    async def start(self):
+        if self._redis_url:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._publisher is not None:
+            await asyncio.to_thread(self._publisher.close)
+
+    async def _run(self):
+        from redis import asyncio as aioredis
+        client = aioredis.from_url(self._redis_url, decode_responses=True)
+        try:
+            while True:
+                try:
+                    async with client.pubsub() as pubsub:
+                        await pubsub.subscribe(self._channel)
+                        _clear_session_cache() # Anything published before we (re)subscribed was missed
+                        async for message in pubsub.listen():
+                            if message["type"] != "message":
+                                continue
+                            for session_id in message["data"].split(","):
+                                _invalidate_session(session_id)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logging.error(f"Session cache invalidation subscription failed, resubscribing: {e}")
+                    await asyncio.sleep(RESUBSCRIBE_SECONDS)
+        finally:
+            await client.aclose()
+
+
+session_invalidations = SessionInvalidations(settings.redis_url)
@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import uuid
+from typing import Callable, Optional
+
+"""
+THE PURPOSE OF THIS FILE IS TO KEEP TRACK OF WHICH SOCKETS (SIDS) BELONG TO WHICH USER, IN A WAY THAT EVERY
+UVICORN WORKER CAN SEE. WITH 'redis_url' SET THE MAPPING LIVES IN REDIS, OTHERWISE IT IS KEPT IN THIS PROCESS
+(FINE FOR A SINGLE WORKER, LOCAL DEVELOPMENT AND TESTS).
+
+THIS IS ONLY FOR LOOKUPS (WHO OWNS A SID, IS A USER CONNECTED ANYWHERE). TO SEND SOMETHING TO A USER EMIT TO
+'user_room(uid)', THE SOCKET.IO CLIENT MANAGER DELIVERS IT TO WHICHEVER WORKER HOLDS THEIR CONNECTION
+
+IN REDIS EVERY WORKER ALSO KEEPS THE SET OF SIDS IT HOLDS AND A HEARTBEAT KEY THAT EXPIRES AFTER WORKER_TTL_SECONDS.
+A WORKER THAT DIES (CRASH, KILL) STOPS REFRESHING IT, AND THE NEXT LIVE WORKER TO NOTICE REMOVES ITS SIDS, CALLING
+'on_user_gone' FOR EVERY USER LEFT WITHOUT A SOCKET (SO THE PRESENCE SERVICE CAN MARK THEM OFFLINE)
+"""
+
+REDIS_KEY_PREFIX = "sockets"
+WORKER_TTL_SECONDS = 30 # A worker whose heartbeat is older than this is dead, and its sids are removed
+HEARTBEAT_SECONDS = 10 # How often workers refresh their heartbeat and look for dead workers
+
+
+def user_room(uid: str) -> str:
+    """Room every socket of a user is entered into on connect."""
+    return f"user:{uid}"
+
+
+class LocalSocketRegistry:
+    """In-process registry, only sees the sockets connected to this worker."""
+
+    def __init__(self):
+        self._sid_user: dict[str, str] = {}
+        self._user_sids: dict[str, set[str]] = {}
+        self.on_user_gone: Optional[Callable[[str], None]] = None # Unused, sockets of this process die with it
+
+    async def start(self):
+        pass
+
+    async def add(self, uid: str, sid: str):
+        self._sid_user[sid] = uid
+        self._user_sids.setdefault(uid, set()).add(sid)
+
+    async def remove(self, sid: str) -> Optional[str]:
+        """Forget a socket. Returns the uid it belonged to, if any."""
+        uid = self._sid_user.pop(sid, None)
+        if uid is None:
+            return None
+
+        sids = self._user_sids.get(uid)
+        if sids is not None:
+            sids.discard(sid)
+            if not sids:
+                del self._user_sids[uid]
+        return uid
+
+    async def get_uid(self, sid: str) -> Optional[str]:
+        return self._sid_user.get(sid)
+
+    async def get_sids(self, uid: str) -> set[str]:
+        return set(self._user_sids.get(uid, ()))
+
+    async def is_connected(self, uid: str) -> bool:
+        return bool(self._user_sids.get(uid))
+
+    async def close(self):
+        pass
+
+
+class RedisSocketRegistry:
+    """
+    Registry shared by every worker through Redis ('sockets:sid:<sid>' -> uid, 'sockets:user:<uid>' -> set of sids,
+    'sockets:worker:<id>' -> set of sids a worker holds, 'sockets:alive:<id>' heartbeat, 'sockets:workers' -> worker ids).
+    """
+
+    def __init__(self, url: str, prefix: str = REDIS_KEY_PREFIX):
+        from redis import asyncio as aioredis
+        self._redis = aioredis.from_url(url, decode_responses=True)
+        self._prefix = prefix
+        self._worker_id = uuid.uuid4().hex
+        self._task: Optional[asyncio.Task] = None
+        self.on_user_gone: Optional[Callable[[str], None]] = None # Called with users a dead worker's cleanup left without sockets
+
+    def _sid_key(self, sid: str) -> str:
+        return f"{self._prefix}:sid:{sid}"
+
+    def _user_key(self, uid: str) -> str:
+        return f"{self._prefix}:user:{uid}"
+
+    def _worker_key(self, worker_id: str) -> str:
+        return f"{self._prefix}:worker:{worker_id}"
+
+    def _alive_key(self, worker_id: str) -> str:
+        return f"{self._prefix}:alive:{worker_id}"
+
+    def _workers_key(self) -> str:
+        return f"{self._prefix}:workers"
+
+    async def start(self):
+        await self._heartbeat()
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(HEARTBEAT_SECONDS)
+            try:
+                await self._heartbeat()
+                await self._reap_dead_workers()
+            except Exception as e:
+                logging.error(f"Socket registry heartbeat failed: {e}")
+
+    async def _heartbeat(self):
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.set(self._alive_key(self._worker_id), "1", ex=WORKER_TTL_SECONDS)
+            pipe.sadd(self._workers_key(), self._worker_id)
+            await pipe.execute()
+
+    async def _reap_dead_workers(self):
+        for worker_id in await self._redis.smembers(self._workers_key()):
+            if worker_id == self._worker_id or await self._redis.exists(self._alive_key(worker_id)):
+                continue
+            # Only the worker that manages to take it off the list cleans up after it
+            if not await self._redis.srem(self._workers_key(), worker_id):
+                continue
+
+            sids = await self._redis.smembers(self._worker_key(worker_id))
+            uids = set()
+            for sid in sids:
+                uid = await self._forget(sid, worker_id)
+                if uid is not None:
+                    uids.add(uid)
+            await self._redis.delete(self._worker_key(worker_id))
+            logging.warning(f"Removed {len(sids)} sockets of dead worker {worker_id}")
+
+            for uid in uids:
+                if self.on_user_gone and not await self.is_connected(uid):
+                    self.on_user_gone(uid)
+
+    async def _forget(self, sid: str, worker_id: str) -> Optional[str]:
+        uid = await self._redis.getdel(self._sid_key(sid))
+        async with self._redis.pipeline(transaction=True) as pipe:
+            if uid is not None:
+                pipe.srem(self._user_key(uid), sid)
+            pipe.srem(self._worker_key(worker_id), sid)
+            await pipe.execute()
+        return uid
+
+    async def add(self, uid: str, sid: str):
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.set(self._sid_key(sid), uid)
+            pipe.sadd(self._user_key(uid), sid)
+            pipe.sadd(self._worker_key(self._worker_id), sid)
+            await pipe.execute()
+
+    async def remove(self, sid: str) -> Optional[str]:
+        """Forget a socket. Returns the uid it belonged to, if any."""
+        return await self._forget(sid, self._worker_id)
+
+    async def get_uid(self, sid: str) -> Optional[str]:
+        return await self._redis.get(self._sid_key(sid))
+
+    async def get_sids(self, uid: str) -> set[str]:
+        return set(await self._redis.smembers(self._user_key(uid)))
+
+    async def is_connected(self, uid: str) -> bool:
+        return bool(await self._redis.scard(self._user_key(uid)))
+
+    async def close(self):
+        """Stop the heartbeat. This worker's sids are left for the other workers to clean up (and mark offline)."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self._redis.delete(self._alive_key(self._worker_id))
+        except Exception as e:
+            logging.error(f"Failed to drop the socket registry heartbeat: {e}")
+        await self._redis.aclose()
+
+
+def create_socket_registry(redis_url: Optional[str]):
+    """Redis backed registry when a Redis URL is configured, in-process one otherwise."""
+    if not redis_url:
+        logging.info("No redis_url configured, tracking sockets in this process only")
+        return LocalSocketRegistry()
+    return RedisSocketRegistry(redis_url)
+
+
+def create_client_manager(redis_url: Optional[str]):
+    """
+    Socket.IO client manager that shares rooms and emits between workers through Redis pub/sub,
+    or None for the default in-process manager.
+    """
+    if not redis_url:
+        return None
+
+    import socketio
+    return socketio.AsyncRedisManager(redis_url)
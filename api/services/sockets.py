@@ -1,22 +1,35 @@
+import asyncio
 import logging
-from jose import jwt, JWTError
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Optional
+from jose import JWTError
 from sqlalchemy.exc import SQLAlchemyError
 from fastapi.exceptions import HTTPException
+from fastapi.encoders import jsonable_encoder
 
 from config import settings
-from models.db import SessionLocal
-from controllers.session import _add_chat_message, _get_active_session_by_id
-from controllers.user import _set_user_online, _set_user_offline
+from models.db import SocketSessionLocal
+from middleware.auth import verify_jwt
+from controllers.session import _get_active_session_by_id, _get_cached_session, _invalidate_session
+from controllers.matchmaking import _join_queue, _leave_queue, MATCHMAKING_TIMEOUT_SECONDS
+from services.socket_registry import create_socket_registry, user_room
+from services.chat_writer import chat_writer
+from services.presence import presence
 
-SECRET = settings.supabase_jwt_secret
 
 logging.basicConfig(level=logging.INFO)
 
-user_sid_map: dict[str, str] = {}
-sid_user_map: dict[str, str] = {}
+# Which sockets belong to which user, shared between workers when 'redis_url' is set
+socket_registry = create_socket_registry(settings.redis_url)
+socket_registry.on_user_gone = presence.disconnected # Users whose only sockets were on a worker that died
 
 socket_manager = None
 
+# Socket handlers run on the event loop, so their (synchronous) DB work goes to this pool instead. It is bounded
+# to stay under the SQLAlchemy connection pool: a slow database queues handlers here rather than exhausting connections
+socket_db_executor = ThreadPoolExecutor(max_workers=settings.socket_db_workers, thread_name_prefix="socket-db")
+
 
 async def _get_auth_user_id(sid, auth_data):
     try:
@@ -29,12 +42,7 @@ async def _get_auth_user_id(sid, auth_data):
             logging.error(f"Missing token in socket auth for SID {sid}")
             return None
 
-        payload = jwt.decode(
-            token,
-            SECRET,
-            algorithms=["HS256"],
-            audience="authenticated",
-        )
+        payload = verify_jwt(token)
         sub = payload.get("sub")
         if not sub:
             logging.error(f"Missing sub in JWT for SID {sid}")
@@ -51,6 +59,44 @@ async def _get_auth_user_id(sid, auth_data):
         return None
 
 
+def _run_with_db(fn, **kwargs):
+    """Run a controller in its own DB session, committing on success. Call it off the event loop."""
+    db = SocketSessionLocal()
+    try:
+        res = fn(db=db, **kwargs)
+        db.commit()
+        return res
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+async def _run_db(fn, **kwargs):
+    """Await '_run_with_db' on the socket DB pool, keeping the event loop free while the query runs."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(socket_db_executor, partial(_run_with_db, fn, **kwargs))
+
+
+async def _get_open_session(session_id: str, refresh: bool = False) -> Optional[dict]:
+    """Open session (host / guest / status) from the session cache, only going to the DB pool on a miss."""
+    if refresh:
+        _invalidate_session(session_id)
+    else:
+        cached = _get_cached_session(session_id)
+        if cached:
+            return cached
+    return await _run_db(_get_active_session_by_id, session_id=session_id)
+
+
+async def emit_to_user(uid: str, event: str, payload: dict):
+    """Send an event to every socket of a user, whichever worker they are connected to."""
+    if socket_manager is None:
+        return
+    await socket_manager.emit(event, payload, room=user_room(uid))
+
+
 def register_socket_handlers(sm):
     global socket_manager
     socket_manager = sm
@@ -66,46 +112,31 @@ def register_socket_handlers(sm):
             await sm.emit("error", {"message": "Invalid or expired authorization token"}, room=sid)
             return False
 
-        user_sid_map[uid] = sid
-        sid_user_map[sid] = uid
-
-        db = SessionLocal()
-        try:
-            _set_user_online(uid=uid, db=db)
-            db.commit()
-            logging.info(f"User {uid} set ONLINE via socket")
-        except SQLAlchemyError as e:
-            db.rollback()
-            logging.error(f"DB error setting user ONLINE for uid={uid}: {e}")
-        finally:
-            db.close()
+        await socket_registry.add(uid, sid)
+        await sm.enter_room(sid, user_room(uid))
+        presence.connected(uid) # Written to the DB in the next presence batch, or not at all after a quick reconnect
 
         logging.info(f"User {uid} connected with SID {sid}")
         return True
 
     @sm.on("disconnect")
     async def handle_disconnect(sid):
-        uid = sid_user_map.pop(sid, None)
+        uid = await socket_registry.remove(sid)
         if not uid:
             return
-        
-        db = SessionLocal()
-        try:
-            _set_user_offline(uid=uid, db=db)
-            db.commit()
-            logging.info(f"User {uid} set OFFLINE via socket")
-        except SQLAlchemyError as e:
-            db.rollback()
-            logging.error(f"DB error setting user OFFLINE for uid={uid}: {e}")
-        finally:
-            db.close()
 
-        user_sid_map.pop(uid, None)
+        # Still connected from another tab / device (possibly on another worker)
+        if await socket_registry.is_connected(uid):
+            logging.info(f"User {uid} disconnected SID {sid}, other sockets still open")
+            return
+
+        presence.disconnected(uid) # Offline once the grace window passes without a reconnect
+
         logging.info(f"User {uid} disconnected SID {sid}")
 
     @sm.on("join_session")
     async def handle_join_session(sid, data):
-        uid = sid_user_map.get(sid)
+        uid = await socket_registry.get_uid(sid)
         session_id = data.get("session_id") if isinstance(data, dict) else None
         logging.info(f"join_session from SID={sid}, uid={uid}, data={data}")
 
@@ -113,9 +144,8 @@ def register_socket_handlers(sm):
             await sm.emit("error", {"message": "Invalid session join payload"}, room=sid)
             return
 
-        db = SessionLocal()
         try:
-            session = _get_active_session_by_id(session_id, db)
+            session = await _get_open_session(session_id)
             if not session:
                 await sm.emit("error", {"message": "Session not found or inactive"}, room=sid)
                 return
@@ -138,12 +168,10 @@ def register_socket_handlers(sm):
         except Exception as e:
             logging.error(f"Unexpected error in join_session for uid={uid}, session_id={session_id}: {e}")
             await sm.emit("error", {"message": "Server error joining session"}, room=sid)
-        finally:
-            db.close()
 
     @sm.on("leave_session")
     async def handle_leave_session(sid, data):
-        uid = sid_user_map.get(sid)
+        uid = await socket_registry.get_uid(sid)
         session_id = data.get("session_id") if isinstance(data, dict) else None
 
         if not uid or not session_id:
@@ -156,7 +184,7 @@ def register_socket_handlers(sm):
 
     @sm.on("chat_message")
     async def handle_chat_message(sid, data):
-        uid = sid_user_map.get(sid)
+        uid = await socket_registry.get_uid(sid)
         if not isinstance(data, dict):
             await sm.emit("error", {"message": "Invalid message format"}, room=sid)
             return
@@ -169,20 +197,36 @@ def register_socket_handlers(sm):
             await sm.emit("error", {"message": "Invalid message format"}, room=sid)
             return
 
-        db = SessionLocal()
         try:
-            message_data = _add_chat_message(
-                session_id=session_id,
-                author_uid=uid,
-                content=content,
-                db=db,
-            )
+            session = await _get_open_session(session_id)
+            if session and uid == session["host_uid"] and not session["guest_uid"]:
+                # The guest may have joined through another worker since the session was cached
+                session = await _get_open_session(session_id, refresh=True)
 
-            session = _get_active_session_by_id(session_id, db)
             if not session:
                 await sm.emit("error", {"message": "Chat session is no longer active"}, room=sid)
                 return
 
+            if uid == session["host_uid"]:
+                receiver_uid = session["guest_uid"]
+            elif uid == session["guest_uid"]:
+                receiver_uid = session["host_uid"]
+            else:
+                await sm.emit("error", {"message": "User is not part of this active session."}, room=sid)
+                return
+
+            if not receiver_uid:
+                await sm.emit("error", {"message": "Cannot send chat message: Session is missing a guest user."}, room=sid)
+                return
+
+            # Broadcast right away, the message is written to the DB in the background
+            message_data = chat_writer.submit(
+                session_id=session_id,
+                author_uid=uid,
+                receiver_uid=receiver_uid,
+                content=content,
+            )
+
             payload = {
                 "session_id": session_id,
                 "author_uid": uid,
@@ -203,5 +247,46 @@ def register_socket_handlers(sm):
         except Exception as e:
             logging.error(f"Critical error handling chat_message: {e}")
             await sm.emit("error", {"message": "Server error processing message"}, room=sid)
-        finally:
-            db.close()
\ No newline at end of file
+
+    @sm.on("matchmaking_join")
+    async def handle_matchmaking_join(sid, data=None):
+        """
+        Push-based alternative to 'POST /matchmaking/me/join' + polling. After joining, the matchmaker
+        pushes 'matchmaking_searching', 'match_found', 'matchmaking_host' or 'matchmaking_timeout' to this socket.
+        """
+        uid = await socket_registry.get_uid(sid)
+        if not uid:
+            await sm.emit("error", {"message": "Invalid or expired authorization token"}, room=sid)
+            return
+
+        try:
+            queue_entry = await _run_db(_join_queue, uid=uid)
+        except HTTPException as e:
+            await sm.emit("error", {"message": e.detail}, room=sid)
+            return
+        except SQLAlchemyError as e:
+            logging.error(f"DB error in matchmaking_join for uid={uid}: {e}")
+            await sm.emit("error", {"message": "Server error joining matchmaking"}, room=sid)
+            return
+
+        logging.info(f"User {uid} joined matchmaking via socket")
+        await sm.emit("matchmaking_joined", {
+            "queue_entry": jsonable_encoder(dict(queue_entry)),
+            "timeout_seconds": MATCHMAKING_TIMEOUT_SECONDS,
+        }, room=sid)
+
+    @sm.on("matchmaking_leave")
+    async def handle_matchmaking_leave(sid, data=None):
+        uid = await socket_registry.get_uid(sid)
+        if not uid:
+            return
+
+        try:
+            await _run_db(_leave_queue, uid=uid)
+        except SQLAlchemyError as e:
+            logging.error(f"DB error in matchmaking_leave for uid={uid}: {e}")
+            await sm.emit("error", {"message": "Server error leaving matchmaking"}, room=sid)
+            return
+
+        logging.info(f"User {uid} left matchmaking via socket")
+        await sm.emit("matchmaking_left", {"message": "Left matchmaking queue"}, room=sid)
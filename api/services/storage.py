@@ -1,61 +1,75 @@
-import io
-from .supabase import supabase_for_user as supabase
-from sqlalchemy.orm import Session
-from sqlalchemy import text
-from storage3 import SyncStorageClient
-from fastapi import HTTPException
-
-from schemas.photos import PhotoMetaSchema, PhotoSchema, PhotoMetadataSchema
+from services.metrics import register_metrics
 
 import mimetypes
-import uuid
-from typing import Optional, Dict, Any
+import threading
+import time
+from typing import Optional, Dict, List, Mapping
+
+"""
+THE PURPOSE OF THIS FILE IS TO HOLD WHAT THE PHOTO SERVICE ('services/async_storage.py') SHARES ACROSS REQUESTS: THE
+BUCKET LAYOUT, THE PATH HELPERS AND THE PROCESS-WIDE CACHE OF SIGNED URLS (WITH ITS METRICS).
+"""
 
 BUCKET = 'user_media'
 BASE_PREFIX = "profile"
 MAX_PHOTOS = 6
 
+# Signed URLs are reused while at least this fraction of their TTL is left, so a popular profile isn't re-signed per view
+SIGNED_URL_MIN_REMAINING = 0.5
+SIGNED_URL_CACHE_MAX_ENTRIES = 50000 # Paths, each usually has a URL for one or two TTLs
+
+_signed_url_cache: dict[str, dict[int, tuple[float, str]]] = {} # path -> {ttl: (expires at, url)}
+_signed_url_cache_lock = threading.Lock()
+# 'signing_calls_saved' counts requests answered entirely from the cache, i.e. storage calls that weren't made
+_signed_url_stats = {"hits": 0, "misses": 0, "signing_calls": 0, "signing_calls_saved": 0, "invalidations": 0}
+
+register_metrics("signed_urls", lambda: {**_signed_url_stats, "size": len(_signed_url_cache)})
+
 def _mime_to_ext(mime_type: str):
     ext = mimetypes.guess_extension(mime_type) or ""
     if ext == ".jpe":
         ext = ".jpg"
     return ext
 
-def _photo_exists(uid: str, id: str, db: Session):
-    stmt = text("""
-        SELECT 1 FROM profiles.photos WHERE id = :id AND uid = :uid;
-    """)
-    row = db.execute(stmt, {"id": id, "uid": uid})
-    return bool(row)
-
-def get_user_photos(
-    storage: SyncStorageClient,
-    uid: str,
-    db: Session,
-    ttl_seconds: int = 500,
-    only_approved: bool = False,
-):
-    # Build WHERE clause
-    where = ["uid = :uid"]
-    params = {"uid": uid}
-    if only_approved:
-        where.append("moderation_status = 'approved'")
-
-    stmt = text(f"""
-        SELECT id, uid, path, mime_type, size_bytes, slot, is_primary, moderation_status, created_at
-        FROM profiles.photos
-        WHERE {' AND '.join(where)}
-        ORDER BY is_primary DESC, created_at DESC
-    """)
-    rows = db.execute(stmt, {"uid": uid}).mappings().all()
-    if not rows:
-        return []
-
-    bucket = storage.from_(BUCKET)
-    paths = [r["path"] for r in rows]
-
-    signed_resp = bucket.create_signed_urls(paths, ttl_seconds)
-
+def invalidate_signed_urls(path: str):
+    """Stop handing out cached URLs for a path, call it when the photo there changes or is removed."""
+    with _signed_url_cache_lock:
+        _signed_url_stats["invalidations"] += len(_signed_url_cache.pop(path, ()))
+
+def _cache_signed_urls(url_map: Dict[str, Optional[str]], ttl_seconds: int, signed_at: float):
+    with _signed_url_cache_lock:
+        if len(_signed_url_cache) + len(url_map) > SIGNED_URL_CACHE_MAX_ENTRIES:
+            now = time.monotonic()
+            for path in [path for path, urls in _signed_url_cache.items() if all(exp <= now for exp, _ in urls.values())]:
+                del _signed_url_cache[path]
+            if len(_signed_url_cache) + len(url_map) > SIGNED_URL_CACHE_MAX_ENTRIES:
+                _signed_url_cache.clear()
+
+        for path, url in url_map.items():
+            if url:
+                _signed_url_cache.setdefault(path, {})[ttl_seconds] = (signed_at + ttl_seconds, url)
+
+def _get_cached_signed_urls(paths: List[str], ttl_seconds: int, now: float) -> tuple[Dict[str, Optional[str]], List[str]]:
+    """Split 'paths' into ({path: url} still usable from the cache, [paths that need signing])."""
+    url_map: Dict[str, Optional[str]] = {}
+    with _signed_url_cache_lock:
+        for path in paths:
+            cached = _signed_url_cache.get(path, {}).get(ttl_seconds)
+            if cached and cached[0] - now >= ttl_seconds * SIGNED_URL_MIN_REMAINING:
+                url_map[path] = cached[1]
+        missing = list(dict.fromkeys(path for path in paths if path not in url_map))
+
+        _signed_url_stats["hits"] += len(url_map)
+        _signed_url_stats["misses"] += len(paths) - len(url_map)
+        if not missing:
+            _signed_url_stats["signing_calls_saved"] += 1
+    return url_map, missing
+
+def _count_signing_call():
+    with _signed_url_cache_lock:
+        _signed_url_stats["signing_calls"] += 1
+
+def _parse_signed_urls(signed_resp) -> Dict[str, Optional[str]]:
     if isinstance(signed_resp, dict):
         data = signed_resp.get("data") or []
     elif isinstance(signed_resp, list):
@@ -64,167 +78,12 @@ def get_user_photos(
         data = []
 
     # Handle signedUrl vs signedURL keys
-    url_map = {
+    return {
         d.get("path"): (d.get("signedUrl") or d.get("signedURL"))
         for d in data if d.get("path")
     }
 
-    return [
-        PhotoMetaSchema(
-            id = row["id"],
-            mime_type = row.get("mime_type"),
-            size_bytes = row.get("size_bytes"),
-            url = url_map.get(row["path"]),
-            path = row["path"],
-            metadata=PhotoMetadataSchema(
-                slot = row.get("slot"),
-                is_primary = row["is_primary"],
-                moderation_status = row["moderation_status"],
-            )
-        ) for row in rows
-    ]
-
-def upload_profile_photo(
-    uid: str,
-    file_bytes: bytes,
-    storage: SyncStorageClient,
-    mime_type: str,
-    db: Session,
-    slot: Optional[int] = None,
-) -> Dict[str, Any]:
-    photo_id = uuid.uuid4()
-    path = f"{BASE_PREFIX}/{uid}/photos/{photo_id}{_mime_to_ext(mime_type)}"
-
-    bucket = storage.from_(BUCKET)
-
-    # Literally cannot get the database to handle this with RLS idk why
-    if (len(get_user_photos(storage=storage, uid=uid, db=db))+1) > MAX_PHOTOS:
-        raise HTTPException(status_code=400, detail=f"There can only be a maximum of {MAX_PHOTOS} per user!")
-
-    stmt = text("""
-        INSERT INTO profiles.photos 
-            (id, uid, bucket, path, mime_type, size_bytes, slot)
-        VALUES
-            (:photo_id, :uid, :bucket, :path, :mime_type, :size_bytes, :slot)
-        RETURNING *
-    """)
-    row = db.execute(stmt, {"photo_id": photo_id, "uid": uid, "bucket": BUCKET, "path": path, "mime_type": mime_type, "size_bytes": len(file_bytes), "slot": slot}).mappings().one()
-
-    bucket.upload(
-        path=path,
-        file=file_bytes if isinstance(file_bytes, (bytes, bytearray)) else io.BytesIO(file_bytes).getvalue(),
-        file_options={"content-type": mime_type, "upsert": False},
-    )
-    signed = bucket.create_signed_url(path, 300) or {}
-
-    return PhotoMetaSchema (
-        id = row["id"],
-        mime_type = row.get("mime_type"),
-        size_bytes = row.get("size_bytes"),
-        path = path,
-        url = signed.get("signedUrl") or signed.get("signedURL"),
-        metadata=PhotoMetadataSchema(
-            slot = row.get("slot"),
-            is_primary = row["is_primary"],
-            moderation_status = row["moderation_status"],
-        )
-    )
-    
-def delete_profile_photo(photo: PhotoSchema, uid: str, storage: SyncStorageClient, db: Session):
-    if not _photo_exists(uid=uid, id=photo.id, db=db):
-        raise HTTPException(status_code=404, detail=f"The photo with id '{id}' does not exist!")
-    
-    if len(get_user_photos(storage=storage, uid=uid, db=db)) == 0:
-        raise HTTPException(status_code=400, detail=f"The user with uid '{uid}' has no photos uploaded!")
-
-    stmt = text("""
-        DELETE FROM profiles.photos WHERE id = :id AND uid = :uid;
-    """)
-
-    row = db.execute(stmt, {"id": photo.id, "uid": uid})
-
-    bucket = storage.from_(BUCKET)
-
-    res = bucket.remove([photo.path])
-    return res
-
-
-def update_profile_photo(photo: PhotoSchema, mime_type: str, file_bytes: bytes, uid: str, storage: SyncStorageClient, db: Session) -> PhotoMetaSchema:
-    if not _photo_exists(uid=uid, id=photo.id, db=db):
-        raise HTTPException(status_code=404, detail=f"The photo with id '{photo.id}' does not exist!")
-    
-    stmt = text("""
-        UPDATE profiles.photos 
-        SET updated_at = now(), 
-            size_bytes = :size_bytes, 
-            mime_type = :mime_type
-        WHERE id = :id AND uid = :uid
-        RETURNING *
-    """)
-
-    row = db.execute(stmt, {"size_bytes": len(file_bytes), "mime_type": mime_type, "id": str(photo.id), "uid": uid}).mappings().one_or_none()
-    if not row:
-        raise HTTPException(status_code=404, detail=f"The photo with id '{photo.id}' does not exist!")
-
-    bucket = storage.from_(BUCKET)
-
-    res = bucket.update(
-        path=photo.path,
-        file=file_bytes,
-        file_options={"content-type": mime_type, "upsert": True}
-    )
-
-    signed = bucket.create_signed_url(photo.path, 300) or {}
-    url = signed.get("signedUrl") or signed.get("signedURL")
-
-    return PhotoMetaSchema(
-        id = row["id"],
-        mime_type = row.get("mime_type"),
-        size_bytes = row.get("size_bytes"),
-        path = row["path"],
-        url = signed.get("signedUrl") or signed.get("signedURL"),
-        metadata=PhotoMetadataSchema(
-            slot = row.get("slot"),
-            is_primary = row["is_primary"],
-            moderation_status = row["moderation_status"],
-
-        )
-    )
-
-
-def update_profile_photo_metadata(photo: PhotoSchema, metadata: PhotoMetadataSchema, storage: SyncStorageClient, uid: str, db: Session) -> PhotoMetaSchema:
-    if not _photo_exists(uid=uid, id=photo.id, db=db):
-        raise HTTPException(status_code=404, detail=f"The photo with id '{photo.id}' does not exist!")
-    
-    stmt = text("""
-        UPDATE profiles.photos
-        SET
-            updated_at = now(),
-            slot = COALESCE(:slot, slot),
-            moderation_status = COALESCE(:moderation_status, moderation_status),
-            is_primary = COALESCE(:is_primary, is_primary)
-        WHERE id = :id AND uid = :uid
-        RETURNING *
-    """)
-
-    row = db.execute(stmt, {"slot": metadata.slot, "moderation_status": metadata.moderation_status.value or None, "is_primary": metadata.is_primary, "id": str(photo.id), "uid": uid}).mappings().one_or_none()
-    if not row:
-        raise HTTPException(status_code=404, detail=f"The photo with id '{photo.id}' does not exist!")
-
-    bucket = storage.from_(BUCKET)
-
-    signed = bucket.create_signed_url(photo.path, 300) or {}
-    url = signed.get("signedUrl") or signed.get("signedURL")
-
-    return PhotoMetaSchema(
-        id = row["id"],
-        mime_type = row.get("mime_type"),
-        size_bytes = row.get("size_bytes"),
-        path = row["path"],
-        url = signed.get("signedUrl") or signed.get("signedURL"),
-        metadata=PhotoMetadataSchema(
-            slot = row.get("slot"),
-            is_primary = row["is_primary"],
-            moderation_status = row["moderation_status"],
-        )
-    )
\ No newline at end of file
+def _photo_url_path(photo: Mapping, tier: Optional[str]) -> str:
+    """Path to serve for a photo: its resized tier when asked for and available, else the original."""
+    derivatives = photo.get("derivatives") or {}
+    return derivatives.get(tier) or photo["path"]
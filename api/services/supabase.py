@@ -1,25 +1,89 @@
-from supabase import create_client, Client
-from storage3 import SyncStorageClient as StorageClient
+from typing import Optional
+
+import httpx
+from supabase import create_client
+from postgrest import SyncPostgrestClient
+from postgrest.constants import DEFAULT_POSTGREST_CLIENT_HEADERS
+from storage3 import SyncStorageClient as StorageClient, AsyncStorageClient
 from config import settings
 
 SUPABASE_URL = settings.supabase_url
 SUPABASE_ANON_KEY = settings.supabase_anon_key
 SUPABASE_SERVICE_KEY = settings.supabase_service_key
+STORAGE_URL = f"{SUPABASE_URL}/storage/v1/"
+REST_URL = f"{SUPABASE_URL}/rest/v1"
 
-def supabase_for_user(user_jwt: str) -> Client:
-    client = create_client(SUPABASE_URL, SUPABASE_ANON_KEY)
-    client.postgrest.auth(user_jwt)
-    return client
+# One keep-alive connection pool to Supabase shared by every request, instead of a new client (and new TLS
+# connections) per request. Per-user clients built on top of it only carry their own auth headers
+STORAGE_HTTP_LIMITS = httpx.Limits(
+    max_connections=settings.storage_max_connections,
+    max_keepalive_connections=settings.storage_max_connections,
+    keepalive_expiry=60,
+)
+STORAGE_HTTP_TIMEOUT = httpx.Timeout(20.0, connect=5.0)
 
-def storage_for_user(user_jwt: str) -> StorageClient:
-    # Storage calls under user identity (RLS applies)
-    return StorageClient(
-        f"{SUPABASE_URL}/storage/v1/",
-        headers={
-            "Authorization": f"Bearer {user_jwt}",
-            "apiKey": SUPABASE_ANON_KEY, 
-        },
+storage_http = httpx.Client(
+    limits=STORAGE_HTTP_LIMITS,
+    timeout=STORAGE_HTTP_TIMEOUT,
+    follow_redirects=True,
+    http2=True,
+)
+_async_storage_http: Optional[httpx.AsyncClient] = None
+
+
+def _user_headers(user_jwt: str) -> dict[str, str]:
+    return {
+        "Authorization": f"Bearer {user_jwt}",
+        "apiKey": SUPABASE_ANON_KEY,
+    }
+
+def _service_headers() -> dict[str, str]:
+    return {
+        "Authorization": f"Bearer {SUPABASE_SERVICE_KEY}",
+        "apiKey": SUPABASE_SERVICE_KEY,
+    }
+
+def _async_http() -> httpx.AsyncClient:
+    # Created on first use, inside the running event loop
+    global _async_storage_http
+    if _async_storage_http is None:
+        _async_storage_http = httpx.AsyncClient(
+            limits=STORAGE_HTTP_LIMITS,
+            timeout=STORAGE_HTTP_TIMEOUT,
+            follow_redirects=True,
+            http2=True,
+        )
+    return _async_storage_http
+
+def supabase_for_user(user_jwt: str, schema: str = "public") -> SyncPostgrestClient:
+    # PostgREST under user identity (RLS applies), over the shared connection pool. The schema is set here because
+    # 'SyncPostgrestClient.schema()' builds a new client with its own connections
+    return SyncPostgrestClient(
+        REST_URL,
+        schema=schema,
+        headers={**DEFAULT_POSTGREST_CLIENT_HEADERS, **_user_headers(user_jwt)},
+        http_client=storage_http,
     )
 
+def storage_for_user(user_jwt: str) -> StorageClient:
+    # Storage calls under user identity (RLS applies), over the shared connection pool
+    return StorageClient(STORAGE_URL, headers=_user_headers(user_jwt), http_client=storage_http)
+
+def async_storage_for_user(user_jwt: str) -> AsyncStorageClient:
+    """Async version of 'storage_for_user', over a shared async connection pool."""
+    return AsyncStorageClient(STORAGE_URL, headers=_user_headers(user_jwt), http_client=_async_http())
+
+def async_storage_for_service() -> AsyncStorageClient:
+    """Storage calls with the service key (no RLS) for the public endpoints, over the same shared async pool."""
+    return AsyncStorageClient(STORAGE_URL, headers=_service_headers(), http_client=_async_http())
+
+async def close_storage_http():
+    """Close the shared connection pools, from the 'lifespan' shutdown."""
+    global _async_storage_http
+    if _async_storage_http is not None:
+        await _async_storage_http.aclose()
+        _async_storage_http = None
+    storage_http.close()
+
 supabase_for_service = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
-    
\ No newline at end of file
+
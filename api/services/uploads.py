@@ -0,0 +1,72 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+from dataclasses import dataclass
+from io import BufferedReader
+from typing import Optional
+
+from fastapi import HTTPException, UploadFile
+
+from config import settings
+
+"""
+THE PURPOSE OF THIS FILE IS TO GET UPLOADED FILES TO STORAGE WITHOUT EVER HOLDING A WHOLE FILE IN MEMORY. AN UPLOAD
+IS READ IN CHUNKS INTO A TEMP FILE ON DISK, CHECKING THE SIZE LIMIT AND HASHING AS IT GOES, AND THE TEMP FILE IS THEN
+HANDED TO THE STORAGE CLIENT AS AN OPEN FILE, WHICH IT STREAMS IN THE REQUEST BODY.
+
+ALWAYS 'close()' A StagedUpload WHEN DONE WITH IT (OR USE IT AS A CONTEXT MANAGER), THAT DELETES THE TEMP FILE
+"""
+
+MAX_UPLOAD_BYTES = settings.max_upload_bytes
+UPLOAD_CHUNK_BYTES = 256 * 1024 # Memory per upload in flight is about one chunk
+
+
+@dataclass
+class StagedUpload:
+    path: str # Temp file holding the upload
+    size_bytes: int
+    sha256: str
+    mime_type: Optional[str]
+
+    def open(self) -> BufferedReader:
+        return open(self.path, "rb")
+
+    def close(self):
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self) -> "StagedUpload":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+async def stage_upload(upload: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES) -> StagedUpload:
+    """
+    Copy an upload to a temp file a chunk at a time, hashing it on the way.
+    Raises a 413 as soon as it goes over 'max_bytes' and a 400 if it's empty.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    fd, path = tempfile.mkstemp(prefix="upload-")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while chunk := await upload.read(UPLOAD_CHUNK_BYTES):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(status_code=413, detail=f"File is too large, the limit is {max_bytes // (1024 * 1024)} MB")
+                digest.update(chunk)
+                await asyncio.to_thread(out.write, chunk)
+    except BaseException:
+        os.unlink(path)
+        raise
+
+    if size == 0:
+        os.unlink(path)
+        raise HTTPException(status_code=400, detail="Empty file uploaded")
+
+    return StagedUpload(path=path, size_bytes=size, sha256=digest.hexdigest(), mime_type=upload.content_type)